@@ -3,9 +3,36 @@
 Manejador de clientes TCP para PsicoIA.
 
 - Cada cliente tiene su propia coroutine `handle_client`, asegurando aislamiento de estados.
-- Implementa control de tasa por usuario con `SlidingWindowLimiter`.
-- Usa un semáforo global para limitar solicitudes simultáneas al LLM.
-- Proporciona trazabilidad detallada en logs con identificadores únicos por mensaje.
+- Implementa control de tasa global por IP, y además por sesión con `RATE_KEY=session`
+  (`RateLimiterRegistry`, GCRA): reconectar o cambiar de sesión no reinicia el límite.
+- Admite pedidos al LLM con un scheduler justo (`FairScheduler`): tope global y por
+  cliente (IP, no conexión), cola acotada y carril prioritario para mensajes de riesgo.
+- Clasifica cada mensaje localmente (`app.services.risk`, microsegundos): las palabras de
+  alarma van al carril prioritario y, la primera vez en la conexión, reciben al instante
+  una respuesta de contención (`CRISIS_REPLY`), que sale antes que las respuestas todavía
+  pendientes de mensajes anteriores.
+- Cada conexión tiene tres partes: el lector (esta coroutine) clasifica y encola los
+  mensajes apenas llegan, un worker hace los turnos con el LLM de a uno (la historia es
+  secuencial) y un escritor envía las respuestas en el orden de los mensajes; un cliente
+  lento para leer no frena la lectura ni el turno siguiente.
+- Con `PIPELINE_COALESCE_MS`, los mensajes escritos seguidos van juntos en un solo turno.
+  Más de `PIPELINE_MAX_PENDING` mensajes en espera se rechazan; los de riesgo tienen un tope
+  aparte, más alto (`_URGENT_MAX`), y al pasarlo reciben la contención en vez del rechazo.
+- Si el cliente se desconecta (EOF), el pedido al LLM en curso se cancela en el momento y
+  los mensajes en espera se descartan: no se gasta cuota en respuestas que nadie va a leer.
+- Libera la sesión (historia en RAM) cuando el cliente se desconecta.
+- Acepta `\\x01resume <token>` (enviado por el gateway) para retomar una
+  conversación previa y responde `\\x01session <token>` con la asignada.
+- Acepta `\\x01prompt <nombre>` para elegir el system prompt de la conexión
+  (registro `app.services.prompts`; un nombre desconocido deja el default).
+- Las líneas de control (`resume`, `prompt`, `peer`) sólo se aceptan de `TRUSTED_PROXIES`
+  (IPs, redes CIDR o nombres de host): un cliente TCP directo queda con la conversación
+  anónima que le asigna el servidor.
+  `peer` y `prompt` valen una vez y antes del primer mensaje de chat.
+- Proporciona trazabilidad detallada en logs con identificadores únicos por mensaje
+  (campo `trace_id`; las líneas por mensaje se formatean fuera del event loop).
+- Con `LLM_STREAM` activo, reenvía los deltas del LLM como líneas enmarcadas
+  (ver `app.protocol`) a medida que llegan.
 """
 
 # Importaciones necesarias
@@ -13,94 +40,555 @@ import asyncio  # Para concurrencia asíncrona
 import itertools  # Para generar identificadores únicos
 import time  # Para medir latencia
 from app.config import settings  # Configuración del proyecto
-from app.utils.logger import get_logger  # Logger configurado
-from app.utils.rate_limiter import SlidingWindowLimiter  # Limitador de tasa
-from app.services.llm_client import llm_generate  # Cliente para el LLM
+from app.utils import metrics  # Métricas del proceso
+from app.utils.logger import get_logger, trace_fields  # Logger configurado (campos por mensaje)
+from app.utils.diagnostics import add_span, record_spans, span, start_spans, take_spans  # Tramos por mensaje
+from app.utils.rate_limiter import rate_limiter_from_settings  # Limitador de tasa global
+from app.utils.scheduler import FairScheduler  # Admisión justa hacia el LLM
+from app.utils.proxies import TrustedProxies, is_internal  # Gateways de confianza (IP, CIDR o host)
+from app.services.risk import RISK, classifier, classify  # Categorías del mensaje (riesgo → prioridad)
+from app.prompts.promptgeneral import CRISIS_REPLY  # Contención inmediata ante palabras de alarma
+from app.services.llm_client import llm_generate, llm_stream, release_session  # Cliente para el LLM
+from app.services.prompts import prompts  # System prompts disponibles
+from app.protocol import (  # Framing de streaming y control de sesión
+    CONTROL, encode_chunk, encode_control, encode_end,
+    is_session_token, new_session_token, parse_control,
+)
 
 # Logger para este módulo
 log = get_logger("client")
-# Semáforo global para limitar solicitudes simultáneas al LLM
-SEM_GLOBAL = asyncio.Semaphore(settings.MAX_IN_FLIGHT)
+# Scheduler global: limita solicitudes simultáneas al LLM (total y por cliente) con cola justa
+SCHEDULER = FairScheduler(
+    capacity=int(settings.MAX_IN_FLIGHT or 20),
+    per_user_max=int(getattr(settings, "PER_USER_MAX", None) or 2),
+    max_queue=int(getattr(settings, "QUEUE_MAX", None) or 100),
+)
+# Limitador de tasa del proceso (o compartido entre workers con RATE_BACKEND=shm)
+RATE_LIMITS = rate_limiter_from_settings()
+# Límite de tasa: "session" (IP y además la sesión retomada, si hay) o "ip" (sólo IP)
+RATE_KEY = (getattr(settings, "RATE_KEY", None) or "session").lower()
+# Gateways/proxies de los que se aceptan líneas de control (`resume`, `prompt`, `peer`):
+# IPs, redes CIDR o nombres de host (p. ej. `gateway` en el compose)
+TRUSTED_PROXIES = TrustedProxies(getattr(settings, "TRUSTED_PROXIES", None) or "127.0.0.1,::1")
+# Respuesta de contención local ante palabras de alarma (antes de la del modelo)
+CRISIS_REPLY_ENABLED = getattr(settings, "CRISIS_REPLY_ENABLED", None) is not False
+# Mensajes de una conexión esperando turno (los que exceden se rechazan)
+MAX_PENDING = int(getattr(settings, "PIPELINE_MAX_PENDING", None) or 8)
+# Ventana para juntar mensajes escritos seguidos en un turno (0 = uno por turno)
+COALESCE_S = float(getattr(settings, "PIPELINE_COALESCE_MS", None) or 0) / 1000
+# Respuestas de una conexión esperando al escritor (más: el lector deja de leer)
+_OUTBOX_MAX = 2 * MAX_PENDING
+# Mensajes en espera a partir de los cuales también se rechazan los de riesgo (con contención)
+_URGENT_MAX = MAX_PENDING + max(1, MAX_PENDING // 2)
 # Generador de identificadores únicos para usuarios
 USER_SEQ = itertools.count(1)  # Usuario-1, Usuario-2, ...
+# Conexiones activas en este proceso: tarea `handle_client` → writer (el apagado ordenado las espera)
+active_clients: dict[asyncio.Task, asyncio.StreamWriter] = {}
 
-async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+# --- Métricas (contadores en memoria; los gauges se calculan al scrapear) ---
+metrics.gauge("psicoia_connections_active", "Conexiones de clientes abiertas", fn=lambda: len(active_clients))
+metrics.gauge("psicoia_scheduler_in_flight", "Requests al LLM en curso", fn=lambda: SCHEDULER.in_flight)
+metrics.gauge("psicoia_scheduler_queued", "Mensajes esperando lugar hacia el LLM", fn=lambda: SCHEDULER.stats()["queued"])
+_MESSAGES = metrics.counter("psicoia_messages_total", "Mensajes de usuario recibidos")
+_TAGS = metrics.counter("psicoia_message_tags_total", "Mensajes por categoría de palabras clave", ("category",))
+_TAG_COUNTERS = {category: _TAGS.labels(category) for category in classifier.categories}
+_CRISIS_REPLIES = metrics.counter("psicoia_crisis_replies_total", "Respuestas de contención locales enviadas")
+_PENDING_REJECTED = metrics.counter("psicoia_pending_rejected_total",
+                                    "Mensajes rechazados por exceder los pendientes de la conexión")
+_COALESCED = metrics.counter("psicoia_messages_coalesced_total", "Mensajes sumados al turno de un mensaje anterior")
+_ABANDONED = metrics.counter("psicoia_messages_abandoned_total",
+                             "Mensajes descartados por desconexión del cliente (en curso: pedido al LLM cancelado)",
+                             ("stage",))
+_ABANDONED_IN_FLIGHT = _ABANDONED.labels("in_flight")
+_ABANDONED_QUEUED = _ABANDONED.labels("queued")
+_RATE_LIMITED = metrics.counter("psicoia_rate_limited_total", "Mensajes rechazados por límite de tasa")
+_QUEUE_REJECTED = metrics.counter("psicoia_queue_rejected_total", "Mensajes rechazados con la cola llena")
+_QUEUE_WAIT = metrics.histogram("psicoia_queue_wait_seconds", "Espera en la cola del scheduler", ("lane",))
+_QUEUE_WAIT_NORMAL = _QUEUE_WAIT.labels("normal")
+_QUEUE_WAIT_URGENT = _QUEUE_WAIT.labels("urgent")
+_TTFB = metrics.histogram("psicoia_ttfb_seconds", "Tiempo hasta el primer byte de respuesta (sin la cola)")
+_RESPONSE = metrics.histogram("psicoia_response_seconds", "Tiempo total de respuesta por mensaje (sin la cola)")
+
+class _Reply:
     """
-    Maneja la conexión de un cliente TCP.
+    Salida hacia el cliente de un mensaje, en el lugar que le tocó al llegar.
 
-    - Lee mensajes del cliente y envía respuestas generadas por el LLM.
-    - Implementa control de tasa y concurrencia segura.
-    - Registra trazabilidad detallada en logs.
+    - El lector (rechazos, contención) o el worker (respuesta del LLM) le agregan bytes y
+      la cierran; el escritor la envía cuando terminó con la anterior.
+    - Si es la respuesta de un turno (`trace_id`), el escritor registra el tiempo de
+      respuesta y los tramos después de escribirla.
     """
-    # Obtener información del cliente y asignar un identificador único
-    peer = writer.get_extra_info("peername")
-    user = f"Usuario-{next(USER_SEQ)}"
-    msg_counter = itertools.count(1)  # Contador de mensajes por conexión
-    log.info(f"[{user}] Conexión desde {peer}")
-
-    # Crear un limitador de tasa para este usuario
-    limiter = SlidingWindowLimiter(
-        settings.RATE_MAX_MESSAGES, settings.RATE_WINDOW_SECONDS
-    )
+    __slots__ = ("chunks", "trace_id", "t0", "spans", "ok", "write_s")
 
-    # Enviar mensaje de bienvenida al cliente
-    greeting = (
-        f"{user} conectado.\n"
-        "Bienvenido a PsicoIA.\n"
-        "Contame cómo te sentís hoy. Escribí 'salir' para cerrar.\n"
-    )
-    writer.write(greeting.encode("utf-8"))
-    await writer.drain()
+    def __init__(self, data: bytes | None = None):
+        self.chunks: asyncio.Queue[bytes | None] = asyncio.Queue()
+        self.trace_id: str | None = None
+        self.t0 = 0.0
+        self.spans: dict | None = None
+        self.ok = False  # El LLM respondió (cuenta en `psicoia_response_seconds`)
+        self.write_s = 0.0  # Tiempo escribiendo al cliente
+        if data is not None:
+            self.put(data)
+            self.close()
 
-    try:
+    def put(self, data: bytes) -> None:
+        self.chunks.put_nowait(data)
+
+    def close(self) -> None:
+        self.chunks.put_nowait(None)
+
+    def finish(self) -> None:
+        """
+        Escrita por completo: registra el tiempo de respuesta y los tramos del turno.
+        """
+        if self.trace_id is None:
+            return
+        total = time.perf_counter() - self.t0
+        if self.ok:
+            _RESPONSE.observe(total)
+        if self.spans is not None:
+            self.spans["write"] = self.spans.get("write", 0.0) + self.write_s
+            record_spans(self.spans, self.trace_id, total)
+
+class _Message:
+    """
+    Mensaje de usuario esperando turno, con la sesión y el prompt vigentes al llegar.
+    """
+    __slots__ = ("text", "urgent", "conversation_id", "prompt", "reply", "arrived")
+
+    def __init__(self, text: str, urgent: bool, conversation_id: str, prompt: str | None, reply: _Reply):
+        self.text = text
+        self.urgent = urgent
+        self.conversation_id = conversation_id
+        self.prompt = prompt
+        self.reply = reply
+        self.arrived = time.monotonic()
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Estado de una conexión y las colas entre lector, worker y escritor.
+
+        - `inbox`: mensajes esperando turno (None = no hay más).
+        - `outbox`: respuestas en el orden de los mensajes (None = cerrar); acotada, para que
+          un cliente que no lee frene la lectura en vez de acumular memoria.
+        - `priority`: bytes que el escritor envía antes que la próxima respuesta que todavía
+          no empezó a escribir (la contención no espera a las respuestas anteriores).
+        """
+        self.reader = reader
+        self.writer = writer
+        # Obtener información del cliente y asignar un identificador único
+        self.peer = writer.get_extra_info("peername")
+        self.user = f"Usuario-{next(USER_SEQ)}"
+        self.msg_counter = itertools.count(1)  # Contador de turnos por conexión
+        # Conversación asociada: anónima (`user`) salvo que el gateway pida retomar una
+        self.conversation_id = self.user
+        # System prompt elegido por la conexión (None = PROMPT_DEFAULT)
+        self.prompt_name: str | None = None
+        # Ya se envió la respuesta de contención en esta conexión
+        self.crisis_sent = False
+        # IP del cliente para el límite de tasa (el gateway puede informar la del navegador)
+        self.client_ip = self.peer[0] if isinstance(self.peer, tuple) and self.peer else "desconocida"
+        # Sólo un gateway/proxy de confianza puede elegir sesión, prompt o IP real
+        # (`handle_client` lo decide con `TRUSTED_PROXIES` antes de leer)
+        self.trusted = False
+        # Proxy interno que no es de confianza: su IP la comparten todos sus navegadores
+        self.shared_ip = False
+        # Líneas de control ya aplicadas (`peer` y `prompt` valen una vez, antes del chat)
+        self.controls: set[str] = set()
+        # Ya llegó un mensaje de chat: la IP y el prompt de la conexión quedan fijos
+        self.chatting = False
+        self.inbox: asyncio.Queue[_Message | None] = asyncio.Queue()
+        self.outbox: asyncio.Queue[_Reply | None] = asyncio.Queue(_OUTBOX_MAX)
+        self.priority: list[bytes] = []
+        self.writing: _Reply | None = None  # Respuesta que está enviando el escritor
+        self.held: list[_Message | None] = []  # Sacado de `inbox` para el turno siguiente
+        self.batch: list[_Message] = []  # Mensajes del turno que se está armando o en curso
+        self.in_flight = 0  # Mensajes del turno en curso (0 = worker libre)
+        self.worker: asyncio.Task | None = None
+        self.sender: asyncio.Task | None = None
+
+    @property
+    def client_key(self) -> str:
+        """
+        Identidad del cliente para el scheduler y el límite de tasa: su IP (la del navegador,
+        vía el gateway).
+
+        - No depende de la conexión: abrir varios sockets no le da más lugares hacia el LLM
+          ni más turnos en la cola justa.
+        - Detrás de un gateway interno que no está en `TRUSTED_PROXIES` (`shared_ip`), la IP es
+          la del gateway, común a todos los navegadores: en ese caso la clave es la conexión,
+          para no poner a todos en un solo límite de tasa y en los mismos lugares del scheduler.
+        """
+        if self.shared_ip:
+            return f"conn:{self.user}"
+        return f"ip:{self.client_ip}"
+
+    def start(self) -> None:
+        self.worker = asyncio.create_task(self.work())
+        self.sender = asyncio.create_task(self.write())
+
+    # --- Lector ---
+
+    async def read(self) -> bool:
+        """
+        Lee y encola mensajes hasta 'salir' (True) o EOF (False).
+        """
         while True:
             # Leer mensaje del cliente
-            data = await reader.readline()
+            data = await self.reader.readline()
             if not data:
-                break
+                return False
 
             msg = data.decode().strip()
+            if msg.startswith(CONTROL):
+                await self._control(msg)
+                continue
+            self.chatting = True
+
             if msg.lower() == "salir":
-                # Cerrar la conexión si el cliente escribe 'salir'
-                writer.write("Gracias por usar PsicoIA. Cuidate!\n".encode("utf-8"))
-                await writer.drain()
+                # Despedirse después de las respuestas pendientes
+                await self.outbox.put(_Reply("Gracias por usar PsicoIA. Cuidate!\n".encode("utf-8")))
+                return True
+
+            await self._accept(msg)
+
+    async def _control(self, msg: str) -> None:
+        """
+        Línea de control del gateway: retomar (o iniciar) una conversación, IP real o prompt.
+
+        - Sólo de `TRUSTED_PROXIES`: de otro cliente, cualquier token elegido por él pasaría
+          a ser su conversación.
+        - `peer` y `prompt` valen una sola vez y antes del primer mensaje de chat: si una
+          línea del navegador se colara como control, no podría rotar la IP (y con ella el
+          límite de tasa y los lugares del scheduler) ni cambiar el prompt a mitad de charla.
+        """
+        command, arg = parse_control(msg)
+        user = self.user
+        if not self.trusted:
+            log.warning("[%s] Control %r de un cliente que no es proxy de confianza; se ignora", user,
+                        command[:16], extra=trace_fields(user))
+            if command == "peer" and not (self.shared_ip or self.chatting) and is_internal(self.client_ip):
+                # Un gateway en la red interna sin configurar: no juntar a sus navegadores por IP
+                self.shared_ip = True
+                log.warning("[%s] %s informa IPs de navegadores pero no está en TRUSTED_PROXIES; "
+                            "límites por conexión", user, self.client_ip, extra=trace_fields(user))
+        elif command in ("peer", "prompt") and (self.chatting or command in self.controls):
+            log.warning("[%s] Control %r repetido o después del chat; se ignora", user, command,
+                        extra=trace_fields(user))
+        elif command == "resume" and self.conversation_id != user:
+            # La conversación se fija una vez por conexión (ni el límite ni la historia rotan)
+            log.warning("[%s] Segundo resume en la conexión; se ignora", user, extra=trace_fields(user))
+        elif command == "resume":
+            resumed = is_session_token(arg)
+            self.conversation_id = arg if resumed else new_session_token()
+            await self.outbox.put(_Reply(encode_control("session", self.conversation_id)))
+            log.info("[%s] Sesión %s %s…", user, "retomada" if resumed else "nueva", self.conversation_id[:6],
+                     extra=trace_fields(user))
+        elif command == "peer" and arg:
+            self.controls.add(command)
+            self.client_ip = arg
+        elif command == "prompt":
+            self.controls.add(command)
+            if arg in prompts:
+                self.prompt_name = arg
+            else:
+                log.warning("[%s] Prompt desconocido %r; se usa el default", user, arg[:64],
+                            extra=trace_fields(user))
+
+    async def _accept(self, msg: str) -> None:
+        """
+        Clasifica el mensaje, le reserva su lugar en la salida y lo encola (o lo rechaza).
+        """
+        user = self.user
+        _MESSAGES.inc()
+        # Clasificación local: categorías del mensaje (contadores, prioridad, contención)
+        tags = classify(msg)
+        for category in tags:
+            _TAG_COUNTERS[category].inc()
+        urgent = RISK in tags  # Mensajes de riesgo: carril prioritario, tope de pendientes aparte
+        if urgent and CRISIS_REPLY_ENABLED and not self.crisis_sent:
+            # Contención inmediata, sin esperar límite de tasa, cola, modelo ni las respuestas
+            # pendientes de mensajes anteriores
+            self.crisis_sent = True
+            self._send_first((CRISIS_REPLY + "\n").encode("utf-8"))
+            log.info("[%s] Palabras de alarma: respuesta de contención enviada", user, extra=trace_fields(user))
+        reply = _Reply()
+        await self.outbox.put(reply)
+
+        # Límite siempre por IP (un token nuevo no lo reinicia) y, si hay sesión, también por
+        # sesión; nunca por conexión
+        allowed = RATE_LIMITS.allow(self.client_key)
+        if allowed and RATE_KEY == "session" and self.conversation_id != user:
+            allowed = RATE_LIMITS.allow(f"session:{self.conversation_id}")
+        if not allowed:
+            _RATE_LIMITED.inc()
+            # Responder con un mensaje de límite de tasa si se excede
+            reply.put("Tranca, demasiados mensajes seguidos. Probá en unos segundos.\n".encode("utf-8"))
+            reply.close()
+            return
+
+        if urgent and self.inbox.qsize() >= _URGENT_MAX:
+            _PENDING_REJECTED.inc()
+            # Ni un mensaje de riesgo espera sin límite; en vez del rechazo, la contención
+            _CRISIS_REPLIES.inc()
+            reply.put((CRISIS_REPLY + "\n").encode("utf-8"))
+            reply.close()
+            return
+        if not urgent and self.inbox.qsize() >= MAX_PENDING:
+            _PENDING_REJECTED.inc()
+            # Demasiados mensajes sin responder en esta conexión
+            reply.put("Esperá mi respuesta antes de mandar más mensajes.\n".encode("utf-8"))
+            reply.close()
+            return
+
+        self.inbox.put_nowait(_Message(msg, urgent, self.conversation_id, self.prompt_name, reply))
+
+    def _send_first(self, data: bytes) -> None:
+        """
+        Respuesta ya completa que sale antes que las pendientes (contención).
+
+        - El escritor la envía antes de la próxima respuesta que todavía no empezó a escribir,
+          incluida la que está esperando al modelo; una respuesta a medio enviar (streaming)
+          no se corta, para no mezclar sus líneas.
+        - Un `b""` en la respuesta en curso despierta al escritor si estaba esperándola.
+        """
+        _CRISIS_REPLIES.inc()
+        self.priority.append(data)
+        if self.writing is not None:
+            self.writing.put(b"")
+
+    # --- Worker ---
+
+    async def work(self) -> None:
+        """
+        Turnos con el LLM de a uno, en orden de llegada (cada uno ve la historia del anterior).
+        """
+        try:
+            while (batch := await self._next_batch()) is not None:
+                self.in_flight = len(batch)
+                try:
+                    await self._turn(batch)
+                finally:
+                    self.in_flight = 0
+                    self.batch = []
+        except Exception as e:
+            # Error inesperado: cerrar la conexión (el lector ve EOF)
+            log.exception("[%s] Error: %s", self.user, e, extra=trace_fields(self.user))
+            self.writer.close()
+
+    async def _next_batch(self) -> list[_Message] | None:
+        """
+        Mensajes del próximo turno (None = no hay más).
+
+        - Sin `COALESCE_S`, uno por turno.
+        - Con `COALESCE_S`, el más viejo y los que llegaron hasta `COALESCE_S` después que él
+          (de la misma sesión y prompt); los que se acumularon durante el turno anterior ya
+          cumplen el plazo.
+        """
+        first = self.held.pop() if self.held else await self.inbox.get()
+        if first is None:
+            return None
+        self.batch = batch = [first]
+        if not COALESCE_S:
+            return batch
+        deadline = first.arrived + COALESCE_S
+        while len(batch) < MAX_PENDING:
+            if not self.inbox.empty():
+                message = self.inbox.get_nowait()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(self.inbox.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if message is None or message.conversation_id != first.conversation_id or message.prompt != first.prompt:
+                self.held.append(message)
                 break
+            batch.append(message)
+        return batch
 
-            if not limiter.allow():
-                # Responder con un mensaje de límite de tasa si se excede
-                writer.write(
-                    "Tranca, demasiados mensajes seguidos. Probá en unos segundos.\n".encode("utf-8")
-                )
-                await writer.drain()
-                continue
+    async def _turn(self, batch: list[_Message]) -> None:
+        """
+        Un pedido al LLM con los mensajes de `batch`; la respuesta va en el lugar del último.
+        """
+        user = self.user
+        for message in batch[:-1]:
+            message.reply.close()
+        reply = batch[-1].reply
+        msg = batch[0].text if len(batch) == 1 else "\n".join(message.text for message in batch)
+        urgent = any(message.urgent for message in batch)
+        conversation_id, prompt_name = batch[0].conversation_id, batch[0].prompt
+        if len(batch) > 1:
+            _COALESCED.inc(len(batch) - 1)
+        try:
+            if not SCHEDULER.has_room(urgent):
+                _QUEUE_REJECTED.inc()
+                # Cola llena: rechazar rápido en vez de hacer esperar sin límite
+                reply.put("Hay mucha demanda en este momento. Probá de nuevo en unos segundos.\n".encode("utf-8"))
+                return
 
-            async with SEM_GLOBAL:
+            async with SCHEDULER.slot(self.client_key, urgent=urgent) as queue_wait:
                 """
                 Manejo de concurrencia y trazabilidad:
-                - `trace_id` vincula cada solicitud al LLM con el usuario y número de mensaje.
+                - `trace_id` vincula cada solicitud al LLM con el usuario y número de turno.
                 - Permite identificar en los logs a qué usuario corresponde cada solicitud.
+                - `queue_wait` es el tiempo que el pedido esperó en la cola del scheduler.
+                - Con diagnóstico activo, los tramos (cola/HTTP/JSON/escritura) quedan ligados al
+                  `trace_id`; el escritor los registra después de enviar la respuesta.
                 """
-                trace_id = f"{user}:m{next(msg_counter)}"
+                trace_id = f"{user}:m{next(self.msg_counter)}"
+                (_QUEUE_WAIT_URGENT if urgent else _QUEUE_WAIT_NORMAL).observe(queue_wait)
+                spans = start_spans()
+                add_span("queue", queue_wait)
 
                 t0 = time.perf_counter()  # Marcar tiempo de inicio
-                log.info(f"[{trace_id}] → LLM start (len={len(msg)})")
+                reply.trace_id, reply.t0 = trace_id, t0
+                log.info(
+                    "[%s] → LLM start (len=%d) cola=%.0f ms%s%s", trace_id, len(msg), queue_wait * 1000,
+                    " prioridad" if urgent else "", f" ({len(batch)} mensajes)" if len(batch) > 1 else "",
+                    extra=trace_fields(trace_id),
+                )
+
+                try:
+                    if settings.LLM_STREAM:
+                        # Pasar cada delta al escritor apenas llega; el cliente arma la respuesta
+                        ttft_ms = None
+                        chars = 0
+                        async for delta in llm_stream(msg, trace_id=trace_id, conversation_id=conversation_id,
+                                                    prompt=prompt_name):
+                            if ttft_ms is None:
+                                ttft_ms = (time.perf_counter() - t0) * 1000
+                                _TTFB.observe(ttft_ms / 1000)
+                            chars += len(delta)
+                            reply.put(encode_chunk(delta))
+                        reply.put(encode_end())
 
-                # Generar respuesta del LLM usando el historial del usuario
-                llm_reply = await llm_generate(msg, trace_id=trace_id, conversation_id=user)
+                        dt_ms = (time.perf_counter() - t0) * 1000
+                        log.info("[%s] ← LLM stream ok (%d chars) ttft=%.0f ms total=%.0f ms", trace_id, chars,
+                                 ttft_ms or dt_ms, dt_ms, extra=trace_fields(trace_id))
+                    else:
+                        # Generar respuesta del LLM usando el historial del usuario
+                        llm_reply = await llm_generate(msg, trace_id=trace_id, conversation_id=conversation_id,
+                                                       prompt=prompt_name)
 
-                dt_ms = (time.perf_counter() - t0) * 1000  # Calcular latencia
-                log.info(f"[{trace_id}] ← LLM ok ({len(llm_reply)} chars) {dt_ms:.0f} ms")
+                        dt_ms = (time.perf_counter() - t0) * 1000  # Calcular latencia
+                        _TTFB.observe(dt_ms / 1000)  # Sin streaming, el primer byte es la respuesta entera
+                        log.info("[%s] ← LLM ok (%d chars) %.0f ms", trace_id, len(llm_reply), dt_ms,
+                                 extra=trace_fields(trace_id))
+                        reply.put((llm_reply + "\n").encode("utf-8"))
+                    reply.ok = True
+                finally:
+                    reply.spans = take_spans(spans)
+        finally:
+            reply.close()
 
-                # Enviar respuesta al cliente
-                out = f"{llm_reply}"
-                writer.write((out + "\n").encode("utf-8"))
-                await writer.drain()
+    # --- Escritor ---
+
+    async def write(self) -> None:
+        """
+        Envía las respuestas en orden; lo que ya está disponible de una respuesta sale en una
+        sola escritura.
+        """
+        try:
+            while (reply := await self.outbox.get()) is not None:
+                self.writing = reply
+                started = False
+                done = False
+                while not done:
+                    if self.priority and not started:
+                        # Contención: antes que esta respuesta, que todavía no empezó
+                        data, self.priority = b"".join(self.priority), []
+                        self.writer.write(data)
+                        await self.writer.drain()
+                    chunks = [await reply.chunks.get()]
+                    while not reply.chunks.empty():
+                        chunks.append(reply.chunks.get_nowait())
+                    done = chunks[-1] is None
+                    if done:
+                        chunks.pop()
+                    data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+                    if data:
+                        started = True
+                        t0 = time.perf_counter()
+                        self.writer.write(data)
+                        await self.writer.drain()
+                        reply.write_s += time.perf_counter() - t0
+                self.writing = None
+                reply.finish()
+        except ConnectionError:
+            # El cliente se fue: cerrar para que el lector vea EOF y corte el resto, y seguir
+            # vaciando la salida para que el lector nunca quede esperando lugar en ella
+            self.writer.close()
+            while await self.outbox.get() is not None:
+                pass
+
+    def stop(self) -> None:
+        """
+        Corta el worker y el escritor: cancela el pedido al LLM en curso y descarta los
+        mensajes en espera (no-op si ya terminaron).
+        """
+        in_flight = self.in_flight if not self.worker.done() else 0
+        queued = 0 if in_flight or self.worker.done() else len(self.batch)
+        queued += sum(1 for message in self.held if message is not None)
+        while not self.inbox.empty():
+            queued += self.inbox.get_nowait() is not None
+        if in_flight or queued:
+            _ABANDONED_IN_FLIGHT.inc(in_flight)
+            _ABANDONED_QUEUED.inc(queued)
+            log.info("[%s] Cliente desconectado: %d mensajes en curso cancelados, %d en espera descartados",
+                     self.user, in_flight, queued, extra=trace_fields(self.user))
+        self.worker.cancel()
+        self.sender.cancel()
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Maneja la conexión de un cliente TCP.
+
+    - Envía el saludo, arranca el worker y el escritor de la conexión y lee mensajes
+      hasta 'salir' o EOF.
+    - Con 'salir', responde los mensajes pendientes y se despide.
+    - Con EOF (el cliente se fue), cancela el pedido al LLM en curso y descarta el resto.
+    - Registra trazabilidad detallada en logs.
+    """
+    active_clients[asyncio.current_task()] = writer
+    conn = _Connection(reader, writer)
+    conn.trusted = await TRUSTED_PROXIES.contains(conn.client_ip)
+    user = conn.user
+    log.info("[%s] Conexión desde %s", user, conn.peer, extra=trace_fields(user))
+
+    # Enviar mensaje de bienvenida al cliente
+    greeting = (
+        f"{user} conectado.\n"
+        "Bienvenido a PsicoIA.\n"
+        "Contame cómo te sentís hoy. Escribí 'salir' para cerrar.\n"
+    )
+    writer.write(greeting.encode("utf-8"))
+    await writer.drain()
+
+    conn.start()
+    try:
+        if await conn.read():
+            # 'salir': terminar los turnos pendientes y enviar todo antes de cerrar
+            conn.inbox.put_nowait(None)
+            await conn.outbox.put(None)
+            await asyncio.gather(conn.worker, conn.sender)
 
     except Exception as e:
         # Manejo de errores durante la conexión
-        log.exception(f"[{user}] Error: {e}")
+        log.exception("[%s] Error: %s", user, e, extra=trace_fields(user))
     finally:
-        # Cerrar la conexión y liberar recursos
-        writer.close()
-        await writer.wait_closed()
-        log.info(f"[{user}] Conexión cerrada")
+        conn.stop()
+        await asyncio.gather(conn.worker, conn.sender, return_exceptions=True)
+        try:
+            # Cerrar la conexión y liberar recursos (la historia persistida se conserva)
+            await release_session(conn.conversation_id, resumable=conn.conversation_id != user)
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+        finally:
+            active_clients.pop(asyncio.current_task(), None)
+            log.info("[%s] Conexión cerrada", user, extra=trace_fields(user))
@@ -1,12 +1,117 @@
-from pydantic_settings import BaseSettings
+"""
+Configuración del proyecto: variables de entorno y archivo `.env`.
 
-class Settings(BaseSettings):
+- Cada campo de `Settings` se lee de la variable de entorno del mismo nombre (sin distinguir
+  mayúsculas) o, si no está, de `.env`; el entorno tiene prioridad.
+- El texto se convierte según la anotación del campo (`int`, `float`, `bool`, `str`); un valor
+  inválido corta el arranque nombrando la variable. Vacío en un campo no-`str` = sin valor.
+- Sólo biblioteca estándar: importarla cuesta ~2 ms (con pydantic-settings eran ~130 ms por
+  proceso), así que el gateway la comparte sin cargar dependencias de la app.
+"""
+
+# Importaciones necesarias
+import os  # Variables de entorno
+
+# Archivo con valores por defecto (relativo al directorio de trabajo, como antes)
+ENV_FILE = ".env"
+# Textos aceptados para los campos `bool`
+_TRUE = {"1", "true", "t", "yes", "y", "on"}
+_FALSE = {"0", "false", "f", "no", "n", "off"}
+
+def read_env_file(path: str) -> dict[str, str]:
+    """
+    Lee `KEY=valor` de un archivo `.env` (vacío si no existe).
+
+    - Ignora líneas vacías y comentarios; acepta el prefijo `export `.
+    - Valores entre comillas simples o dobles se toman textuales; sin comillas, un ` #`
+      empieza un comentario.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    values = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[7:].lstrip()
+        key, sep, value = line.partition("=")
+        if not sep:
+            continue
+        value = value.strip()
+        if len(value) >= 2 and value[0] in "'\"" and value[-1] == value[0]:
+            value = value[1:-1]
+        else:
+            value = value.split(" #", 1)[0].rstrip()
+        values[key.strip().upper()] = value
+    return values
+
+def _convert(name: str, raw: str, annotation):
+    """Texto de la variable `name` → valor del tipo del campo (ValueError si no corresponde)."""
+    kind = next((t for t in getattr(annotation, "__args__", (annotation,)) if t is not type(None)), str)
+    if kind is str:
+        return raw
+    raw = raw.strip()
+    if not raw:
+        return None
+    if kind is bool:
+        if raw.lower() in _TRUE:
+            return True
+        if raw.lower() in _FALSE:
+            return False
+    else:
+        try:
+            return kind(raw)
+        except ValueError:
+            pass
+    raise ValueError(f"Configuración inválida: {name}={raw!r} no es {kind.__name__}")
+
+class Settings:
     APP_HOST: str | None = None
     APP_PORT: int | None = None
     MAX_IN_FLIGHT: int | None = None
     PER_USER_MAX: int | None = None
+    #Pedidos en espera hacia el LLM antes de rechazar (los de riesgo nunca se rechazan)
+    QUEUE_MAX: int | None = None
+    #Por conexión: mensajes en espera antes de rechazar y ventana para juntar mensajes seguidos en un turno (0 = no juntar)
+    PIPELINE_MAX_PENDING: int | None = None
+    PIPELINE_COALESCE_MS: float | None = None
+    #Procesos worker en el mismo puerto ("reuseport" o "shared") y plazo de apagado
+    APP_WORKERS: int | None = None
+    WORKER_BIND: str | None = None
+    WORKER_SHUTDOWN_TIMEOUT: float | None = None
+    #Puerto para links multiplexados del gateway (vacío = deshabilitado) y ventana por sesión en bytes
+    APP_MUX_PORT: int | None = None
+    MUX_WINDOW_BYTES: int | None = None
     RATE_WINDOW_SECONDS: int | None = None
     RATE_MAX_MESSAGES: int | None = None
+    #Límite de tasa global: clave "session" o "ip", backend "memory" o "shm" (compartido entre workers)
+    RATE_KEY: str | None = None
+    RATE_BACKEND: str | None = None
+    RATE_SHM_PATH: str | None = None
+    RATE_SHM_SLOTS: int | None = None
+    #Gateways de los que se acepta la IP real del navegador (IPs, redes CIDR o nombres de host)
+    TRUSTED_PROXIES: str | None = None
+    #Endpoint de métricas /metrics (vacío = deshabilitado; con workers, un puerto por worker)
+    METRICS_HOST: str | None = None
+    METRICS_PORT: int | None = None
+    #Logging: nivel, formato ("text" o "json"), escritura en un hilo aparte con cola acotada,
+    #política con la cola llena ("drop_new", "drop_old" o "block") y tope por línea repetida por segundo
+    LOG_LEVEL: str | None = None
+    LOG_FORMAT: str | None = None
+    LOG_ASYNC: bool | None = None
+    LOG_QUEUE_SIZE: int | None = None
+    LOG_DROP_POLICY: str | None = None
+    LOG_RATE_PER_KEY: int | None = None
+    #Diagnóstico del event loop (opt-in): lag, bloqueos con stack, tramos por mensaje y perfil con SIGUSR1
+    DIAG_ENABLED: bool = False
+    DIAG_LAG_INTERVAL_MS: float | None = None
+    DIAG_SLOW_CALLBACK_MS: float | None = None
+    DIAG_PROFILE_SECONDS: float | None = None
+    DIAG_PROFILE_DIR: str | None = None
 
     #GROQ_API_KEY se puede cambiar por otro proveedor de APIs
     GROQ_API_KEY: str | None = None
@@ -20,11 +125,79 @@ class Settings(BaseSettings):
     LLM_MAX_RETRIES: int | None = None
     LLM_BACKOFF_INITIAL: float | None = None
     LLM_BACKOFF_MAX: float | None = None
+    #Resiliencia: presupuesto de reintentos del proceso, circuit breaker y hedging
+    LLM_RETRY_BUDGET_RATIO: float | None = None
+    LLM_RETRY_BUDGET_MIN_PER_SEC: float | None = None
+    LLM_RETRY_BUDGET_MAX: float | None = None
+    LLM_BREAKER_FAILURE_RATE: float | None = None
+    LLM_BREAKER_MIN_REQUESTS: int | None = None
+    LLM_BREAKER_WINDOW: int | None = None
+    LLM_BREAKER_OPEN_SECONDS: float | None = None
+    LLM_HEDGE_URL: str | None = None
+    LLM_HEDGE_PERCENTILE: float | None = None
+    #Varios endpoints OpenAI-compatibles (lista JSON) y tope de concurrencia por endpoint
+    LLM_ENDPOINTS: str | None = None
+    LLM_ENDPOINT_MAX_CONCURRENCY: int | None = None
     LLM_HISTORY_MAX_MESSAGES: int | None = None
     LLM_INPUT_TOKEN_BUDGET: int | None = None
     LLM_CHARS_PER_TOKEN: int | None = None
+    #Tokenizador para el presupuesto: "chars" (heurística) o "bpe" (vocabulario local)
+    LLM_TOKENIZER: str | None = None
+    LLM_TOKENIZER_VOCAB: str | None = None
+    LLM_TOKEN_CACHE_SIZE: int | None = None
+
+    #Pool HTTP compartido hacia el LLM (keep-alive) y conexiones por endpoint a abrir al arrancar (0 = ninguna)
+    LLM_POOL_MAX_CONNECTIONS: int | None = None
+    LLM_POOL_MAX_KEEPALIVE: int | None = None
+    LLM_POOL_KEEPALIVE_EXPIRY: float | None = None
+    LLM_POOL_WARMUP: int | None = None
+    LLM_HTTP2: bool = False
+
+    #Resumen incremental de conversaciones largas (opt-in): umbral de tokens sin resumir,
+    #mensajes recientes que quedan textuales y largo máximo del resumen
+    LLM_SUMMARY_ENABLED: bool = False
+    LLM_SUMMARY_TRIGGER_TOKENS: int | None = None
+    LLM_SUMMARY_KEEP_MESSAGES: int | None = None
+    LLM_SUMMARY_MAX_TOKENS: int | None = None
+
+    #Respuesta de contención local e inmediata ante palabras de alarma (CRISIS_REPLY en promptgeneral.py)
+    CRISIS_REPLY_ENABLED: bool = True
+
+    #Caché de respuestas para conversaciones nuevas idénticas (opt-in)
+    LLM_CACHE_ENABLED: bool = False
+    LLM_CACHE_MAX_ENTRIES: int | None = None
+    LLM_CACHE_TTL_SECONDS: float | None = None
+    LLM_CACHE_VARIANTS: int | None = None
+    LLM_CACHE_PATH: str | None = None
+    LLM_CACHE_SKIP_RISK: bool | None = None
+
+    #Sesiones en memoria (historia + lock por conversación)
+    SESSION_MAX: int | None = None
+    SESSION_IDLE_TTL_SECONDS: float | None = None
+    SESSION_SWEEP_INTERVAL_SECONDS: float | None = None
+
+    #System prompts (módulos de app/prompts): el de las sesiones sin uno elegido y
+    #cada cuántos segundos se revisan los archivos para recargarlos (0 = sin recarga)
+    PROMPT_DEFAULT: str | None = None
+    PROMPT_RELOAD_INTERVAL_SECONDS: float | None = None
+
+    #Persistencia de historias: "memory" (sin persistencia) o "sqlite"
+    HISTORY_BACKEND: str | None = None
+    HISTORY_DB_PATH: str | None = None
+    HISTORY_FLUSH_INTERVAL_MS: int | None = None
+    HISTORY_BATCH_SIZE: int | None = None
+
+    #Streaming de tokens (SSE del LLM → TCP → WebSocket → navegador)
+    LLM_STREAM: bool = False
 
-    class Config:
-        env_file = ".env"
+    def __init__(self, env_file: str | None = ENV_FILE):
+        """
+        Carga los campos desde el entorno y `env_file` (None = sólo el entorno).
+        """
+        values = read_env_file(env_file) if env_file else {}
+        values.update((key.upper(), value) for key, value in os.environ.items())
+        for name, annotation in type(self).__annotations__.items():
+            if name in values:
+                setattr(self, name, _convert(name, values[name], annotation))
 
 settings = Settings()
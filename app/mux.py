@@ -0,0 +1,423 @@
+"""
+Multiplexado de sesiones gateway ↔ app sobre pocas conexiones TCP persistentes.
+
+- Cada conexión TCP ("link") transporta muchas sesiones; cada sesión equivale a
+  una conexión del protocolo de líneas (mismo contenido: saludo, respuestas,
+  `\\x02`/`\\x03`, `\\x01resume`...), así `handle_client` no cambia.
+- Frames con prefijo de largo: cabecera `!BII` = (tipo, id de sesión, largo) + payload.
+  - `OPEN`: el gateway abre una sesión nueva (ids impares crecientes, nunca se reusan).
+  - `DATA`: bytes de la sesión.
+  - `CREDIT`: el receptor habilita `n` bytes más de `DATA` para esa sesión (payload `!I`).
+  - `CLOSE`: cualquiera de los lados cierra la sesión (el otro ve EOF).
+- Control de flujo por sesión (como las ventanas de HTTP/2): nadie envía más bytes
+  de los que el otro lado puede guardar. Un navegador lento frena sólo su sesión
+  (su `drain()` espera créditos) y no bloquea el link para el resto.
+- Aislamiento: cada sesión tiene su propio buffer, su propia ventana y del lado
+  app su propio `handle_client` (y por lo tanto su propio `conversation_id`).
+- `MuxReader`/`MuxWriter` imitan la parte de `StreamReader`/`StreamWriter` que usan
+  `handle_client` y el gateway.
+- Sin dependencias del resto de `app` para que el gateway pueda importarlo.
+"""
+
+# Importaciones necesarias
+import asyncio  # Links TCP y tareas por sesión
+import itertools  # Ids de sesión
+import logging  # Logger sin depender de app.utils (lo importa el gateway)
+import struct  # Cabecera binaria de los frames
+from collections.abc import Awaitable, Callable  # Tipo del handler de sesiones
+
+# Logger para este módulo
+log = logging.getLogger("mux")
+
+# Tipos de frame
+OPEN = 1
+DATA = 2
+CREDIT = 3
+CLOSE = 4
+
+# Cabecera: tipo (1 byte), id de sesión (4 bytes), largo del payload (4 bytes)
+HEADER = struct.Struct("!BII")
+_CREDIT = struct.Struct("!I")
+
+# Ventana inicial por sesión y sentido; un receptor con más buffer la amplía con CREDIT
+DEFAULT_WINDOW = 64 * 1024
+# Payload máximo de un frame DATA (reparte el link entre sesiones)
+MAX_DATA_FRAME = 16 * 1024
+# Largo máximo aceptado de un frame (protege de un peer roto)
+MAX_FRAME = 1024 * 1024
+
+class MuxReader:
+    """
+    Lado lectura de una sesión: buffer propio y devolución de créditos al consumir.
+    """
+    def __init__(self, stream: "MuxStream"):
+        self._stream = stream
+        self._buffer = bytearray()
+        self._eof = False
+        self._waiter: asyncio.Future | None = None
+
+    def feed_data(self, data: bytes) -> None:
+        self._buffer += data
+        self._wakeup()
+
+    def feed_eof(self) -> None:
+        self._eof = True
+        self._wakeup()
+
+    def at_eof(self) -> bool:
+        return self._eof and not self._buffer
+
+    def _wakeup(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _wait(self) -> None:
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+    def _consume(self, n: int) -> bytes:
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        self._stream._consumed(n)
+        return data
+
+    async def readline(self) -> bytes:
+        """
+        Devuelve la próxima línea (con `\\n`), o lo que quede al llegar EOF.
+
+        - Una línea más larga que la ventana nunca podría completarse: `ValueError`,
+          igual que `StreamReader` al superar su límite.
+        """
+        while True:
+            end = self._buffer.find(b"\n")
+            if end >= 0:
+                return self._consume(end + 1)
+            if self._eof:
+                return self._consume(len(self._buffer))
+            if len(self._buffer) >= self._stream.window:
+                raise ValueError("Línea más larga que la ventana de la sesión")
+            await self._wait()
+
+    async def read(self, n: int = -1) -> bytes:
+        """
+        Devuelve hasta `n` bytes disponibles (b"" en EOF).
+        """
+        while not self._buffer and not self._eof:
+            await self._wait()
+        return self._consume(len(self._buffer) if n < 0 else min(n, len(self._buffer)))
+
+class MuxWriter:
+    """
+    Lado escritura de una sesión: `write()` encola y envía lo que permita la ventana.
+    """
+    def __init__(self, stream: "MuxStream"):
+        self._stream = stream
+
+    def write(self, data: bytes) -> None:
+        self._stream._send(data)
+
+    async def drain(self) -> None:
+        await self._stream._drain()
+
+    def get_extra_info(self, name: str, default=None):
+        if name == "mux_session":
+            return self._stream.sid
+        return self._stream.link.writer.get_extra_info(name, default)
+
+    def is_closing(self) -> bool:
+        return self._stream.closed
+
+    def close(self) -> None:
+        self._stream.close()
+
+    async def wait_closed(self) -> None:
+        await self._stream.wait_closed()
+
+class MuxStream:
+    """
+    Una sesión dentro de un link: ventanas de envío/recepción, buffer de salida y cierre.
+    """
+    def __init__(self, link: "MuxLink", sid: int, window: int):
+        self.link = link
+        self.sid = sid
+        self.window = window  # Buffer de recepción que ofrecemos al otro lado
+        self.send_window = DEFAULT_WINDOW  # Bytes que el otro lado nos habilitó
+        self._recv_allowed = window  # Bytes que todavía puede mandarnos el otro lado
+        self._unacked = 0  # Bytes consumidos sin devolver como crédito
+        self._pending = bytearray()  # Salida esperando crédito
+        self._closing = False  # close() pedido (se envía CLOSE al vaciar `_pending`)
+        self.closed = False  # CLOSE enviado o recibido
+        self._progress = asyncio.Event()  # Cambios de ventana o cierre (despierta `drain`)
+        self._closed_event = asyncio.Event()
+        self.reader = MuxReader(self)
+        self.writer = MuxWriter(self)
+        if window > DEFAULT_WINDOW:
+            # Anunciar el buffer extra respecto de la ventana inicial del protocolo
+            link._frame(CREDIT, sid, _CREDIT.pack(window - DEFAULT_WINDOW))
+
+    # --- Salida ---
+
+    def _send(self, data: bytes) -> None:
+        if self._closing or self.closed:
+            return  # Como un socket cerrado: se descarta
+        self._pending += data
+        self._pump()
+
+    def _pump(self) -> None:
+        """
+        Envía lo pendiente hasta agotar la ventana; si terminó y se pidió cerrar, envía CLOSE.
+        """
+        while self._pending and self.send_window > 0 and not self.closed:
+            n = min(len(self._pending), self.send_window, MAX_DATA_FRAME)
+            self.link._frame(DATA, self.sid, bytes(self._pending[:n]))
+            del self._pending[:n]
+            self.send_window -= n
+        if self._closing and not self._pending and not self.closed:
+            self.link._frame(CLOSE, self.sid)
+            self._finish()
+
+    async def _drain(self) -> None:
+        """
+        Espera a que lo escrito salga por el link (backpressure por sesión y por link).
+        """
+        while self._pending and not self.closed:
+            self._progress.clear()
+            await self._progress.wait()
+        if self.closed and self._pending:
+            raise ConnectionResetError("Sesión mux cerrada")
+        await self.link.drain()
+
+    # --- Entrada ---
+
+    def _on_data(self, data: bytes) -> None:
+        self._recv_allowed -= len(data)
+        if self._recv_allowed < 0:
+            # El otro lado ignoró el control de flujo: cortar sólo esta sesión
+            log.warning(f"Sesión mux {self.sid}: ventana excedida; se cierra")
+            self.reset()
+            return
+        self.reader.feed_data(data)
+
+    def _on_credit(self, n: int) -> None:
+        self.send_window += n
+        self._pump()
+        self._progress.set()
+
+    def _consumed(self, n: int) -> None:
+        """
+        El lector consumió `n` bytes: devolver crédito en bloques de media ventana.
+        """
+        self._unacked += n
+        if self._unacked >= self.window // 2 and not self.closed:
+            self.link._frame(CREDIT, self.sid, _CREDIT.pack(self._unacked))
+            self._recv_allowed += self._unacked
+            self._unacked = 0
+
+    # --- Cierre ---
+
+    def close(self) -> None:
+        """
+        Cierra la sesión tras enviar lo pendiente; el lector local ve EOF (como un socket).
+        """
+        self._closing = True
+        self.reader.feed_eof()
+        self._pump()
+
+    def reset(self) -> None:
+        """
+        Cierra la sesión ya mismo, descartando lo pendiente.
+        """
+        if not self.closed:
+            self.link._frame(CLOSE, self.sid)
+        self._finish()
+
+    def _finish(self) -> None:
+        """
+        Marca la sesión como cerrada (CLOSE enviado, recibido o link caído).
+        """
+        self.closed = True
+        self.reader.feed_eof()
+        self._progress.set()
+        self._closed_event.set()
+        self.link._streams.pop(self.sid, None)
+
+    async def wait_closed(self) -> None:
+        await self._closed_event.wait()
+
+class MuxLink:
+    """
+    Una conexión TCP que transporta muchas sesiones.
+
+    - `on_open(reader, writer)`: del lado app, se agenda por cada `OPEN` recibido.
+    - Del lado gateway, `open_stream()` abre sesiones nuevas.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 window: int = DEFAULT_WINDOW,
+                 on_open: Callable[[MuxReader, MuxWriter], Awaitable[None]] | None = None):
+        self.reader = reader
+        self.writer = writer
+        self.window = max(DEFAULT_WINDOW, window)
+        self._on_open = on_open
+        self._streams: dict[int, MuxStream] = {}
+        self._ids = itertools.count(1, 2)
+        self._tasks: set[asyncio.Task] = set()  # Handlers de sesiones abiertas por el peer
+        self._out = bytearray()  # Frames de esta vuelta del loop, en una sola escritura
+        self._loop = asyncio.get_running_loop()
+        self.closed = False
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def _frame(self, kind: int, sid: int, payload: bytes = b"") -> None:
+        """
+        Agrega un frame a la salida del link.
+
+        - Los frames de todas las sesiones en una misma vuelta del loop salen juntos en
+          un solo `write` (un syscall en vez de uno por línea y por sesión).
+        """
+        if self.closed:
+            return
+        if not self._out:
+            self._loop.call_soon(self._flush)
+        self._out += HEADER.pack(kind, sid, len(payload))
+        self._out += payload
+
+    def _flush(self) -> None:
+        if self._out and not self.closed:
+            data, self._out = self._out, bytearray()
+            self.writer.write(data)
+
+    async def drain(self) -> None:
+        if self.closed:
+            raise ConnectionResetError("Link mux cerrado")
+        self._flush()
+        await self.writer.drain()
+
+    def open_stream(self) -> MuxStream:
+        """
+        Abre una sesión nueva en este link (lado gateway).
+        """
+        if self.closed:
+            raise ConnectionResetError("Link mux cerrado")
+        sid = next(self._ids)
+        self._frame(OPEN, sid)
+        stream = self._streams[sid] = MuxStream(self, sid, self.window)
+        return stream
+
+    async def _read_loop(self) -> None:
+        """
+        Lee frames del link y los reparte entre las sesiones.
+        """
+        try:
+            while True:
+                kind, sid, length = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+                if length > MAX_FRAME:
+                    log.warning(f"Link mux: frame de {length} bytes; se cierra el link")
+                    break
+                payload = await self.reader.readexactly(length) if length else b""
+                stream = self._streams.get(sid)
+                if kind == OPEN and self._on_open is not None and stream is None:
+                    stream = self._streams[sid] = MuxStream(self, sid, self.window)
+                    task = asyncio.create_task(self._on_open(stream.reader, stream.writer))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                elif stream is None:
+                    continue  # Frames tardíos de una sesión ya cerrada
+                elif kind == DATA:
+                    stream._on_data(payload)
+                elif kind == CREDIT:
+                    stream._on_credit(_CREDIT.unpack(payload)[0])
+                elif kind == CLOSE:
+                    stream._finish()
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self._lost()
+
+    def _lost(self) -> None:
+        """
+        El link se cerró: todas sus sesiones ven EOF.
+        """
+        self.closed = True
+        self._out.clear()
+        for stream in list(self._streams.values()):
+            stream._finish()
+        self.writer.close()
+
+    async def close(self) -> None:
+        """
+        Cierra el link y espera a que terminen los handlers de sus sesiones.
+        """
+        self._flush()
+        self.writer.close()
+        await asyncio.gather(self._read_task, return_exceptions=True)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def wait_closed(self) -> None:
+        await asyncio.gather(self._read_task, return_exceptions=True)
+
+# --- Lado app ---
+
+# Links aceptados por este proceso (se cierran al apagar)
+_links: set[MuxLink] = set()
+
+async def serve_link(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, *,
+                     handler: Callable[[MuxReader, MuxWriter], Awaitable[None]],
+                     window: int = DEFAULT_WINDOW) -> None:
+    """
+    Atiende un link entrante: cada `OPEN` corre `handler(reader, writer)` como una conexión más.
+    """
+    link = MuxLink(reader, writer, window=window, on_open=handler)
+    _links.add(link)
+    log.info(f"Link mux desde {writer.get_extra_info('peername')}")
+    try:
+        await link.wait_closed()
+    finally:
+        _links.discard(link)
+
+async def close_links() -> None:
+    """
+    Cierra los links aceptados (después de cerrar sus sesiones en el apagado).
+    """
+    await asyncio.gather(*(link.close() for link in list(_links)), return_exceptions=True)
+
+# --- Lado gateway ---
+
+class MuxPool:
+    """
+    Pocos links persistentes hacia la app; cada sesión nueva va al link con menos sesiones.
+    """
+    def __init__(self, host: str, port: int, size: int, window: int = DEFAULT_WINDOW):
+        self.host = host
+        self.port = port
+        self.size = max(1, size)
+        self.window = window
+        self._links: list[MuxLink] = []
+        self._connecting = asyncio.Lock()
+
+    async def _connect(self) -> MuxLink:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        return MuxLink(reader, writer, window=self.window)
+
+    async def open_stream(self) -> tuple[MuxReader, MuxWriter]:
+        """
+        Abre una sesión (reconectando links caídos) y devuelve `(reader, writer)`.
+        """
+        async with self._connecting:
+            self._links = [link for link in self._links if not link.closed]
+            if len(self._links) < self.size:
+                self._links.append(await self._connect())
+        stream = min(self._links, key=len).open_stream()
+        return stream.reader, stream.writer
+
+    def stats(self) -> dict:
+        return {"links": len(self._links), "sessions": sum(len(link) for link in self._links)}
+
+    async def close(self) -> None:
+        await asyncio.gather(*(link.close() for link in self._links), return_exceptions=True)
+        self._links.clear()
@@ -32,6 +32,29 @@ El sistema debe prestar atención a las siguientes palabras:
 Hola, gracias por buscar apoyo. Entiendo que si estás aquí es porque estás atravesando un momento difícil, y quiero que sepas que puedes contar conmigo para escucharte. ¿Qué es lo que más te está afectando emocionalmente en este momento?
 """
 
+# Palabras de alarma/riesgo del diccionario de arriba, para usarlas fuera del modelo
+# (por ejemplo, para no cachear respuestas a mensajes de riesgo)
+RISK_KEYWORDS = (
+    "suicidio", "matarme", "cortarme", "morir", "muerte",
+    "terminar con todo", "no aguanto más", "desesperado",
+)
+
+# Diccionario completo por categoría, para el clasificador local (app/services/risk.py)
+KEYWORDS = {
+    "riesgo": RISK_KEYWORDS,
+    "ansiedad": ("ansiedad", "ataque de pánico", "nervioso", "presión", "no puedo respirar", "angustia"),
+    "depresion": ("vacío", "tristeza", "sin ganas", "llorar", "solo", "nada importa", "culpa", "cansancio"),
+    "apoyo": ("familia", "amigos", "pareja", "hablar", "compartir", "apoyo"),
+    "esperanza": ("mejorar", "calma", "avanzar", "superarlo", "cuidarme", "fuerza"),
+}
+
+# Respuesta local inmediata ante palabras de alarma (se envía antes de la respuesta del modelo)
+CRISIS_REPLY = (
+    "Lo que contás es importante y no tenés que atravesarlo solo. Si estás en peligro ahora, "
+    "llamá al 911; para hablar con alguien las 24 horas, llamá al 135 (Centro de Asistencia "
+    "al Suicida). Sigo acá con vos."
+)
+
 # SYSTEM_PROMPT = """
 #Prompt General — Asistente de Apoyo Psicológico\n\nRol: Eres un psicólogo clínico con amplia experiencia en acompañamiento emocional.\n\nObjetivo: Escuchar activamente, responder con empatía, sugerir autocuidados y recordar que no sustituye consulta profesional.\n\nTono: Cercano, humano y empático. Lenguaje claro y validante.\n\nRestricciones: No diagnosticar ni prescribir fármacos. Ante riesgo suicida, seguir protocolo y recomendar ayuda inmediata.\n\nPreguntas iniciales sugeridas: 1) ¿Cómo te sientes hoy? 2) ¿Hay algo que te esté afectando? 3) ¿Desde cuándo sientes esto?\n\nEstructura de respuesta: Resumir, preguntar, explicar brevemente, sugerir estrategias, reiterar la necesidad de evaluación profesional, cerrar con mensaje esperanzador.
 
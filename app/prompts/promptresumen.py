@@ -0,0 +1,15 @@
+# Prompt de Resumen — memoria de conversaciones largas (ver app/services/summarizer.py)
+# No define SYSTEM_PROMPT: no es un prompt elegible por las sesiones.
+
+SUMMARY_PROMPT = """
+Sos el registro clínico de una conversación de apoyo emocional. Recibís el resumen anterior
+(si existe) y los turnos nuevos entre el usuario y el asistente.
+
+Escribí un único resumen actualizado, en español, en tercera persona y en un solo párrafo:
+- Qué siente el usuario, desde cuándo y qué lo desencadena.
+- Datos personales relevantes que compartió (vínculos, trabajo, rutinas, sueño).
+- Estrategias que ya se sugirieron y cómo las recibió.
+- Cualquier señal de riesgo mencionada, con sus palabras exactas.
+
+No agregues consejos nuevos ni interpretes más allá de lo dicho. Máximo 120 palabras.
+"""
@@ -0,0 +1,74 @@
+"""
+Marcas de framing del protocolo de líneas TCP (app ↔ gateway).
+
+- El protocolo base es texto UTF-8, una respuesta por línea (`\\n`).
+- En modo streaming (`LLM_STREAM`), cada delta del LLM viaja como una línea
+  `\\x02` + delta codificado en JSON (así puede contener saltos de línea),
+  y el fin de la respuesta como una línea `\\x03`.
+- Se usan caracteres de control STX/ETX para no chocar con texto normal.
+- Líneas de control `\\x01<comando> <argumento>` entre gateway y app (los clientes
+  TCP directos nunca las reciben si no las piden):
+  - `resume <token>` (gateway → app): retomar la conversación `token` (vacío = nueva).
+  - `session <token>` (app → gateway): token de la conversación asignada.
+  - `peer <ip>` (gateway → app): IP real del navegador, para limitar la tasa por IP
+    (la app sólo la acepta de `TRUSTED_PROXIES`).
+  - `prompt <nombre>` (gateway → app): system prompt de la conversación (un módulo de
+    `app/prompts`; un nombre desconocido deja el default).
+- Sin dependencias del resto de `app` para que el gateway pueda importarlo.
+"""
+
+# Importaciones necesarias
+import json  # Codificar deltas como string JSON de una sola línea
+import re  # Validar tokens de sesión
+import secrets  # Generar tokens de sesión
+
+# Marcas de inicio de línea
+STREAM_CHUNK = "\x02"  # Delta parcial de una respuesta en streaming
+STREAM_END = "\x03"  # Fin de la respuesta en streaming
+CONTROL = "\x01"  # Línea de control (sesiones)
+
+# Formato de los tokens de sesión (los de `new_session_token`)
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+def encode_chunk(delta: str) -> bytes:
+    """
+    Codifica un delta como línea `\\x02"<json>"\\n`.
+    """
+    return (STREAM_CHUNK + json.dumps(delta, ensure_ascii=False) + "\n").encode("utf-8")
+
+def encode_end() -> bytes:
+    """
+    Línea que marca el final de una respuesta en streaming.
+    """
+    return (STREAM_END + "\n").encode("utf-8")
+
+def decode_chunk(line: str) -> str:
+    """
+    Devuelve el delta contenido en una línea `\\x02...` (sin la marca).
+    """
+    return json.loads(line[len(STREAM_CHUNK):])
+
+def encode_control(command: str, arg: str = "") -> bytes:
+    """
+    Codifica una línea de control `\\x01<comando> <argumento>\\n`.
+    """
+    return (CONTROL + f"{command} {arg}".rstrip() + "\n").encode("utf-8")
+
+def parse_control(line: str) -> tuple[str, str]:
+    """
+    Separa una línea de control en `(comando, argumento)`.
+    """
+    command, _, arg = line[len(CONTROL):].strip().partition(" ")
+    return command, arg.strip()
+
+def new_session_token() -> str:
+    """
+    Token aleatorio (no adivinable) que identifica una conversación reanudable.
+    """
+    return secrets.token_urlsafe(16)
+
+def is_session_token(token: str) -> bool:
+    """
+    Indica si `token` tiene el formato de un token de sesión.
+    """
+    return bool(_TOKEN_RE.fullmatch(token or ""))
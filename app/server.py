@@ -5,40 +5,240 @@ Servidor TCP para PsicoIA.
 - Cada cliente se gestiona en una coroutine independiente (`handle_client`).
 - Implementa un modelo de concurrencia basado en I/O no bloqueante.
 - Comparte un único puerto TCP para todas las conexiones.
+- Con `--workers N` (o `APP_WORKERS`) corre N procesos en el mismo puerto (ver `app.workers`).
+- Apagado ordenado con SIGTERM/SIGINT: deja de aceptar y espera a las conexiones activas.
+- Con `APP_MUX_PORT`, acepta además links multiplexados del gateway (ver `app.mux`).
+- Con `METRICS_PORT`, expone métricas de Prometheus en `http://METRICS_HOST:METRICS_PORT/metrics`
+  (cada worker en `METRICS_PORT + índice`).
+- Arranque rápido: escucha antes de importar httpx y el handler, y hace el arranque pesado
+  (pool HTTP, prompts, store, caché) con el socket ya aceptando; `/ready` indica cuándo terminó.
+- Con `DIAG_ENABLED`, mide el lag del event loop, loguea los bloqueos con su stack y los tramos
+  de cada mensaje, y escribe un perfil `.folded` con `kill -USR1 <pid>` (ver `app.utils.diagnostics`).
 """
 
 # Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
 import asyncio  # Para concurrencia asíncrona
+import functools  # Handler de links mux con su configuración
+import signal  # Apagado ordenado
+import socket  # Socket heredado del supervisor (modo workers)
+import time  # Plazo de apagado y tiempo de arranque
 from app.config import settings  # Configuración del proyecto
 from app.utils.logger import get_logger  # Logger configurado
-from app.client_handler import handle_client  # Manejador de clientes
+from app.mux import serve_link, close_links  # Sesiones multiplexadas del gateway
+from app.utils.metrics import set_ready, start_metrics_server  # Endpoints /metrics y /ready
+from app.utils.diagnostics import Diagnostics  # Lag del loop, bloqueos y perfil (opt-in)
+# El handler y los servicios (httpx, pool HTTP, prompts, store, caché) se importan en
+# `_warm_up`, con el socket ya escuchando
 
 # Logger para este módulo
 log = get_logger("server")
+# Referencia del tiempo de arranque (importación de este módulo)
+_T0 = time.perf_counter()
+# `app.client_handler`, importado por `_warm_up`
+client_handler = None
+# Se completa al terminar el arranque: hasta entonces `_accept` retiene las conexiones
+_ready = asyncio.Event()
 
-async def main():
+async def _drain_connections(timeout: float) -> None:
+    """
+    Espera (hasta `timeout` segundos) a que terminen las conexiones activas.
+
+    - Al vencer el plazo cierra los sockets que sigan abiertos: cada
+      `handle_client` ve EOF y termina por su camino normal (libera la sesión).
+    - Si alguno sigue colgado (por ejemplo, esperando al LLM), se cancela.
+    """
+    deadline = time.monotonic() + timeout
+    while client_handler.active_clients and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if not client_handler.active_clients:
+        return
+    log.warning(f"Apagado: cerrando {len(client_handler.active_clients)} conexiones todavía activas")
+    for writer in client_handler.active_clients.values():
+        writer.close()
+    _, pending = await asyncio.wait(list(client_handler.active_clients), timeout=5.0)
+    for task in pending:
+        task.cancel()
+
+def diagnostics_from_settings(name: str) -> Diagnostics | None:
+    """
+    `Diagnostics` configurado con `DIAG_*`, o None si el diagnóstico está apagado.
+    """
+    if not getattr(settings, "DIAG_ENABLED", False):
+        return None
+    return Diagnostics(
+        name=name,
+        lag_interval=float(getattr(settings, "DIAG_LAG_INTERVAL_MS", None) or 100) / 1000,
+        slow_callback=float(getattr(settings, "DIAG_SLOW_CALLBACK_MS", None) or 100) / 1000,
+        profile_seconds=float(getattr(settings, "DIAG_PROFILE_SECONDS", None) or 10),
+        profile_dir=getattr(settings, "DIAG_PROFILE_DIR", None) or "data/profiles",
+    )
+
+async def _accept(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Handler del socket: espera a que termine el arranque y atiende con `handle_client`.
+    """
+    await _ready.wait()
+    await client_handler.handle_client(reader, writer)
+
+async def _warm_up() -> None:
+    """
+    Arranque pesado, con el socket ya aceptando conexiones.
+
+    - Importa el handler (httpx, cliente del LLM, clasificador, registro de prompts).
+    - Crea el pool HTTP (contexto SSL con los certificados) y, con `LLM_POOL_WARMUP`,
+      abre esas conexiones keep-alive por endpoint.
+    - Inicia la barredora de sesiones y la recarga de prompts, abre el store persistente
+      (si está configurado) y carga la caché de respuestas (si está activa).
+    """
+    global client_handler
+    from app import client_handler  # Manejador de clientes
+    from app.services.http_pool import start_http_client, warm_up  # Pool HTTP al LLM
+    from app.services.llm_router import hedge_endpoint, router  # Endpoints a precalentar
+    from app.services.session_store import sessions, SWEEP_INTERVAL  # Sesiones acotadas
+    from app.services.prompts import prompts, RELOAD_INTERVAL  # System prompts (recarga en caliente)
+    from app.services.conversation_store import get_store  # Historias persistentes
+    from app.services.response_cache import get_cache  # Caché opcional de respuestas
+
+    # Cliente HTTP compartido para todas las sesiones (keep-alive)
+    await start_http_client()
+    warm = int(getattr(settings, "LLM_POOL_WARMUP", None) or 0)
+    urls = list(dict.fromkeys(ep.url for ep in [*router.endpoints, hedge_endpoint] if ep is not None))
+    if warm > 0 and urls:
+        ok = await warm_up(urls, warm)
+        log.info(f"HTTP pool precalentado: {ok}/{warm * len(urls)} conexiones")
+    # Expirar sesiones inactivas en segundo plano
+    sessions.start_sweeper(SWEEP_INTERVAL)
+    # Recargar los prompts de `app/prompts` cuando cambian los archivos
+    prompts.start_watcher(RELOAD_INTERVAL)
+    # Abrir el store persistente (si está configurado) antes de atender clientes
+    get_store()
+    # Cargar la caché de respuestas persistida (si está activa)
+    get_cache()
+
+async def _shut_down() -> None:
+    """
+    Detiene lo que inició `_warm_up`: tareas de fondo, pool HTTP, store y caché.
+    """
+    from app.services.http_pool import close_http_client
+    from app.services.llm_router import log_stats, router
+    from app.services.session_store import sessions
+    from app.services.prompts import prompts
+    from app.services.summarizer import stop_summaries
+    from app.services.conversation_store import close_store
+    from app.services.response_cache import close_cache
+
+    # Cerrar conexiones keep-alive y registrar estadísticas del pool y de los endpoints
+    await sessions.stop_sweeper()
+    await prompts.stop_watcher()
+    await stop_summaries()
+    log_stats(router)
+    await close_http_client()
+    # Escribir lo pendiente del write-behind antes de salir
+    await asyncio.to_thread(close_store)
+    # Guardar la caché de respuestas (si tiene persistencia)
+    close_cache()
+
+async def main(sock: socket.socket | None = None, worker: int | None = None):
     """
     Punto de entrada principal para el servidor TCP.
 
     - Configura un socket de escucha no bloqueante con `asyncio.start_server`.
+    - `sock`: socket ya abierto (heredado del supervisor en modo `shared`).
+    - `worker`: índice del worker en modo multi-proceso (usa SO_REUSEPORT si no hay `sock`).
     - Por cada conexión entrante, agenda una coroutine `handle_client`.
-    - Registra en logs la dirección y el puerto donde el servidor está escuchando.
+    - Escucha primero y arranca lo pesado después (`_warm_up`): las conexiones que llegan
+      mientras tanto esperan en `_accept` en vez de ser rechazadas.
+    - Al terminar el arranque marca el proceso listo (`/ready` con `METRICS_PORT`) y
+      registra en logs cuánto tardó en escuchar y en estar listo.
+    - Si `APP_MUX_PORT` está definido, escucha también links multiplexados:
+      cada sesión del link corre su propio `handle_client`.
+    - Al apagar cierra el pool HTTP, el store y la caché (`_shut_down`).
     """
+    # Diagnóstico del event loop (opt-in)
+    diagnostics = diagnostics_from_settings(f"worker{worker}" if worker is not None else "app")
+    if diagnostics is not None:
+        diagnostics.start()
+
     # Crear el servidor TCP
-    server = await asyncio.start_server(
-        handle_client,  # Función manejadora para cada cliente
-        host=settings.APP_HOST,  # Dirección del host (configurable)
-        port=settings.APP_PORT,  # Puerto del servidor (configurable)
-    )
+    if sock is not None:
+        server = await asyncio.start_server(_accept, sock=sock)
+    else:
+        server = await asyncio.start_server(
+            _accept,  # Función manejadora para cada cliente
+            host=settings.APP_HOST,  # Dirección del host (configurable)
+            port=settings.APP_PORT,  # Puerto del servidor (configurable)
+            reuse_port=worker is not None,  # Workers comparten el puerto (SO_REUSEPORT)
+        )
+
+    servers = [server]
+    mux_port = getattr(settings, "APP_MUX_PORT", None)
+    if mux_port:
+        # Links del gateway: muchas sesiones por conexión TCP
+        mux_handler = functools.partial(
+            serve_link,
+            handler=_accept,
+            window=int(getattr(settings, "MUX_WINDOW_BYTES", None) or 64 * 1024),
+        )
+        servers.append(await asyncio.start_server(
+            mux_handler,
+            host=settings.APP_HOST,
+            port=mux_port,
+            reuse_port=worker is not None and hasattr(socket, "SO_REUSEPORT"),
+        ))
+
+    metrics_port = getattr(settings, "METRICS_PORT", None)
+    if metrics_port:
+        # Un puerto por worker: cada proceso tiene su propio registro
+        metrics_host = getattr(settings, "METRICS_HOST", None) or "127.0.0.1"
+        metrics_port += worker or 0
+        servers.append(await start_metrics_server(metrics_host, metrics_port))
+        log.info(f"Métricas en http://{metrics_host}:{metrics_port}/metrics")
 
     # Obtener las direcciones donde el servidor está escuchando
-    addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
-    log.info(f"TCP server escuchando en {addrs}")
+    addrs = ", ".join(str(s.getsockname()) for srv in servers for s in srv.sockets)
+    who = f"Worker {worker}: " if worker is not None else ""
+    listening = time.perf_counter() - _T0
+    log.info(f"{who}TCP server escuchando en {addrs}")
+
+    # Arranque pesado con el socket ya aceptando
+    await _warm_up()
+    _ready.set()
+    set_ready(True)
+    log.info(f"{who}Listo en {(time.perf_counter() - _T0) * 1000:.0f} ms (escuchando a los {listening * 1000:.0f} ms)")
+
+    # SIGTERM/SIGINT → apagado ordenado (en Windows no hay add_signal_handler)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
 
-    # Mantener el servidor corriendo indefinidamente
-    async with server:
-        await server.serve_forever()
+    # Mantener el servidor corriendo hasta recibir la señal de apagado
+    try:
+        async with server:
+            await stop.wait()
+            set_ready(False)
+            log.info(f"{who}Apagando: no se aceptan conexiones nuevas")
+            for srv in servers:
+                srv.close()
+            await _drain_connections(float(getattr(settings, "WORKER_SHUTDOWN_TIMEOUT", None) or 10.0))
+            await close_links()
+    finally:
+        if diagnostics is not None:
+            await diagnostics.stop()
+        await _shut_down()
 
 if __name__ == "__main__":
-    # Ejecutar el servidor TCP
-    asyncio.run(main())
+    # Ejecutar el servidor TCP (uno o varios procesos)
+    parser = argparse.ArgumentParser(description="Servidor TCP de PsicoIA")
+    parser.add_argument("--workers", type=int, default=int(getattr(settings, "APP_WORKERS", None) or 1),
+                        help="procesos worker en el mismo puerto (default: APP_WORKERS o 1)")
+    args = parser.parse_args()
+    if args.workers > 1:
+        from app.workers import run_workers
+        run_workers(args.workers)
+    else:
+        asyncio.run(main())
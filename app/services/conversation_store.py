@@ -0,0 +1,200 @@
+"""
+Almacén persistente de conversaciones (SQLite en modo WAL) con escritura diferida.
+
+- Los `append` sólo encolan el mensaje: el request nunca espera a disco (fsync).
+- Un hilo escritor dueño de la conexión SQLite agrupa los mensajes encolados y los
+  escribe en una sola transacción (write-behind batching).
+- Las lecturas (`load`) pasan por la misma cola: ven siempre todo lo encolado antes.
+- Se activa con `HISTORY_BACKEND=sqlite`; con `memory` (default) no hay persistencia.
+"""
+
+# Importaciones necesarias
+import asyncio  # Esperar lecturas del hilo escritor sin bloquear el loop
+import queue  # Cola de operaciones hacia el hilo escritor
+import sqlite3  # Base de datos embebida
+import threading  # Hilo escritor
+import time  # Marcas de tiempo y espera de agrupamiento
+from concurrent.futures import Future  # Resultado de lecturas/flush
+from pathlib import Path  # Crear el directorio de la base
+
+from app.config import settings  # Configuración del proyecto
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("store")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conv ON messages (conversation_id, seq);
+"""
+
+class SQLiteConversationStore:
+    def __init__(self, path: str, flush_interval: float = 0.05, batch_size: int = 500):
+        """
+        Abre (o crea) la base y arranca el hilo escritor.
+
+        - `flush_interval`: segundos que el escritor espera para juntar más mensajes.
+        - `batch_size`: máximo de mensajes por transacción.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self._ops: queue.SimpleQueue = queue.SimpleQueue()
+        self.written = 0  # Mensajes escritos a disco
+        self.batches = 0  # Transacciones de escritura
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    # --- API usada desde el event loop ---
+
+    def append(self, conversation_id: str, role: str, content: str) -> None:
+        """
+        Encola un mensaje para escritura diferida (no bloquea).
+        """
+        self._ops.put(("append", (conversation_id, role, content, time.time())))
+
+    def delete(self, conversation_id: str) -> None:
+        """
+        Encola el borrado de toda la conversación.
+        """
+        self._ops.put(("delete", conversation_id))
+
+    async def load(self, conversation_id: str, limit: int) -> list[tuple[str, str]]:
+        """
+        Devuelve los últimos `limit` mensajes `(role, content)` en orden cronológico.
+        """
+        fut: Future = Future()
+        self._ops.put(("load", (conversation_id, limit, fut)))
+        return await asyncio.wrap_future(fut)
+
+    async def flush(self) -> None:
+        """
+        Espera a que todo lo encolado hasta ahora esté escrito.
+        """
+        fut: Future = Future()
+        self._ops.put(("flush", fut))
+        await asyncio.wrap_future(fut)
+
+    def close(self) -> None:
+        """
+        Escribe lo pendiente y detiene el hilo escritor.
+        """
+        self._ops.put(("stop", None))
+        self._thread.join()
+        log.info(f"Store cerrado: {self.written} mensajes en {self.batches} lotes")
+
+    # --- Hilo escritor ---
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Conexión propia del hilo escritor, en modo WAL.
+        """
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        return db
+
+    def _write(self, db: sqlite3.Connection, rows: list[tuple]) -> None:
+        """
+        Escribe un lote de mensajes en una sola transacción.
+        """
+        if not rows:
+            return
+        with db:
+            db.executemany(
+                "INSERT INTO messages (conversation_id, role, content, created) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        self.written += len(rows)
+        self.batches += 1
+        rows.clear()
+
+    def _run(self) -> None:
+        """
+        Bucle del hilo: junta appends y los escribe antes de cada lectura/borrado/flush.
+        """
+        db = self._connect()
+        pending: list[tuple] = []
+        running = True
+        while running:
+            op, arg = self._ops.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    if op == "append":
+                        pending.append(arg)
+                        if len(pending) >= self.batch_size:
+                            self._write(db, pending)
+                    else:
+                        # Cualquier otra operación ve primero lo ya encolado
+                        self._write(db, pending)
+                        if op == "load":
+                            cid, limit, fut = arg
+                            rows = db.execute(
+                                "SELECT role, content FROM messages WHERE conversation_id = ? "
+                                "ORDER BY seq DESC LIMIT ?",
+                                (cid, limit),
+                            ).fetchall()
+                            fut.set_result(rows[::-1])
+                        elif op == "delete":
+                            with db:
+                                db.execute("DELETE FROM messages WHERE conversation_id = ?", (arg,))
+                        elif op == "flush":
+                            arg.set_result(None)
+                        elif op == "stop":
+                            running = False
+                            break
+                except Exception as e:
+                    log.error(f"Error en el store de historias ({op}): {e}")
+                    if op in ("load", "flush"):
+                        fut = arg[2] if op == "load" else arg
+                        if not fut.done():
+                            fut.set_exception(e)
+                # Juntar más operaciones hasta `flush_interval` (write-behind)
+                remaining = deadline - time.monotonic()
+                try:
+                    op, arg = self._ops.get(timeout=remaining) if remaining > 0 else self._ops.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write(db, pending)
+            except Exception as e:
+                log.error(f"Error escribiendo historias: {e}")
+                pending.clear()
+        db.close()
+
+# --- Instancia del proceso ---
+_store: SQLiteConversationStore | None = None
+
+def get_store() -> SQLiteConversationStore | None:
+    """
+    Devuelve el store persistente configurado, o None con `HISTORY_BACKEND=memory`.
+
+    - Se crea perezosamente en la primera llamada (arranca el hilo escritor).
+    """
+    global _store
+    if _store is None and (getattr(settings, "HISTORY_BACKEND", None) or "memory").lower() == "sqlite":
+        _store = SQLiteConversationStore(
+            getattr(settings, "HISTORY_DB_PATH", None) or "data/psicoia.db",
+            flush_interval=float(getattr(settings, "HISTORY_FLUSH_INTERVAL_MS", None) or 50) / 1000,
+            batch_size=int(getattr(settings, "HISTORY_BATCH_SIZE", None) or 500),
+        )
+        log.info(f"Historias persistentes en {_store.path} (SQLite WAL)")
+    return _store
+
+def close_store() -> None:
+    """
+    Cierra el store (si se creó), escribiendo lo pendiente.
+    """
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -0,0 +1,191 @@
+"""
+Historial de una conversación: anillo compacto con estimación de tokens memoizada.
+
+- Cada mensaje es un registro `Message` con `__slots__`: el rol (internado, compartido por
+  todas las historias) y su JSON ya codificado (`payload.encode`). No hay un dict por
+  mensaje ni una segunda copia del texto como `str`: el dict `{"role", "content"}` se arma
+  sólo cuando alguien lo pide (`as_dict`, `HistoryView.as_dicts`), no en cada turno.
+- Anillo de capacidad `max_messages`: con la historia llena, el mensaje nuevo ocupa el
+  lugar del más viejo (recorte O(1), sin mover los demás).
+- Suma acumulada de tokens en un `array` paralelo al anillo (enteros de 8 bytes, sin un
+  `int` por mensaje): el costo de cualquier sufijo sale en O(1) y la ventana de contexto
+  que entra en el presupuesto se elige con búsqueda binaria.
+- `messages` y `window` devuelven vistas de sólo lectura (`HistoryView`), no copias; el
+  cuerpo del request se arma uniendo los bytes de cada registro.
+"""
+
+# Importaciones necesarias
+import sys  # Tamaño en memoria y roles internados
+from array import array  # Suma acumulada compacta
+from bisect import bisect_left  # Búsqueda binaria sobre la suma acumulada
+
+from app.services.payload import encode, loads  # JSON de cada mensaje
+
+# Roles conocidos: los que llegan del store (SQLite) son strings nuevos por fila
+_ROLES = {role: sys.intern(role) for role in ("system", "user", "assistant")}
+
+class Message:
+    __slots__ = ("role", "json")
+
+    def __init__(self, role: str, content: str):
+        """
+        Mensaje de la historia: rol internado y `{"role", "content"}` codificado.
+        """
+        self.role = _ROLES.get(role) or sys.intern(role)
+        self.json = encode({"role": self.role, "content": content})
+
+    @property
+    def content(self) -> str:
+        """Texto del mensaje (se decodifica del JSON)."""
+        return loads(self.json)["content"]
+
+    def as_dict(self) -> dict:
+        """El mensaje como dict `{"role", "content"}` (uno nuevo en cada llamada)."""
+        return {"role": self.role, "content": self.content}
+
+class HistoryView:
+    __slots__ = ("_history", "_start", "_stop")
+
+    def __init__(self, history: "ConversationHistory", start: int, stop: int):
+        """
+        Vista de sólo lectura de los mensajes `[start:stop]` de `history`, sin copiarlos.
+
+        - Indexable, iterable y rebanable (una rebanada es otra vista).
+        - Refleja la historia viva: usarla con el lock de la conversación tomado.
+        """
+        self._history = history
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("HistoryView sólo admite rebanadas contiguas")
+            return HistoryView(self._history, self._start + start, self._start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("índice fuera de la historia")
+        return self._history._at(self._start + index)
+
+    def records(self) -> list[Message]:
+        """Los registros de la vista en una lista nueva (a lo sumo dos rebanadas del anillo)."""
+        ring, head = self._history._ring, self._history._head
+        size = len(ring)
+        start, stop = head + self._start, head + self._stop
+        if stop <= size:
+            return ring[start:stop]
+        if start >= size:
+            return ring[start - size:stop - size]
+        return ring[start:] + ring[:stop - size]
+
+    def as_dicts(self) -> list[dict]:
+        """Los mensajes de la vista como dicts nuevos (se decodifican juntos, en una llamada)."""
+        return loads(b"[" + b",".join([msg.json for msg in self.records()]) + b"]")
+
+    def __iter__(self):
+        return iter(self.records())
+
+class ConversationHistory:
+    __slots__ = ("max_messages", "_ring", "_cum", "_head", "_base", "_end", "nbytes", "offset")
+
+    def __init__(self, max_messages: int):
+        """
+        Inicializa una historia vacía.
+
+        - `max_messages`: cantidad máxima de mensajes a conservar (los más viejos se descartan).
+        - `_ring`: registros `Message`; crece hasta `max_messages` y después se reutiliza,
+          con `_head` apuntando al más viejo.
+        - `_cum`: paralela a `_ring`, tokens acumulados hasta cada mensaje inclusive (contando
+          los ya recortados); `_base` es el acumulado antes del más viejo y `_end` el total.
+        - `nbytes`: bytes aproximados del JSON conservado (para métricas).
+        - `offset`: mensajes ya recortados (posición absoluta de `messages[0]`).
+        """
+        self.max_messages = max(1, max_messages)
+        self._ring: list[Message] = []
+        self._cum = array("q")
+        self._head = 0
+        self._base = 0
+        self._end = 0
+        self.nbytes = 0
+        self.offset = 0
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+    @property
+    def tokens(self) -> int:
+        """Tokens estimados de toda la historia conservada."""
+        return self._end - self._base
+
+    @property
+    def messages(self) -> HistoryView:
+        """Todos los mensajes conservados, del más viejo al más nuevo (vista, no copia)."""
+        return HistoryView(self, 0, len(self._ring))
+
+    def _at(self, i: int) -> Message:
+        """Mensaje `i` en orden cronológico."""
+        return self._ring[(self._head + i) % len(self._ring)]
+
+    def append(self, role: str, content: str, tokens: int) -> None:
+        """
+        Agrega un mensaje con su costo `tokens` ya calculado; lleno, reemplaza al más viejo.
+        """
+        record = Message(role, content)
+        self._end += tokens
+        self.nbytes += sys.getsizeof(record.json)
+        if len(self._ring) < self.max_messages:
+            self._ring.append(record)
+            self._cum.append(self._end)
+            return
+        head = self._head
+        self.nbytes -= sys.getsizeof(self._ring[head].json)
+        self._base = self._cum[head]
+        self._ring[head] = record
+        self._cum[head] = self._end
+        self._head = head + 1 if head + 1 < self.max_messages else 0
+        self.offset += 1
+
+    def _before(self, start: int) -> int:
+        """Tokens acumulados antes de `messages[start]`."""
+        if start <= 0:
+            return self._base
+        return self._cum[(self._head + start - 1) % len(self._ring)]
+
+    def tokens_from(self, start: int) -> int:
+        """Tokens estimados de `messages[start:]` (O(1))."""
+        return self._end - self._before(start)
+
+    def window_start(self, budget: int) -> int:
+        """
+        Índice del primer mensaje del sufijo más largo cuyo costo no supera `budget`.
+
+        - Equivale a recorrer desde el final sumando tokens hasta pasarse,
+          pero en O(log n) gracias a la suma acumulada.
+        - `_cum` está ordenada por tramos: `[_head:]` (los más viejos) y `[:_head]`;
+          se busca sólo en el tramo que corresponde.
+        """
+        size = len(self._ring)
+        if budget <= 0 or not size:
+            return size
+        # Primer índice i tal que _end - acumulado antes de i <= budget
+        target = self._end - budget
+        if self._base >= target:
+            return 0
+        cum, head = self._cum, self._head
+        if head and cum[size - 1] < target:
+            last = bisect_left(cum, target, 0, head) + size - head
+        else:
+            last = bisect_left(cum, target, head, size) - head
+        # `last` es el primer mensaje cuyo acumulado llega a `target`: la ventana empieza después
+        return last + 1
+
+    def window(self, budget: int) -> HistoryView:
+        """
+        Devuelve el sufijo más largo de la historia cuyo costo no supera `budget` (vista).
+        """
+        return HistoryView(self, self.window_start(budget), len(self._ring))
@@ -0,0 +1,169 @@
+"""
+Cliente HTTP compartido (pool de conexiones) para las llamadas al LLM.
+
+- Mantiene UN `httpx.AsyncClient` por proceso, creado al iniciar el servidor
+  y cerrado al apagarlo, para no pagar TCP + TLS en cada turno de chat.
+- Keep-alive y límites del pool configurables; por defecto atados a `MAX_IN_FLIGHT`.
+- HTTP/2 opcional (`LLM_HTTP2`), sólo si el paquete `h2` está instalado.
+- Cuenta conexiones nuevas vs. reutilizadas usando la extensión `trace` de httpcore.
+- `warm_up` abre conexiones keep-alive por adelantado (el servidor lo llama ya escuchando,
+  con `LLM_POOL_WARMUP`): el primer turno no paga TCP + TLS.
+"""
+
+# Importaciones necesarias
+import asyncio  # Cliente creado en un hilo y precalentamiento concurrente
+import httpx  # Cliente HTTP asíncrono
+from app.config import settings  # Configuración del proyecto
+from app.utils import metrics  # Métricas del proceso
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("http_pool")
+
+# --- Estado global del pool ---
+# _client: Cliente compartido por todas las sesiones del proceso.
+# _stats: Contadores de requests enviados y conexiones TCP abiertas.
+_client: httpx.AsyncClient | None = None
+_stats = {"requests": 0, "connections": 0}
+
+def _http2_available() -> bool:
+    """
+    Indica si se puede usar HTTP/2 (requiere el paquete opcional `h2`).
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _build_client() -> httpx.AsyncClient:
+    """
+    Crea el `httpx.AsyncClient` con límites de pool y keep-alive.
+
+    - `LLM_POOL_MAX_CONNECTIONS`: conexiones totales (default `MAX_IN_FLIGHT`).
+    - `LLM_POOL_MAX_KEEPALIVE`: conexiones ociosas que se mantienen abiertas.
+    - `LLM_POOL_KEEPALIVE_EXPIRY`: segundos antes de cerrar una conexión ociosa.
+    - `LLM_HTTP2`: multiplexa requests sobre una sola conexión si es posible.
+    """
+    in_flight = int(getattr(settings, "MAX_IN_FLIGHT", None) or 20)
+    max_conns = int(getattr(settings, "LLM_POOL_MAX_CONNECTIONS", None) or in_flight)
+    max_keepalive = int(getattr(settings, "LLM_POOL_MAX_KEEPALIVE", None) or in_flight)
+    expiry = float(getattr(settings, "LLM_POOL_KEEPALIVE_EXPIRY", None) or 30.0)
+
+    http2 = bool(getattr(settings, "LLM_HTTP2", False))
+    if http2 and not _http2_available():
+        # Sin `h2` httpx fallaría al crear el cliente: degradar a HTTP/1.1
+        log.warning("LLM_HTTP2 activo pero falta el paquete 'h2'; usando HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_conns,
+        max_keepalive_connections=min(max_keepalive, max_conns),
+        keepalive_expiry=expiry,
+    )
+    log.info(
+        f"HTTP pool: max_conns={max_conns} keepalive={limits.max_keepalive_connections} "
+        f"expiry={expiry:.0f}s http2={http2}"
+    )
+    return httpx.AsyncClient(
+        timeout=getattr(settings, "LLM_TIMEOUT_SECONDS", None) or 30.0,
+        limits=limits,
+        http2=http2,
+    )
+
+async def start_http_client() -> httpx.AsyncClient:
+    """
+    Crea el cliente compartido (llamar una vez al iniciar el servidor).
+
+    - En un hilo: cargar los certificados del contexto SSL lleva ~100-200 ms y el loop
+      sigue atendiendo mientras tanto (por ejemplo, `/ready` respondiendo 503).
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = await asyncio.to_thread(_build_client)
+    return _client
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Devuelve el cliente compartido.
+
+    - Si el servidor no lo creó (por ejemplo, uso desde un script), se crea
+      perezosamente en la primera llamada.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+async def close_http_client() -> None:
+    """
+    Cierra el cliente compartido y registra el resumen de reutilización.
+    """
+    global _client
+    if _client is None:
+        return
+    stats = pool_stats()
+    log.info(
+        f"HTTP pool cerrado: {stats['requests']} requests, "
+        f"{stats['connections']} conexiones nuevas, {stats['reused']} reutilizadas"
+    )
+    await _client.aclose()
+    _client = None
+
+async def warm_up(urls: list[str], connections: int, timeout: float = 5.0) -> int:
+    """
+    Abre `connections` conexiones keep-alive hacia cada URL antes del primer turno.
+
+    - Un GET por conexión, en paralelo: el status (404/405 en un endpoint real) no importa,
+      sólo que la conexión quede en el pool.
+    - Una falla se loguea y no frena el arranque. Devuelve cuántos GET tuvieron respuesta.
+    """
+    client = get_http_client()
+
+    async def one(url: str) -> bool:
+        try:
+            await client.get(url, timeout=timeout, extensions=_TRACE_EXTENSIONS)
+        except httpx.HTTPError as e:
+            log.warning(f"Precalentamiento de {url} falló: {e!r}")
+            return False
+        return True
+
+    results = await asyncio.gather(*(one(url) for url in urls for _ in range(connections)))
+    return sum(results)
+
+async def _trace(event_name: str, info: dict) -> None:
+    """
+    Callback de la extensión `trace` de httpcore.
+
+    - `connection.connect_tcp.complete`: se abrió una conexión nueva.
+    - `http11/http2.send_request_headers.started`: se envió un request.
+    """
+    if event_name == "connection.connect_tcp.complete":
+        _stats["connections"] += 1
+    elif event_name.endswith(".send_request_headers.started"):
+        _stats["requests"] += 1
+
+# Extensiones a pasar en cada request (se crea una sola vez)
+_TRACE_EXTENSIONS = {"trace": _trace}
+
+def trace_extensions() -> dict:
+    """
+    Extensiones httpx para contar conexiones nuevas/reutilizadas.
+    """
+    return _TRACE_EXTENSIONS
+
+def pool_stats() -> dict:
+    """
+    Devuelve los contadores del pool: requests, conexiones nuevas y reutilizadas.
+    """
+    requests = _stats["requests"]
+    connections = _stats["connections"]
+    return {
+        "requests": requests,
+        "connections": connections,
+        "reused": max(0, requests - connections),
+    }
+
+# Métricas (se calculan al scrapear)
+metrics.counter("psicoia_llm_http_requests_total", "Requests HTTP enviados al LLM", fn=lambda: _stats["requests"])
+metrics.counter("psicoia_llm_http_connections_total", "Conexiones TCP nuevas hacia el LLM", fn=lambda: _stats["connections"])
@@ -1,45 +1,142 @@
 """
 Módulo para comunicar con un LLM remoto (Groq/OpenAI-compatible).
 
-- Gestiona la memoria de conversación en RAM, con soporte para múltiples sesiones.
+- Gestiona la memoria de conversación en RAM, con soporte para múltiples sesiones
+  (acotada por `SessionStore`: límite de sesiones, TTL de inactividad y LRU).
+- Opcionalmente persiste las historias (`HISTORY_BACKEND=sqlite`) y las carga
+  perezosamente en el primer acceso.
 - Implementa mecanismos de concurrencia seguros usando asyncio.Lock.
 - Proporciona funciones para construir mensajes y realizar llamadas al LLM.
+- Reutiliza un cliente HTTP compartido (pool con keep-alive) en lugar de abrir
+  una conexión nueva por cada solicitud.
+- Soporta streaming (`llm_stream`): deltas SSE como generador asíncrono.
+- Caché opcional de respuestas para conversaciones nuevas idénticas (`LLM_CACHE_ENABLED`).
+- Reintentos con presupuesto compartido y jitter, circuit breaker y hedging
+  opcional (ver `app.services.resilience`).
+- Resumen incremental opcional de los turnos viejos (`LLM_SUMMARY_ENABLED`, ver
+  `app.services.summarizer`).
+- Reparte los requests entre varios endpoints según latencia, errores y cuota
+  (ver `app.services.llm_router`); un reintento va a otro endpoint si hay.
+- El cuerpo del request se arma con bytes ya codificados (system prompt e historia) y
+  las respuestas se decodifican con `orjson` si está instalado (ver `app.services.payload`).
 """
 
-# --- Variables globales ---
-# _histories: Almacena el historial de mensajes por conversación.
-# _locks: Gestiona un asyncio.Lock por conversación para acceso seguro.
-_histories: dict[str, list[dict]] = defaultdict(list)
-_locks: dict[str, asyncio.Lock] = {}
+# Importaciones necesarias
+import asyncio  # Para locks y esperas asíncronas
+import time  # Para medir latencia
+from collections.abc import AsyncIterator  # Tipo del generador de streaming
+from functools import lru_cache  # Memoizar el costo del system prompt
+
+import httpx  # Cliente HTTP asíncrono
+
+from app.config import settings  # Configuración del proyecto
+from app.services.history import ConversationHistory  # Historia con tokens memoizados
+from app.services.conversation_store import get_store  # Persistencia opcional (write-behind)
+from app.services.session_store import Session, sessions  # Sesiones acotadas (historia + lock)
+from app.services.prompts import Prompt, prompts  # System prompts precargados por nombre
+from app.services.payload import LLMRequest, encode, loads  # Cuerpo del request ya serializado
+from app.services.summarizer import Summary, maybe_summarize, summary_start  # Resumen de turnos viejos
+from app.services.http_pool import get_http_client, pool_stats, trace_extensions  # Pool HTTP compartido
+from app.services.response_cache import get_cache  # Caché opcional de respuestas
+from app.services.llm_router import Endpoint, hedge_endpoint, router  # Endpoints y balanceo
+from app.services.resilience import (  # Presupuesto de reintentos y hedging
+    HEDGE_PERCENTILE, backoff_delay, latencies, retry_budget,
+)
+from app.services.tokenizer import get_tokenizer  # Conteo de tokens configurable
+from app.utils import metrics  # Métricas del proceso
+from app.utils.logger import get_logger, trace_fields  # Logger configurado (campos por mensaje)
+from app.utils.diagnostics import add_span, span  # Tramos HTTP/JSON del mensaje (diagnóstico)
+
+# Logger para este módulo
+log = get_logger("llm")
+
+# --- Parámetros leídos una sola vez (Settings no cambia en runtime) ---
+# _TOKENIZER: Backend de conteo de tokens (`LLM_TOKENIZER`).
+# _INPUT_BUDGET: Presupuesto total de tokens de entrada.
+_TOKENIZER = get_tokenizer()
+_INPUT_BUDGET = int(getattr(settings, "LLM_INPUT_TOKEN_BUDGET", 2000) or 2000)
+# Margen de tokens para seguridad/overhead en `build_messages`
+_BUDGET_MARGIN = 32
+
+# --- Métricas del camino al LLM ---
+_LLM_SECONDS = metrics.histogram("psicoia_llm_request_seconds",
+                                 "Latencia de cada intento al LLM (hasta el primer token en streaming)", ("endpoint",))
+_LLM_RESULTS = metrics.counter("psicoia_llm_requests_total", "Intentos al LLM por endpoint y resultado",
+                               ("endpoint", "result"))
+_LLM_TTFT = metrics.histogram("psicoia_llm_ttft_seconds", "Tiempo hasta el primer token (streaming)")
+_LLM_RETRIES = metrics.counter("psicoia_llm_retries_total", "Reintentos de 429/5xx y errores de red")
+_LLM_HEDGES = metrics.counter("psicoia_llm_hedges_total", "Requests de respaldo enviados")
+_PROMPT_TOKENS = metrics.histogram("psicoia_llm_prompt_tokens", "Tokens de entrada estimados por request",
+                                   buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+_LLM_FALLBACKS = metrics.counter("psicoia_llm_fallbacks_total", "Respuestas de respaldo por motivo (busy, status, error)",
+                                 ("reason",))
+metrics.counter("psicoia_llm_retry_budget_denied_total", "Reintentos negados por falta de presupuesto",
+                fn=lambda: retry_budget.denied)
 
 def _get_lock(cid: str) -> asyncio.Lock:
     """
     Obtener (o crear) un lock exclusivo para la conversación `cid`.
 
-    - Evita condiciones de carrera en acceso a `_histories[cid]`.
-    - Si no hay lock creado, se crea y se guarda en `_locks`.
+    - Evita condiciones de carrera en acceso a la historia de `cid`.
+    - El lock vive en la sesión de `sessions`; si no existe, se crea.
+    - Una sesión con el lock tomado nunca se desaloja.
     """
-    # Buscar lock existente
-    lock = _locks.get(cid)
-    # Si no existe, crear uno y almacenarlo
-    if lock is None:
-        lock = asyncio.Lock()
-        _locks[cid] = lock
-    # Devolver el lock (siempre un asyncio.Lock)
-    return lock
+    return sessions.get(cid).lock
+
+async def _session(cid: str) -> Session:
+    """
+    Devuelve la sesión de `cid`, cargando su historia del store persistente
+    la primera vez que se accede (carga perezosa).
+
+    - Con `HISTORY_BACKEND=memory` no hay nada que cargar.
+    - La carga se hace con el lock tomado: nadie ve la historia a medio cargar.
+    - Si mientras se esperaba el lock la sesión se liberó (`clear_history`,
+      `release_session`), se vuelve a buscar: nunca se carga en una sesión que ya no
+      está en `sessions`, así que todos usan la misma sesión para `cid`.
+    """
+    while True:
+        session = sessions.get(cid)
+        if session.loaded:
+            return session
+        async with session.lock:
+            if sessions.peek(cid) is not session:
+                continue
+            if not session.loaded:
+                store = get_store()
+                if store is not None:
+                    rows = await store.load(cid, session.history.max_messages)
+                    for role, content in rows:
+                        session.history.append(role, content, _est_tokens_text(content))
+                session.loaded = True
+        return session
 
 async def get_history(conversation_id: str) -> list[dict]:
     """
     Devuelve la historia completa de `conversation_id` de forma segura.
 
     - Usa el lock asociado para operaciones concurrentes.
-    - Devuelve una copia (`list(...)`) para que el llamador no mutile
+    - Devuelve dicts nuevos (`HistoryView.as_dicts`) para que el llamador no mutile
       la estructura interna compartida.
     """
+    session = await _session(conversation_id)
     # Adquirir lock para lectura segura
-    async with _get_lock(conversation_id):
-        # Retornar una copia de la lista de mensajes (puede ser vacía)
-        return list(_histories.get(conversation_id, []))
+    async with session.lock:
+        # Materializar los mensajes como dicts (puede ser vacía)
+        return session.history.messages.as_dicts()
+
+def _append(session: Session, conversation_id: str, role: str, text: str) -> None:
+    """
+    Agrega un mensaje a la historia de la sesión y lo encola en el store persistente.
+
+    - El costo en tokens se calcula acá, una sola vez por mensaje.
+    - El recorte a `LLM_HISTORY_MAX_MESSAGES` lo hace `ConversationHistory`.
+    - La escritura a disco es diferida: no bloquea el request.
+    - Debe llamarse con el lock de la conversación tomado.
+    """
+    session.history.append(role, text, _est_tokens_text(text))
+    store = get_store()
+    if store is not None:
+        store.append(conversation_id, role, text)
 
 async def append_user(conversation_id: str, text: str) -> None:
     """
@@ -48,9 +145,10 @@ async def append_user(conversation_id: str, text: str) -> None:
     - Guarda un diccionario con keys `role` y `content`.
     - Protegido con lock para concurrencia.
     """
+    session = await _session(conversation_id)
     # Bloquear la conversación mientras se muta la lista
-    async with _get_lock(conversation_id):
-        _histories[conversation_id].append({"role": "user", "content": text})
+    async with session.lock:
+        _append(session, conversation_id, "user", text)
 
 async def append_assistant(conversation_id: str, text: str) -> None:
     """
@@ -58,37 +156,55 @@ async def append_assistant(conversation_id: str, text: str) -> None:
 
     - Si la lista excede `LLM_HISTORY_MAX_MESSAGES`, recorta los mensajes
       más antiguos para mantener sólo los últimos `max_msgs`.
+    - Con `LLM_SUMMARY_ENABLED`, puede agendar el resumen de los turnos viejos.
     """
-    async with _get_lock(conversation_id):
-        # Añadir mensaje del asistente
-        _histories[conversation_id].append({"role": "assistant", "content": text})
-        # Número máximo de mensajes a almacenar (configurable)
-        max_msgs = getattr(settings, "LLM_HISTORY_MAX_MESSAGES", 200)
-        # Si excede, mantener sólo los últimos `max_msgs`
-        if len(_histories[conversation_id]) > max_msgs:
-            _histories[conversation_id] = _histories[conversation_id][-max_msgs:]
+    session = await _session(conversation_id)
+    async with session.lock:
+        # Añadir mensaje del asistente (recorta los más antiguos si excede)
+        _append(session, conversation_id, "assistant", text)
+        # Fin del turno: compactar lo viejo en segundo plano si la historia creció
+        maybe_summarize(session)
 
 async def clear_history(conversation_id: str) -> None:
     """
     Borrar la historia completa de `conversation_id`.
 
     - Útil para reiniciar el contexto de una sesión.
+    - Libera la sesión de RAM y borra la conversación del store persistente.
     """
     async with _get_lock(conversation_id):
-        _histories.pop(conversation_id, None)
+        sessions.release(conversation_id)
+        store = get_store()
+        if store is not None:
+            store.delete(conversation_id)
+
+async def release_session(conversation_id: str, resumable: bool = False) -> None:
+    """
+    Libera la sesión de RAM sin borrar lo persistido (al desconectarse el cliente).
+
+    - Con store persistente, la próxima vez se vuelve a cargar perezosamente.
+    - Una sesión `resumable` sin store persistente se deja en RAM: la reconexión
+      la encuentra ahí y, si nadie vuelve, la expira el TTL de `SessionStore`.
+    - Con store persistente espera a que lo encolado llegue a disco: otro worker
+      puede recibir la reconexión y cargar la historia desde ahí.
+    """
+    store = get_store()
+    if resumable and store is None:
+        return
+    async with _get_lock(conversation_id):
+        sessions.release(conversation_id)
+    if store is not None:
+        await store.flush()
 
 def _est_tokens_text(s: str) -> int:
     """
-    Estima el número de tokens para un texto `s` usando una regla simple.
+    Estima el número de tokens para un texto `s` con el tokenizador configurado.
 
-    - Usa `LLM_CHARS_PER_TOKEN` para dividir caracteres->tokens.
-    - No pretende reemplazar un tokenizador real, sólo sirve para control
-      del presupuesto de entrada.
+    - `chars`: divide caracteres por `LLM_CHARS_PER_TOKEN` (regla simple).
+    - `bpe`: cuenta con un vocabulario BPE local, memoizado en un LRU.
+    - Sólo sirve para control del presupuesto de entrada; al menos 1 token.
     """
-    # Chars per token (configurable), por seguridad al menos 1
-    cpt = max(1, int(getattr(settings, "LLM_CHARS_PER_TOKEN", 4) or 4))
-    # Redondeo hacia arriba de len(s)/cpt
-    return max(1, (len(s or "") + cpt - 1) // cpt)
+    return max(1, _TOKENIZER.count(s or ""))
 
 def _est_tokens_msg(msg: dict) -> int:
     """
@@ -98,195 +214,521 @@ def _est_tokens_msg(msg: dict) -> int:
     """
     return _est_tokens_text(msg.get("content", "") or "")
 
-def build_messages(system_prompt: str, history: list[dict], user_text: str) -> list[dict]:
+@lru_cache(maxsize=8)
+def _system_tokens(system_prompt: str) -> int:
+    """
+    Costo estimado del system prompt (constante): se calcula una sola vez.
+    """
+    return _est_tokens_text(system_prompt)
+
+def _window_start(history: ConversationHistory, summary: Summary | None, budget: int) -> int:
+    """
+    Primer mensaje de la historia que va al modelo: el sufijo que entra en `budget`
+    (descontado el resumen) y, con resumen, nunca antes de lo que ya resume.
+    """
+    if summary is None:
+        return history.window_start(budget)
+    return max(history.window_start(budget - summary.tokens), summary_start(history, summary))
+
+def build_messages(system_prompt: Prompt | str, history: ConversationHistory | list[dict] | None,
+                   user_text: str, summary: Summary | None = None) -> list[dict]:
     """
     Construye la lista `messages` que se enviará al modelo.
 
     - Incluye un `system` al inicio, preserva tantos mensajes previos como
       quepan en el presupuesto de tokens (`LLM_INPUT_TOKEN_BUDGET`), y
       finalmente añade el mensaje del usuario.
-    - La ventana es deslizante: se recogen mensajes desde el final hacia atrás
-      hasta llenar el presupuesto estimado.
+    - La ventana es deslizante: se conservan los mensajes más recientes
+      que entran en el presupuesto estimado.
+    - Con una `ConversationHistory` la ventana sale de la suma acumulada
+      (O(log n)); una lista de dicts se acepta por compatibilidad.
+    - Con un `Prompt` del registro se reusan su mensaje `system` (compartido, no
+      se modifica) y su costo precalculado; un texto suelto se acepta también.
+    - Con `summary` (ver `app.services.summarizer`), el resumen va después del system
+      y la ventana sólo toma mensajes posteriores a lo resumido.
     """
-    # Presupuesto total de tokens para el input (configurable)
-    budget = int(getattr(settings, "LLM_INPUT_TOKEN_BUDGET", 2000) or 2000)
     # Mensajes fijo: system al inicio y user al final
-    system_msg = {"role": "system", "content": system_prompt}
+    if isinstance(system_prompt, Prompt):
+        system_msg, system_tokens = system_prompt.message, system_prompt.tokens
+    else:
+        system_msg, system_tokens = {"role": "system", "content": system_prompt}, _system_tokens(system_prompt)
     user_msg = {"role": "user", "content": user_text}
 
-    # Dejamos un pequeño margen de tokens para seguridad/overhead
-    margin = 32
-    # Calcular tokens restantes después de system + user + margin
-    remaining = budget - _est_tokens_msg(system_msg) - _est_tokens_msg(user_msg) - margin
+    # Calcular tokens restantes después de system + user + margen
+    remaining = _INPUT_BUDGET - system_tokens - _est_tokens_text(user_text) - _BUDGET_MARGIN
     remaining = max(0, remaining)
 
-    # Recorrer la historia desde el final (más reciente) hacia atrás
-    # y recoger mensajes hasta llenar el presupuesto `remaining`.
-    picked: list[dict] = []
-    total = 0
-    for msg in reversed(history):
-        t = _est_tokens_msg(msg)  # tokens estimados de este mensaje
-        if total + t > remaining:
-            # Si añadir este mensaje excede el presupuesto, parar
-            break
-        picked.append(msg)
-        total += t
-    # Volver a orden original (más antiguo -> más nuevo)
-    picked.reverse()
+    if history is None:
+        picked: list[dict] = []
+    else:
+        if not isinstance(history, ConversationHistory):
+            # Lista plana: estimar una vez cada mensaje para poder usar la ventana
+            hist = ConversationHistory(max(1, len(history)))
+            for msg in history:
+                hist.append(msg["role"], msg["content"], _est_tokens_msg(msg))
+            history = hist
+        # Sufijo más largo de la historia que entra en `remaining`
+        picked = history.messages[_window_start(history, summary, remaining):].as_dicts()
+        if summary is not None:
+            picked = [summary.message, *picked]
+
+    # Devolver la secuencia completa: system + (resumen) + context escogido + user
+    return [system_msg, *picked, user_msg]
+
+# Respuesta local cuando no hay API key configurada (modo offline)
+OFFLINE_REPLY = "Estoy para acompañarte. Probemos respirar suave 4-4-4-4 y contame qué sentís ahora."
+# Respuesta de respaldo con el proveedor saturado (reintentos agotados o circuito abierto)
+BUSY_REPLY = "Estoy recibiendo muchas solicitudes. Probemos de nuevo en unos segundos."
+
+async def _build_request(user_text: str, conversation_id: str | None, stream: bool,
+                         prompt: str | None = None) -> LLMRequest:
+    """
+    Prepara el pedido de una llamada al LLM.
+
+    - Elige la ventana de la historia de `conversation_id` (si hay) como `build_messages`,
+      con el resumen de la sesión si lo hay.
+    - `prompt`: nombre del system prompt de la sesión (None = `PROMPT_DEFAULT`).
+    - Compartido por la llamada normal (`llm_generate`) y la de streaming (`llm_stream`).
+    - Sólo se codifica el mensaje del usuario: el system y la historia ya tienen su JSON
+      (ver `app.services.payload`).
+    - URL, headers (clave, `X-Request-ID`) y modelo los pone el endpoint elegido.
+    """
+    system_prompt = prompts.get(prompt)
+    user_msg = {"role": "user", "content": user_text}
+    user_tokens = _est_tokens_text(user_text)
+    remaining = max(0, _INPUT_BUDGET - system_prompt.tokens - user_tokens - _BUDGET_MARGIN)
+    tokens = system_prompt.tokens + user_tokens
+
+    # Ventana sobre la historia viva de la conversación: sólo se copian las
+    # referencias de los registros elegidos y de sus bytes, no su contenido.
+    if conversation_id:
+        session = await _session(conversation_id)
+        async with session.lock:
+            history, summary = session.history, session.summary
+            start = _window_start(history, summary, remaining)
+            picked = history.messages[start:].records()
+            picked_json = [msg.json for msg in picked]
+            tokens += history.tokens_from(start)
+        if summary is not None:
+            picked, picked_json = [summary.message, *picked], [summary.encoded, *picked_json]
+            tokens += summary.tokens
+    else:
+        picked, picked_json = [], []
+    _PROMPT_TOKENS.observe(tokens)
+
+    return LLMRequest(
+        model=settings.MODEL_NAME,
+        messages=[system_prompt.message, *picked, user_msg],
+        encoded=[system_prompt.json, *picked_json, encode(user_msg)],
+        temperature=settings.LLM_TEMPERATURE,
+        max_tokens=settings.LLM_MAX_TOKENS,
+        stream=stream,
+    )
+
+def _cache_lookup(payload: LLMRequest, user_text: str) -> tuple[str | None, str | None]:
+    """
+    Consulta la caché de respuestas (si está activa).
 
-    # Devolver la secuencia completa: system + context escogido + user
-    return [system_msg] + picked + [user_msg]
+    - Devuelve `(clave, respuesta)`: clave None si el pedido no es cacheable,
+      respuesta None si hay que ir al proveedor (y luego guardar con la clave).
+    """
+    cache = get_cache()
+    if cache is None:
+        return None, None
+    key = cache.key_for(payload, user_text)
+    return key, (cache.get(key) if key is not None else None)
 
-def _read_system_prompt_from_file(module_basename: str) -> str | None:
+def _cache_store(key: str | None, content: str) -> None:
+    """
+    Guarda `content` como variante de `key` en la caché (si corresponde).
+    """
+    cache = get_cache()
+    if cache is not None and key is not None and content:
+        cache.put(key, content)
+
+def _observe(endpoint: Endpoint, latency: float | None, result: str) -> None:
+    """
+    Registra un intento en el router y en las métricas.
+
+    - `result`: `ok`, `rejected` (4xx del pedido), `transient` (429/5xx) o `error` (red).
+    """
+    endpoint.observe(latency, result in ("ok", "rejected"))
+    _LLM_RESULTS.labels(endpoint.name, result).inc()
+    if latency is not None:
+        _LLM_SECONDS.labels(endpoint.name).observe(latency)
+
+def _transient(status: int) -> bool:
+    """
+    429 (rate-limit) y 5xx: errores transitorios del proveedor (se reintentan).
+    """
+    return status == 429 or 500 <= status < 600
+
+def _send(client: httpx.AsyncClient, endpoint: Endpoint, payload: LLMRequest, trace_id: str | None):
+    """
+    POST de `payload` a `endpoint` (con su clave y su modelo), con el cuerpo ya codificado.
     """
-    Lee el valor de SYSTEM_PROMPT desde un archivo en `app/prompts` usando ast.
+    return client.post(endpoint.url, headers=endpoint.request_headers(trace_id),
+                       content=payload.body(endpoint.model), extensions=trace_extensions())
 
-    - Evita importar el módulo directamente para prevenir efectos secundarios.
-    - Devuelve el valor de la constante o None si no se encuentra.
+async def _post(client: httpx.AsyncClient, endpoint: Endpoint, payload: LLMRequest,
+                trace_id: str | None) -> httpx.Response:
     """
+    POST al LLM, con request de respaldo ("hedge") opcional.
+
+    - Con `LLM_HEDGE_URL`, si la respuesta tarda más que el percentil
+      `LLM_HEDGE_PERCENTILE` de las latencias recientes, se envía el mismo pedido
+      a la URL secundaria y gana la primera respuesta sana.
+    - El hedge consume del presupuesto de reintentos: en una caída no duplica la carga.
+    - Si el llamador se cancela (el cliente se desconectó), se cancelan los POST en curso:
+      no siguen gastando cuota con el endpoint ya liberado en el router.
+    """
+    threshold = latencies.percentile(HEDGE_PERCENTILE) if hedge_endpoint is not None else None
+    primary = asyncio.ensure_future(_send(client, endpoint, payload, trace_id))
+    if threshold is None:
+        return await primary
     try:
-        # Directorio `app/prompts`
-        prompts_dir = Path(__file__).resolve().parents[1] / "prompts"
-        file_path = prompts_dir / f"{module_basename}.py"
-        # Si no existe el archivo, no hay prompt personalizado
-        if not file_path.exists():
-            return None
-        # Leer el contenido del archivo y parsearlo con ast
-        source = file_path.read_text(encoding="utf-8")
-        tree = ast.parse(source, filename=str(file_path))
-        # Buscar asignaciones top-level cuyo target sea `SYSTEM_PROMPT`
-        for node in tree.body:
-            if isinstance(node, ast.Assign):
-                for target in node.targets:
-                    if getattr(target, "id", None) == "SYSTEM_PROMPT":
-                        value = node.value
-                        # Si es una constante string simple
-                        if isinstance(value, ast.Constant) and isinstance(value.value, str):
-                            return value.value
-                        # Intentar evaluar literales compuestas (concatenaciones)
-                        try:
-                            return ast.literal_eval(value)
-                        except Exception:
-                            return None
-        # Si no encontramos la variable, devolver None
-        return None
-    except Exception:
-        # En caso de error de parseo o I/O, devolver None silenciosamente
-        return None
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+    except asyncio.CancelledError:
+        # `asyncio.wait` no cancela lo que espera
+        primary.cancel()
+        raise
+    if done or not retry_budget.withdraw():
+        return await primary
+
+    _LLM_HEDGES.inc()
+    log.info("[%s] LLM hedge → %s (>%.0f ms)", trace_id or "-", hedge_endpoint.url, threshold * 1000, extra=trace_fields(trace_id))
+    hedge = asyncio.ensure_future(_send(client, hedge_endpoint, payload, trace_id))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and not _transient(task.result().status_code):
+                    return task.result()
+        # Ninguna respuesta sana: la del pedido original, salvo que haya fallado y el hedge
+        # tenga una respuesta (se reintenta igual, pero con su status y `Retry-After`)
+        if primary.exception() is not None and hedge.exception() is None:
+            return hedge.result()
+        return primary.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def _should_retry(resp: httpx.Response | None, endpoint: Endpoint, attempt: int,
+                        trace_id: str | None, what: str) -> bool:
+    """
+    Decide (y espera) el reintento de un 429/5xx de `endpoint` (o de un error de red o
+    timeout, con `resp=None`).
 
-async def llm_generate(user_text: str, trace_id: str | None = None, conversation_id: str | None = None) -> str:
+    - Sólo reintenta si quedan intentos y presupuesto de reintentos del proceso.
+    - Si hay otro endpoint sano, reintenta ahí sin esperar.
+    - Si no, espera con backoff exponencial + jitter (o `Retry-After`); el
+      circuit breaker del endpoint se consulta al volver a elegirlo.
+    """
+    if attempt >= settings.LLM_MAX_RETRIES:
+        return False
+    reason = resp.status_code if resp is not None else "error de red"
+    if not retry_budget.withdraw():
+        log.warning("[%s] %s %s: sin presupuesto de reintentos", trace_id or "-", what, reason, extra=trace_fields(trace_id))
+        return False
+    _LLM_RETRIES.inc()
+    if router.has_alternative(endpoint):
+        log.warning("[%s] %s %s en %s, retry %d/%d en otro endpoint", trace_id or "-", what,
+                    reason, endpoint.name, attempt, settings.LLM_MAX_RETRIES, extra=trace_fields(trace_id))
+        return True
+    wait = backoff_delay(attempt, resp.headers.get("Retry-After") if resp is not None else None)
+    log.warning("[%s] %s, retry %d/%d in %.2fs", trace_id or "-", what, attempt, settings.LLM_MAX_RETRIES, wait,
+                extra=trace_fields(trace_id))
+    await asyncio.sleep(wait)
+    return True
+
+async def llm_generate(user_text: str, trace_id: str | None = None, conversation_id: str | None = None,
+                       prompt: str | None = None) -> str:
     """
     Llama a LLaMA en Groq (API OpenAI-compatible).
 
     - Requiere GROQ_API_KEY y MODEL_NAME en el .env.
     - Usa settings.LLM_URL si está definido; si no, fallback al endpoint de Groq.
+    - Con `LLM_ENDPOINTS`, cada intento va al endpoint que elige `router`.
+    - `prompt`: nombre del system prompt (registro `app.services.prompts`; None = default).
+    - La sesión de `conversation_id` queda fijada (`SessionStore.in_use`) durante todo el
+      turno: el TTL o el LRU no la desalojan mientras se espera al proveedor.
     """
-    # Obtener credenciales; si no hay API key, usamos una respuesta por defecto
-    api_key = getattr(settings, "GROQ_API_KEY", None)
-    # Si no está configurada la API key, devolvemos una respuesta local
-    if not api_key:
+    with sessions.in_use(conversation_id):
+        return await _generate(user_text, trace_id, conversation_id, prompt)
+
+async def _generate(user_text: str, trace_id: str | None, conversation_id: str | None,
+                    prompt: str | None) -> str:
+    """Cuerpo de `llm_generate`, con la sesión ya fijada."""
+    # Sin ningún endpoint con API key configurada, devolvemos una respuesta local
+    if not router.endpoints:
         # Guardar el turno del usuario y la respuesta simulada en la historia
         if conversation_id:
             await append_user(conversation_id, user_text)
-            await append_assistant(conversation_id, "Estoy para acompañarte. Probemos respirar suave 4-4-4-4 y contame qué sentís ahora.")
+            await append_assistant(conversation_id, OFFLINE_REPLY)
         # Respuesta por defecto en modo offline
-        return "Estoy para acompañarte. Probemos respirar suave 4-4-4-4 y contame qué sentís ahora."
-
-    url = getattr(settings, "LLM_URL", None)
-    model = settings.MODEL_NAME
-    system_prompt = SYSTEM_PROMPT
-
-    # Construir headers para la API compatible con OpenAI (Groq)
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    # Si se pasó un trace_id, añadirlo para trazabilidad en logs/proxies
-    if trace_id:
-        headers["X-Request-ID"] = trace_id
-
-    # Recuperar la historia asociada a la conversación (si hay)
-    conv_key = conversation_id
-    history = await get_history(conv_key) if conv_key else []
-    # Construir la lista `messages` (system + contexto + user)
-    messages = build_messages(system_prompt, history, user_text)
-
-    # Payload para la API: modelo, mensajes y parámetros de generación
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": settings.LLM_TEMPERATURE,
-        "max_tokens": settings.LLM_MAX_TOKENS,
-        "stream": False,
-    }
+        return OFFLINE_REPLY
+
+    payload = await _build_request(user_text, conversation_id, stream=False, prompt=prompt)
     # Guardar el turno del usuario en la historia antes de la llamada
     # para no perder el registro en caso de fallo de red/proveedor.
     if conversation_id:
         await append_user(conversation_id, user_text)
 
+    # Pedido idéntico ya respondido (conversación nueva): no pagar latencia ni cuota
+    cache_key, cached = _cache_lookup(payload, user_text)
+    if cached is not None:
+        log.info("[%s] LLM cache hit (%d chars)", trace_id or "-", len(cached), extra=trace_fields(trace_id))
+        if conversation_id:
+            await append_assistant(conversation_id, cached)
+        return cached
+
+    retry_budget.deposit()
+
     try:
         # Marcar tiempo de inicio para métricas
         t0 = time.perf_counter()
-        log.info(f"[{trace_id or '-'}] POST {url} model={model} len={len(user_text)}")
-
-        # Realizar la petición HTTP con reintentos (httpx.AsyncClient)
-        async with httpx.AsyncClient(timeout=settings.LLM_TIMEOUT_SECONDS) as client:
-            for attempt in range(1, settings.LLM_MAX_RETRIES + 1):
-                # Enviar POST al endpoint configurado
-                resp = await client.post(url, headers=headers, json=payload)
-                status = resp.status_code
-
-                # Manejo de errores transitorios: 429 (rate-limit) y 5xx
-                if status == 429 or 500 <= status < 600:
-                    # Intentar respetar header Retry-After si viene
-                    retry_after = resp.headers.get("Retry-After")
-                    if retry_after:
-                        try:
-                            wait = float(retry_after)
-                        except Exception:
-                            wait = settings.LLM_BACKOFF_INITIAL
-                    else:
-                        # Backoff exponencial con límite superior
-                        wait = min(
-                            settings.LLM_BACKOFF_MAX,
-                            settings.LLM_BACKOFF_INITIAL * (2 ** (attempt - 1))
-                        )
-                    log.warning(f"[{trace_id or '-'}] LLM, retry {attempt}/{settings.LLM_MAX_RETRIES} in {wait:.2f}s")
-                    if attempt == settings.LLM_MAX_RETRIES:
-                        # Si es el último intento, romper y devolver mensaje amigable
-                        break
-                    # Esperar antes de reintentar
-                    await asyncio.sleep(wait)
+        # Cliente compartido del proceso: reutiliza conexiones (keep-alive)
+        client = get_http_client()
+        failed: Endpoint | None = None  # Endpoint del intento anterior fallido
+        # Realizar la petición HTTP con reintentos
+        for attempt in range(1, settings.LLM_MAX_RETRIES + 1):
+            # Elegir endpoint; ninguno disponible (circuitos abiertos): fallar al instante
+            endpoint = await router.acquire(avoid=failed)
+            if endpoint is None:
+                log.warning("[%s] LLM sin endpoints disponibles: respuesta de respaldo", trace_id or "-", extra=trace_fields(trace_id))
+                break
+            log.info("[%s] POST %s model=%s len=%d", trace_id or "-", endpoint.name, endpoint.model,
+                     len(user_text), extra=trace_fields(trace_id))
+            # Enviar POST al endpoint elegido (con hedge opcional)
+            t_attempt = time.perf_counter()
+            try:
+                with span("http"):
+                    resp = await _post(client, endpoint, payload, trace_id)
+            except httpx.TransportError as e:
+                # Conexión o timeout: el endpoint cuenta como caído y se reintenta como un
+                # 429/5xx (en otro endpoint sano, si hay)
+                _observe(endpoint, None, "error")
+                log.warning("[%s] LLM %s en %s: %s", trace_id or "-", type(e).__name__, endpoint.name, e,
+                            extra=trace_fields(trace_id))
+                resp = None
+            finally:
+                router.release(endpoint)
+            if resp is None:
+                failed = endpoint
+                if await _should_retry(None, endpoint, attempt, trace_id, "LLM"):
                     continue
-
-                # Si el código no fue transitorio, forzar raise_for_status
-                resp.raise_for_status()
-                # Parsear JSON de la respuesta
-                data = resp.json()
-
-                # Extraer el contenido en formato OpenAI-compatible
-                content = (data.get("choices", [{}])[0]
-                               .get("message", {})
-                               .get("content", "")
-                               .strip())
-
-                # Registrar tiempo total de respuesta
-                dt_ms = (time.perf_counter() - t0) * 1000
-                log.info(f"[{trace_id or '-'}] LLM OK ({len(content or '')} chars) {dt_ms:.0f} ms")
-
-                # Guardar respuesta del asistente en la historia si corresponde
-                if conversation_id:
-                    await append_assistant(conversation_id, content or "")
-                # Devolver contenido (o mensaje por defecto si está vacío)
-                return content or "No recibí respuesta del modelo."
+                break
+            endpoint.update_limits(resp.headers, resp.status_code)
+
+            # Manejo de errores transitorios: 429 (rate-limit) y 5xx
+            if _transient(resp.status_code):
+                _observe(endpoint, None, "transient")
+                failed = endpoint
+                if await _should_retry(resp, endpoint, attempt, trace_id, "LLM"):
+                    continue
+                # Sin intentos o sin presupuesto: mensaje amigable
+                break
+
+            # El proveedor respondió (aunque sea un 4xx del pedido): está sano
+            elapsed = time.perf_counter() - t_attempt
+            _observe(endpoint, elapsed, "rejected" if resp.is_error else "ok")
+            latencies.add(elapsed)
+            # Si el código no fue transitorio, forzar raise_for_status
+            resp.raise_for_status()
+            # Parsear JSON de la respuesta
+            with span("decode"):
+                data = loads(resp.content)
+
+            # Extraer el contenido en formato OpenAI-compatible
+            content = (data.get("choices", [{}])[0]
+                           .get("message", {})
+                           .get("content", "")
+                           .strip())
+
+            # Registrar tiempo total de respuesta
+            dt_ms = (time.perf_counter() - t0) * 1000
+            stats = pool_stats()
+            log.info(
+                "[%s] LLM OK (%d chars) %.0f ms (conn reused %d/%d)", trace_id or "-", len(content or ""), dt_ms,
+                stats["reused"], stats["requests"], extra=trace_fields(trace_id),
+            )
+
+            # Guardar respuesta del asistente en la historia si corresponde
+            if conversation_id:
+                await append_assistant(conversation_id, content or "")
+            _cache_store(cache_key, content)
+            # Devolver contenido (o mensaje por defecto si está vacío)
+            return content or "No recibí respuesta del modelo."
 
         # Si agotamos reintentos sin una respuesta válida
-        return "Estoy recibiendo muchas solicitudes. Probemos de nuevo en unos segundos."
+        _LLM_FALLBACKS.labels("busy").inc()
+        return BUSY_REPLY
     except httpx.HTTPStatusError as e:
         # Errores HTTP manejados aquí
-        log.error(f"[{trace_id or '-'}] Groq error: {e}")
+        log.error("[%s] Groq error: %s", trace_id or "-", e, extra=trace_fields(trace_id))
+        _LLM_FALLBACKS.labels("status").inc()
         return "Hubo un problema con el proveedor. Intentá más tarde."
     except Exception as e:
         # Otros errores (timeout, parseo, etc.)
-        log.error(f"[{trace_id or '-'}] Groq error: {e}")
+        log.error("[%s] Groq error: %s", trace_id or "-", e, extra=trace_fields(trace_id))
+        _LLM_FALLBACKS.labels("error").inc()
         return "Ocurrió un error al consultar el modelo. Intentá de nuevo."
+
+def _sse_delta(line: str) -> str | None:
+    """
+    Extrae el texto de una línea SSE de chat completions en streaming.
+
+    - `data: {...}` → `choices[0].delta.content` (puede ser "").
+    - `data: [DONE]` → None (fin del stream).
+    - Comentarios, `event:` o líneas vacías → "".
+    """
+    if not line.startswith("data:"):
+        return ""
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return None
+    try:
+        chunk = loads(data)
+    except ValueError:
+        return ""
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+async def llm_stream(user_text: str, trace_id: str | None = None,
+                     conversation_id: str | None = None, prompt: str | None = None) -> AsyncIterator[str]:
+    """
+    Versión en streaming de `llm_generate`: genera los deltas de texto a medida que llegan.
+
+    - Pide `"stream": true` y parsea los eventos SSE del proveedor.
+    - Reintenta 429/5xx y errores de red sólo antes del primer token (después ya se envió
+      texto al cliente), con el mismo presupuesto y router que `llm_generate` (sin hedging).
+    - La latencia que aprende el router es el tiempo hasta el primer token.
+    - La respuesta del asistente se guarda en la historia UNA sola vez, al completarse el stream.
+    - Registra el tiempo hasta el primer token (TTFT) y el tiempo total.
+    - `prompt`: como en `llm_generate`; la sesión queda fijada igual que allí.
+    """
+    with sessions.in_use(conversation_id):
+        async for delta in _stream(user_text, trace_id, conversation_id, prompt):
+            yield delta
+
+async def _stream(user_text: str, trace_id: str | None, conversation_id: str | None,
+                  prompt: str | None) -> AsyncIterator[str]:
+    """Cuerpo de `llm_stream`, con la sesión ya fijada."""
+    if not router.endpoints:
+        # Modo offline: un único "delta" con la respuesta por defecto
+        if conversation_id:
+            await append_user(conversation_id, user_text)
+            await append_assistant(conversation_id, OFFLINE_REPLY)
+        yield OFFLINE_REPLY
+        return
+
+    payload = await _build_request(user_text, conversation_id, stream=True, prompt=prompt)
+    if conversation_id:
+        await append_user(conversation_id, user_text)
+
+    # Acierto de caché: la respuesta completa como un único delta
+    cache_key, cached = _cache_lookup(payload, user_text)
+    if cached is not None:
+        log.info("[%s] LLM cache hit (%d chars) stream", trace_id or "-", len(cached), extra=trace_fields(trace_id))
+        if conversation_id:
+            await append_assistant(conversation_id, cached)
+        yield cached
+        return
+
+    retry_budget.deposit()
+
+    parts: list[str] = []  # Deltas recibidos (se unen al final)
+    t0 = time.perf_counter()
+    ttft_ms: float | None = None
+    try:
+        client = get_http_client()
+        failed: Endpoint | None = None
+        for attempt in range(1, settings.LLM_MAX_RETRIES + 1):
+            endpoint = await router.acquire(avoid=failed)
+            if endpoint is None:
+                log.warning("[%s] LLM sin endpoints disponibles: respuesta de respaldo", trace_id or "-", extra=trace_fields(trace_id))
+                break
+            log.info("[%s] POST %s model=%s len=%d stream", trace_id or "-", endpoint.name, endpoint.model,
+                     len(user_text), extra=trace_fields(trace_id))
+            t_attempt = time.perf_counter()
+            resp = None
+            try:
+                async with client.stream("POST", endpoint.url, headers=endpoint.request_headers(trace_id),
+                                         content=payload.body(endpoint.model),
+                                         extensions=trace_extensions()) as resp:
+                    add_span("http", time.perf_counter() - t_attempt)  # Hasta los headers
+                    endpoint.update_limits(resp.headers, resp.status_code)
+                    if not _transient(resp.status_code):
+                        if resp.is_error:
+                            _observe(endpoint, None, "rejected")  # 4xx del pedido: el endpoint está sano
+                            resp.raise_for_status()
+                        first: float | None = None
+                        t_read = time.perf_counter()
+                        async for line in resp.aiter_lines():
+                            # Espera del cuerpo (sin el tiempo que el consumidor tarda en escribir)
+                            add_span("http", time.perf_counter() - t_read)
+                            t_read = time.perf_counter()
+                            delta = _sse_delta(line)
+                            if delta is None:
+                                break
+                            if not delta:
+                                continue
+                            if first is None:
+                                first = time.perf_counter() - t_attempt
+                                ttft_ms = (time.perf_counter() - t0) * 1000
+                                _LLM_TTFT.observe(ttft_ms / 1000)
+                            parts.append(delta)
+                            yield delta
+                            t_read = time.perf_counter()
+                        _observe(endpoint, first if first is not None else time.perf_counter() - t_attempt, "ok")
+            except httpx.TransportError as e:
+                _observe(endpoint, None, "error")
+                if parts:
+                    raise  # Ya se envió texto al cliente: no se puede reintentar
+                log.warning("[%s] LLM stream %s en %s: %s", trace_id or "-", type(e).__name__, endpoint.name, e,
+                            extra=trace_fields(trace_id))
+                resp = None
+            finally:
+                router.release(endpoint)
+
+            if resp is None:
+                # Error de red o timeout antes del primer token: reintentar como un 429/5xx
+                failed = endpoint
+                if await _should_retry(None, endpoint, attempt, trace_id, "LLM stream"):
+                    continue
+                break
+            if _transient(resp.status_code):
+                _observe(endpoint, None, "transient")
+                failed = endpoint
+                if await _should_retry(resp, endpoint, attempt, trace_id, "LLM stream"):
+                    continue
+                break
+
+            content = "".join(parts).strip()
+            dt_ms = (time.perf_counter() - t0) * 1000
+            log.info(
+                "[%s] LLM stream OK (%d chars) ttft=%.0f ms total=%.0f ms", trace_id or "-", len(content),
+                ttft_ms or dt_ms, dt_ms, extra=trace_fields(trace_id),
+            )
+            # Commit único de la respuesta completa en la historia
+            if conversation_id:
+                await append_assistant(conversation_id, content)
+            _cache_store(cache_key, content)
+            if not content:
+                yield "No recibí respuesta del modelo."
+            return
+
+        # Si agotamos reintentos sin una respuesta válida
+        _LLM_FALLBACKS.labels("busy").inc()
+        yield BUSY_REPLY
+    except httpx.HTTPStatusError as e:
+        log.error("[%s] Groq error: %s", trace_id or "-", e, extra=trace_fields(trace_id))
+        _LLM_FALLBACKS.labels("status").inc()
+        if not parts:
+            yield "Hubo un problema con el proveedor. Intentá más tarde."
+    except Exception as e:
+        log.error("[%s] Groq error: %s", trace_id or "-", e, extra=trace_fields(trace_id))
+        _LLM_FALLBACKS.labels("error").inc()
+        if not parts:
+            yield "Ocurrió un error al consultar el modelo. Intentá de nuevo."
@@ -0,0 +1,361 @@
+"""
+Router multi-endpoint para las llamadas al LLM.
+
+- `LLM_ENDPOINTS`: lista JSON de endpoints OpenAI-compatibles (otras claves, regiones
+  o modelos), por ejemplo
+  `[{"name": "groq-a", "api_key": "gsk_a"}, {"name": "otro", "url": "https://...", "model": "m", "max_concurrency": 8}]`.
+  Los campos que faltan salen de `LLM_URL` / `GROQ_API_KEY` / `MODEL_NAME`.
+  Sin `LLM_ENDPOINTS` hay un único endpoint con esos valores (como antes).
+- Cada request va al endpoint de menor costo esperado: latencia EWMA (sensible a
+  picos y que decae sin muestras nuevas, así un endpoint abandonado se vuelve a
+  probar) × (requests en curso + 1), penalizado por la tasa de errores reciente.
+- Se saltean los endpoints con el circuito abierto, en enfriamiento (`Retry-After`,
+  `x-ratelimit-remaining-*` agotados) o en su tope de concurrencia (`max_concurrency`,
+  default `LLM_ENDPOINT_MAX_CONCURRENCY`); si todos los sanos están en su tope, se
+  espera a que se libere un lugar.
+- `stats()`: por endpoint, en curso, latencia, tasa de errores, salud y cuota restante.
+"""
+
+# Importaciones necesarias
+import asyncio  # Espera por un lugar libre
+import json  # Parsear LLM_ENDPOINTS
+import math  # Decaimiento de la latencia
+import random  # Desempate entre endpoints equivalentes
+import re  # Duraciones de los headers de rate-limit
+import time  # Relojes monotónicos
+from collections.abc import Mapping  # Headers de la respuesta
+
+from app.config import settings  # Configuración del proyecto
+from app.services.resilience import HEDGE_URL, CircuitBreaker, breaker_from_settings  # Breaker por endpoint
+from app.utils import metrics  # Métricas del proceso
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("llm_router")
+
+# Endpoint por defecto si no se configura `LLM_URL`
+DEFAULT_URL = "https://api.groq.com/openai/v1/chat/completions"
+# Suavizado de la latencia (cuando baja) y de la tasa de errores
+_LATENCY_ALPHA = 0.3
+_ERROR_ALPHA = 0.1
+# Segundos en que la latencia medida pierde ~63% de su peso sin muestras nuevas
+_DECAY_SECONDS = 30.0
+# Enfriamiento ante un 429 sin `Retry-After` ni headers de cuota
+_DEFAULT_COOLDOWN = 1.0
+# Tokens que necesita un pedido (para `x-ratelimit-remaining-tokens`)
+_TOKENS_NEEDED = int(getattr(settings, "LLM_MAX_TOKENS", None) or 1)
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_duration(value: str | None) -> float | None:
+    """
+    Convierte una duración de los headers de rate-limit a segundos.
+
+    - Segundos sueltos (`Retry-After: 2`) o el formato de OpenAI/Groq (`7.66s`, `2m59.56s`, `120ms`).
+    - None si no hay valor o no se entiende.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _UNITS[unit] for amount, unit in parts)
+
+class Endpoint:
+    def __init__(self, name: str, url: str, api_key: str, model: str, max_concurrency: int = 0,
+                 breaker: CircuitBreaker | None = None):
+        """
+        Un endpoint OpenAI-compatible con su estado de salud.
+
+        - `max_concurrency`: requests simultáneos (0 = sin tope propio).
+        - `breaker`: circuit breaker propio (default `LLM_BREAKER_*`).
+        """
+        self.name = name
+        self.url = url
+        self.model = model
+        self.max_concurrency = max(0, max_concurrency)
+        self.breaker = breaker or breaker_from_settings(name)
+        self.headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        self.in_flight = 0
+        self.error_rate = 0.0  # EWMA de fallas (0..1)
+        self.cooldown_until = 0.0  # No usar antes de este instante (monotónico)
+        self.remaining_requests: int | None = None  # Último `x-ratelimit-remaining-requests`
+        self.remaining_tokens: int | None = None  # Último `x-ratelimit-remaining-tokens`
+        self._limits_until = 0.0  # Hasta cuándo vale `remaining_requests`
+        self._latency: float | None = None  # EWMA de latencia (s)
+        self._latency_at = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def latency(self, now: float) -> float:
+        """
+        Latencia estimada (s): la EWMA, decayendo hacia 0 mientras no haya muestras.
+        """
+        if self._latency is None:
+            return 0.0
+        return self._latency * math.exp(-(now - self._latency_at) / _DECAY_SECONDS)
+
+    def cost(self, now: float) -> float:
+        """
+        Costo esperado de mandar un request más: latencia × (en curso + 1) / tasa de éxito.
+        """
+        return max(self.latency(now), 0.001) * (self.in_flight + 1) / max(0.05, 1.0 - self.error_rate)
+
+    def saturated(self) -> bool:
+        return 0 < self.max_concurrency <= self.in_flight
+
+    def available_at(self, now: float) -> float:
+        """
+        Desde cuándo se le puede volver a enviar (pausa o cuota agotada); inf con el circuito abierto.
+        """
+        if not self.breaker.ready():
+            return math.inf
+        at = self.cooldown_until
+        if self.remaining_requests is not None and now < self._limits_until and self.remaining_requests <= self.in_flight:
+            at = max(at, self._limits_until)
+        return at
+
+    def usable(self, now: float) -> bool:
+        """
+        Sano y con cuota (no mira la concurrencia).
+        """
+        return self.available_at(now) <= now
+
+    def health(self, now: float) -> float:
+        """
+        Puntaje de salud 0..1 (0 = no se le envían requests).
+        """
+        return (1.0 - self.error_rate) if self.usable(now) else 0.0
+
+    def observe(self, latency: float | None, ok: bool) -> None:
+        """
+        Registra el resultado de un request (`latency` en segundos, None si falló).
+        """
+        now = time.monotonic()
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.error_rate += _ERROR_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        if latency is not None:
+            current = self.latency(now)
+            if self._latency is None or latency > current:
+                self._latency = latency  # Los picos se toman enseguida
+            else:
+                self._latency = current + _LATENCY_ALPHA * (latency - current)
+            self._latency_at = now
+        self.breaker.record(ok)
+
+    def update_limits(self, headers: Mapping[str, str], status: int) -> None:
+        """
+        Lee `Retry-After` y `x-ratelimit-*` de una respuesta para no llegar al 429.
+
+        - `remaining-requests`: no se mandan más requests en curso que los que quedan
+          hasta `reset-requests`.
+        - `remaining-tokens` menor a `LLM_MAX_TOKENS`: enfriamiento hasta `reset-tokens`.
+        - 429/5xx con `Retry-After`: enfriamiento por ese tiempo.
+        """
+        now = time.monotonic()
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None and remaining.isdigit():
+            self.remaining_requests = int(remaining)
+            self._limits_until = now + (parse_duration(headers.get("x-ratelimit-reset-requests")) or _DEFAULT_COOLDOWN)
+        tokens = headers.get("x-ratelimit-remaining-tokens")
+        if tokens is not None and tokens.isdigit():
+            self.remaining_tokens = int(tokens)
+            if self.remaining_tokens < _TOKENS_NEEDED:
+                reset = parse_duration(headers.get("x-ratelimit-reset-tokens")) or _DEFAULT_COOLDOWN
+                self._cool(now + reset, "tokens agotados")
+        if status == 429 or status >= 500:
+            retry_after = parse_duration(headers.get("retry-after"))
+            if retry_after is not None:
+                self._cool(now + retry_after, f"{status} Retry-After")
+            elif status == 429 and remaining is None:
+                self._cool(now + _DEFAULT_COOLDOWN, "429")
+
+    def _cool(self, until: float, reason: str) -> None:
+        if until > self.cooldown_until:
+            if self.cooldown_until <= time.monotonic():
+                log.info(f"Endpoint {self.name}: en pausa {until - time.monotonic():.1f}s ({reason})")
+            self.cooldown_until = until
+
+    def request_headers(self, trace_id: str | None) -> dict:
+        """
+        Headers del request (clave del endpoint + `X-Request-ID`).
+        """
+        if not trace_id:
+            return self.headers
+        return {**self.headers, "X-Request-ID": trace_id}
+
+class Router:
+    def __init__(self, endpoints: list[Endpoint], max_wait: float = 5.0):
+        """
+        Reparte los requests entre `endpoints` (ver docstring del módulo).
+
+        - `max_wait`: si todos están en pausa, espera hasta este tope a que vuelva uno.
+        """
+        self.endpoints = endpoints
+        self.max_wait = max_wait
+        self.unavailable = 0  # Requests sin ningún endpoint disponible
+        self._freed = asyncio.Event()  # Se marca al liberar un lugar
+
+    def _take(self, candidates: list[Endpoint], now: float) -> Endpoint | None:
+        """
+        Toma el candidato de menor costo cuyo breaker lo admite (y ocupa un lugar).
+        """
+        while candidates:
+            best = min(candidates, key=lambda ep: (ep.cost(now), random.random()))
+            if best.breaker.allow():
+                best.in_flight += 1
+                return best
+            candidates.remove(best)
+        return None
+
+    def has_alternative(self, endpoint: Endpoint) -> bool:
+        """
+        Indica si hay otro endpoint sano al que reintentar sin esperar.
+        """
+        now = time.monotonic()
+        return any(ep is not endpoint and ep.usable(now) for ep in self.endpoints)
+
+    async def acquire(self, avoid: Endpoint | None = None) -> Endpoint | None:
+        """
+        Toma el mejor endpoint disponible y un lugar en su concurrencia.
+
+        - `avoid`: endpoint que acaba de fallar; se usa sólo si no hay otro sano.
+        - Si hay endpoints sanos pero todos en su tope, espera a que se libere uno.
+        - Si todos están en pausa (`Retry-After`, cuota), espera al primero que
+          vuelva, hasta `max_wait`.
+        - None si ninguno está disponible (circuitos abiertos o pausas largas).
+        """
+        while True:
+            now = time.monotonic()
+            usable = [ep for ep in self.endpoints if ep.usable(now)]
+            if avoid is not None and any(ep is not avoid for ep in usable):
+                usable = [ep for ep in usable if ep is not avoid]
+            timeout = None
+            if usable:
+                endpoint = self._take([ep for ep in usable if not ep.saturated()], now)
+                if endpoint is not None:
+                    return endpoint
+            else:
+                soonest = min((ep.available_at(now) for ep in self.endpoints), default=math.inf)
+                if soonest - now > self.max_wait:
+                    self.unavailable += 1
+                    return None
+                timeout = soonest - now
+            self._freed.clear()
+            try:
+                await asyncio.wait_for(self._freed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, endpoint: Endpoint) -> None:
+        """
+        Devuelve el lugar tomado con `acquire`.
+        """
+        endpoint.in_flight -= 1
+        self._freed.set()
+
+    def stats(self) -> list[dict]:
+        """
+        Métricas por endpoint: en curso, tope, latencia, errores, salud y cuota.
+        """
+        now = time.monotonic()
+        return [
+            {
+                "name": ep.name,
+                "in_flight": ep.in_flight,
+                "max_concurrency": ep.max_concurrency,
+                "latency_ms": ep.latency(now) * 1000,
+                "error_rate": ep.error_rate,
+                "health": ep.health(now),
+                "breaker": ep.breaker.state,
+                "cooldown_s": max(0.0, ep.cooldown_until - now),
+                "remaining_requests": ep.remaining_requests,
+                "remaining_tokens": ep.remaining_tokens,
+                "requests": ep.requests,
+                "errors": ep.errors,
+            }
+            for ep in self.endpoints
+        ]
+
+def log_stats(router: Router) -> None:
+    """
+    Registra en el log una línea por endpoint con sus métricas.
+    """
+    for stat in router.stats():
+        log.info(
+            f"Endpoint {stat['name']}: requests={stat['requests']} errores={stat['errors']} "
+            f"latencia={stat['latency_ms']:.0f} ms salud={stat['health']:.2f} breaker={stat['breaker']}"
+        )
+
+def _endpoints_from_settings() -> list[Endpoint]:
+    """
+    Endpoints de `LLM_ENDPOINTS` (o el único de `LLM_URL`), sólo los que tienen clave.
+    """
+    default_key = getattr(settings, "GROQ_API_KEY", None)
+    default_url = getattr(settings, "LLM_URL", None) or DEFAULT_URL
+    default_model = getattr(settings, "MODEL_NAME", None) or ""
+    default_limit = int(getattr(settings, "LLM_ENDPOINT_MAX_CONCURRENCY", None) or 0)
+
+    raw = getattr(settings, "LLM_ENDPOINTS", None)
+    try:
+        specs = json.loads(raw) if raw else [{"name": "default"}]
+    except ValueError as e:
+        raise ValueError(f"LLM_ENDPOINTS no es JSON válido: {e}") from e
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        raise ValueError("LLM_ENDPOINTS debe ser una lista de objetos")
+
+    endpoints = []
+    for i, spec in enumerate(specs):
+        api_key = spec.get("api_key") or default_key
+        if not api_key:
+            continue
+        endpoints.append(Endpoint(
+            name=str(spec.get("name") or f"llm-{i}"),
+            url=spec.get("url") or default_url,
+            api_key=api_key,
+            model=spec.get("model") or default_model,
+            max_concurrency=int(spec.get("max_concurrency") or default_limit),
+        ))
+    return endpoints
+
+def router_from_settings() -> Router:
+    """
+    Crea el router del proceso. Sin endpoints con clave, `llm_client` responde en modo offline.
+    """
+    router = Router(_endpoints_from_settings(),
+                    max_wait=float(getattr(settings, "LLM_BACKOFF_MAX", None) or 5.0))
+    if len(router.endpoints) > 1:
+        log.info(f"LLM router: {', '.join(ep.name for ep in router.endpoints)}")
+    return router
+
+# --- Instancias del proceso ---
+router = router_from_settings()
+# Destino de los requests de respaldo (`LLM_HEDGE_URL`), con la clave y el modelo por defecto
+hedge_endpoint = (
+    Endpoint("hedge", HEDGE_URL, getattr(settings, "GROQ_API_KEY", None) or "",
+             getattr(settings, "MODEL_NAME", None) or "")
+    if HEDGE_URL else None
+)
+
+def _per_endpoint(key: str):
+    return lambda: {(stat["name"],): stat[key] or 0 for stat in router.stats()}
+
+# Métricas por endpoint (se calculan al scrapear)
+metrics.gauge("psicoia_llm_endpoint_in_flight", "Requests en curso por endpoint", ("endpoint",), fn=_per_endpoint("in_flight"))
+metrics.gauge("psicoia_llm_endpoint_max_concurrency", "Tope de concurrencia por endpoint (0 = sin tope)", ("endpoint",),
+              fn=_per_endpoint("max_concurrency"))
+metrics.gauge("psicoia_llm_endpoint_latency_seconds", "Latencia EWMA por endpoint", ("endpoint",),
+              fn=lambda: {(stat["name"],): stat["latency_ms"] / 1000 for stat in router.stats()})
+metrics.gauge("psicoia_llm_endpoint_error_rate", "Tasa de errores reciente por endpoint", ("endpoint",), fn=_per_endpoint("error_rate"))
+metrics.gauge("psicoia_llm_endpoint_health", "Salud del endpoint (0 = sin tráfico)", ("endpoint",), fn=_per_endpoint("health"))
+metrics.gauge("psicoia_llm_endpoint_remaining_requests", "Último x-ratelimit-remaining-requests", ("endpoint",),
+              fn=_per_endpoint("remaining_requests"))
+metrics.counter("psicoia_llm_unavailable_total", "Requests sin ningún endpoint disponible", fn=lambda: router.unavailable)
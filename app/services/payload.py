@@ -0,0 +1,83 @@
+"""
+Cuerpo del request al LLM armado con bytes ya serializados.
+
+- Cada pieza del JSON se codifica UNA vez y se guarda: el mensaje `system` en el registro
+  de prompts, cada mensaje de la historia al agregarse (`ConversationHistory`) y el
+  encabezado (`model`, `temperature`, `max_tokens`, `stream`) por combinación de valores.
+- Por request sólo se codifica el mensaje nuevo del usuario; el cuerpo sale de un único
+  `b"".join` y viaja como `content=` (httpx no vuelve a serializar nada).
+- Mismo formato que `json=` de httpx (compacto, UTF-8 sin escapar): el proveedor recibe
+  el mismo JSON que antes.
+- Decodificar respuestas: `loads` usa `orjson` si está instalado (opcional) y si no el
+  `json` estándar.
+"""
+
+# Importaciones necesarias
+import json  # Codificación de las piezas (y decodificación sin orjson)
+from functools import lru_cache  # Encabezados ya codificados
+
+try:
+    import orjson  # Decodificación rápida (opcional)
+except ImportError:
+    orjson = None
+
+# Backend de decodificación en uso
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+loads = orjson.loads if orjson is not None else json.loads
+
+def encode(obj) -> bytes:
+    """
+    `obj` en JSON compacto UTF-8 (el mismo formato que `json=` de httpx).
+    """
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+@lru_cache(maxsize=64)
+def _head(model: str, temperature: float | None, max_tokens: int | None, stream: bool) -> bytes:
+    """Inicio del cuerpo hasta la lista de mensajes: `{"model":...,"messages":[`."""
+    head = encode({"model": model, "temperature": temperature, "max_tokens": max_tokens, "stream": stream})
+    return head[:-1] + b',"messages":['
+
+class LLMRequest:
+    def __init__(self, model: str, messages: list, encoded: list[bytes],
+                 temperature: float | None, max_tokens: int | None, stream: bool):
+        """
+        Pedido al LLM: los mensajes elegidos y sus bytes ya codificados.
+
+        - `messages`: los mensajes (dicts, o registros `Message` de la historia: no copias)
+          para la caché y los logs.
+        - `encoded`: `encode(m)` de cada mensaje, en el mismo orden.
+        """
+        self.model = model
+        self.messages = messages
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.stream = stream
+        # Piezas del cuerpo: [encabezado, m1, ",", m2, ..., "]}"]; el encabezado se
+        # completa por modelo en `body()`
+        parts = [b""] * (2 * len(encoded) + 1)
+        parts[1::2] = encoded
+        parts[2:-1:2] = [b","] * (len(encoded) - 1)
+        parts[-1] = b"]}"
+        self._parts = parts
+        self._bodies: dict[str, bytes] = {}
+
+    def body(self, model: str | None = None) -> bytes:
+        """
+        Cuerpo JSON del request para `model` (default: el de la configuración).
+
+        - Un solo `join`; se memoiza por modelo (reintentos y hedge reusan los bytes).
+        """
+        model = model or self.model
+        body = self._bodies.get(model)
+        if body is None:
+            self._parts[0] = _head(model, self.temperature, self.max_tokens, self.stream)
+            body = self._bodies[model] = b"".join(self._parts)
+        return body
+
+    def key_bytes(self) -> bytes:
+        """
+        Lo que identifica la respuesta (modelo, parámetros y mensajes, sin `stream`),
+        para la clave de la caché: `[model,temperature,max_tokens,[mensajes...]]`.
+        """
+        head = encode([self.model, self.temperature, self.max_tokens])
+        return b"".join((head[:-1], b",[", *self._parts[1:-1], b"]]"))
@@ -0,0 +1,220 @@
+"""
+Registro de system prompts: se cargan una vez, se eligen por nombre y se recargan en caliente.
+
+- Cada módulo de `app/prompts` con un `SYSTEM_PROMPT` es un prompt; su nombre es el del
+  archivo (`promptgeneral`). El valor se lee con `ast`, sin importar el módulo.
+- Al cargar se precalcula todo lo que el request necesita: el mensaje `system` (un solo
+  dict compartido por todas las sesiones), su costo en tokens y su fragmento JSON.
+- `get(name)` es una búsqueda en un dict: nada se lee ni se parsea en el camino del request.
+  Un nombre desconocido (o vacío) usa `PROMPT_DEFAULT`.
+- Recarga en caliente: una tarea revisa cada `PROMPT_RELOAD_INTERVAL_SECONDS` la fecha y el
+  tamaño de los archivos; si cambiaron, parsea en un hilo y reemplaza el dict de una vez
+  (los requests en curso siguen con el prompt que ya tenían). Un archivo roto no reemplaza
+  la versión anterior.
+"""
+
+# Importaciones necesarias
+import ast  # Leer SYSTEM_PROMPT sin importar el módulo
+import asyncio  # Tarea de recarga
+import os  # Fecha y tamaño de los archivos
+from pathlib import Path  # Carpeta de prompts
+
+from app.config import settings  # Configuración del proyecto
+from app.services.payload import encode  # Fragmento JSON precalculado
+from app.services.tokenizer import get_tokenizer  # Costo en tokens del prompt
+from app.utils import metrics  # Recargas
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("prompts")
+
+# Carpeta de los módulos de prompts (`app/prompts`)
+PROMPTS_DIR = Path(__file__).resolve().parents[1] / "prompts"
+
+_RELOADS = metrics.counter("psicoia_prompt_reloads_total", "Recargas del registro de prompts por resultado",
+                           ("result",))
+
+class Prompt:
+    """
+    Un system prompt listo para usar (inmutable: una recarga crea otro).
+
+    - `message`: el dict `{"role": "system", ...}` que va al inicio de `messages`.
+    - `tokens`: costo estimado con el tokenizador configurado.
+    - `json`: `message` serializado (`payload.encode`) para armar el cuerpo del request.
+    """
+    __slots__ = ("name", "text", "tokens", "message", "json", "version")
+
+    def __init__(self, name: str, text: str, tokens: int, version: tuple[int, int]):
+        self.name = name
+        self.text = text
+        self.tokens = tokens
+        self.message = {"role": "system", "content": text}
+        self.json = encode(self.message)
+        self.version = version  # (mtime_ns, tamaño) del archivo de origen
+
+def _literal(node: ast.expr):
+    """
+    Valor de una expresión de literales; además de `ast.literal_eval`, acepta strings unidos
+    con `+` (`literal_eval` sólo suma números).
+    """
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _literal(node.left), _literal(node.right)
+        if isinstance(left, str) and isinstance(right, str):
+            return left + right
+        raise ValueError("SYSTEM_PROMPT: `+` sólo entre strings")
+    return ast.literal_eval(node)
+
+def read_system_prompt(path: Path) -> str | None:
+    """
+    Valor de `SYSTEM_PROMPT` en el archivo `path`, o None si no lo define.
+
+    - Acepta un string literal, literales adyacentes o strings unidos con `+` (sin
+      ejecutar el módulo: nombres, llamadas o f-strings se rechazan).
+    - Un error de sintaxis se propaga (la recarga lo registra y conserva la versión anterior).
+    """
+    tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+    value = None
+    # La última asignación top-level gana, como al importar el módulo
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SYSTEM_PROMPT" for t in node.targets):
+            value = node.value
+    if value is None:
+        return None
+    text = _literal(value)
+    return text if isinstance(text, str) else None
+
+class PromptRegistry:
+    def __init__(self, directory: Path, default: str):
+        """
+        Inicializa el registro (vacío hasta `load()`).
+
+        - `directory`: carpeta con los módulos de prompts.
+        - `default`: nombre del prompt para sesiones sin uno elegido.
+        """
+        self.directory = directory
+        self.default = default
+        self._tokenizer = get_tokenizer()
+        self._prompts: dict[str, Prompt] = {}
+        self._default: Prompt | None = None
+        self._seen: dict[str, tuple[int, int]] = {}  # Versiones de la última carga (incluso fallidas)
+        self._watcher: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._prompts)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._prompts
+
+    def names(self) -> list[str]:
+        return sorted(self._prompts)
+
+    def get(self, name: str | None = None) -> Prompt:
+        """
+        Prompt `name`, o el default si no existe (O(1)).
+        """
+        if name:
+            prompt = self._prompts.get(name)
+            if prompt is not None:
+                return prompt
+        return self._default
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        """
+        Versión `(mtime_ns, tamaño)` de cada módulo de la carpeta (sin leerlos).
+        """
+        versions = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".py") and not entry.name.startswith("_") and entry.is_file():
+                    st = entry.stat()
+                    versions[entry.name[:-3]] = (st.st_mtime_ns, st.st_size)
+        return versions
+
+    def load(self) -> list[str]:
+        """
+        (Re)carga los prompts cuyos archivos cambiaron y publica el nuevo dict de una vez.
+
+        - Los prompts sin cambios se conservan (mismo objeto, misma memoria).
+        - Devuelve los nombres agregados, cambiados o quitados.
+        """
+        current = self._prompts
+        prompts: dict[str, Prompt] = {}
+        changed = []
+        self._seen = versions = self._scan()
+        for name, version in versions.items():
+            old = current.get(name)
+            if old is not None and old.version == version:
+                prompts[name] = old
+                continue
+            try:
+                text = read_system_prompt(self.directory / f"{name}.py")
+            except (OSError, SyntaxError, ValueError) as e:
+                _RELOADS.labels("error").inc()
+                log.warning(f"Prompt {name}: no se pudo leer ({e}); se conserva la versión anterior")
+                if old is not None:
+                    prompts[name] = old
+                continue
+            if text is None:
+                continue  # Módulo sin SYSTEM_PROMPT (no es un prompt)
+            prompts[name] = Prompt(name, text, max(1, self._tokenizer.count(text)), version)
+            changed.append(name)
+
+        default = prompts.get(self.default)
+        if default is None:
+            if self._default is None:
+                raise ValueError(f"PROMPT_DEFAULT={self.default!r} no está en {self.directory} "
+                                 f"(disponibles: {sorted(prompts)})")
+            # El default desapareció: seguir sirviendo la última versión conocida
+            log.warning(f"Prompt default {self.default} no disponible; se conserva la versión anterior")
+            default = prompts[self.default] = self._default
+        changed.extend(name for name in current if name not in prompts)
+        # Publicar: el dict no se modifica después, así `get` nunca ve un estado a medias
+        self._prompts, self._default = prompts, default
+        if changed and current:
+            _RELOADS.labels("ok").inc()
+            log.info(f"Prompts recargados: {', '.join(sorted(changed))}")
+        return changed
+
+    async def _watch(self, interval: float) -> None:
+        """
+        Tarea de recarga: revisa la carpeta cada `interval` segundos.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                versions = await asyncio.to_thread(self._scan)
+                if versions != self._seen:
+                    # Leer, parsear y tokenizar fuera del event loop
+                    await asyncio.to_thread(self.load)
+            except Exception as e:
+                _RELOADS.labels("error").inc()
+                log.warning(f"No se pudo recargar los prompts: {e}")
+
+    def start_watcher(self, interval: float) -> None:
+        """
+        Inicia la recarga en caliente (una sola vez por proceso; `interval<=0` la desactiva).
+        """
+        if interval > 0 and (self._watcher is None or self._watcher.done()):
+            self._watcher = asyncio.create_task(self._watch(interval))
+
+    async def stop_watcher(self) -> None:
+        """
+        Detiene la recarga en caliente.
+        """
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+# Registro del proceso: se carga al importar (antes del fork de los workers, así
+# los textos quedan compartidos entre procesos)
+prompts = PromptRegistry(PROMPTS_DIR, getattr(settings, "PROMPT_DEFAULT", None) or "promptgeneral")
+prompts.load()
+# Intervalo de revisión de la carpeta en segundos (0 = sin recarga en caliente)
+_reload = getattr(settings, "PROMPT_RELOAD_INTERVAL_SECONDS", None)
+RELOAD_INTERVAL = 2.0 if _reload is None else float(_reload)
+
+metrics.gauge("psicoia_prompts_loaded", "Prompts disponibles en el registro", fn=lambda: len(prompts))
@@ -0,0 +1,208 @@
+"""
+Capa de resiliencia de las llamadas al LLM: presupuesto de reintentos, circuit breaker,
+backoff con jitter y requests "hedged".
+
+- `RetryBudget`: los reintentos de TODO el proceso salen de un balde de tokens que se
+  llena con una fracción de los requests exitosos enviados (y un mínimo por segundo).
+  En una caída parcial del proveedor los reintentos se agotan rápido en vez de
+  multiplicar la carga (y de retener lugares del scheduler por segundos).
+- `CircuitBreaker`: si la tasa de fallas de las últimas llamadas supera el umbral,
+  se abre y las llamadas fallan al instante con el mensaje de respaldo; tras
+  `open_seconds` deja pasar una llamada de prueba (semi-abierto). Hay uno por
+  endpoint (`breaker_from_settings`, ver `app.services.llm_router`).
+- `backoff_delay`: backoff exponencial con jitter completo (respeta `Retry-After`).
+- `LatencyTracker`: latencias recientes; su percentil decide cuándo lanzar el
+  request de respaldo ("hedge") hacia `LLM_HEDGE_URL`.
+"""
+
+# Importaciones necesarias
+import random  # Jitter
+import time  # Relojes monotónicos
+from collections import deque  # Ventanas de resultados y latencias
+
+from app.config import settings  # Configuración del proyecto
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("resilience")
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 10.0):
+        """
+        Presupuesto de reintentos del proceso.
+
+        - `ratio`: tokens que aporta cada request (0.2 = hasta 20% de reintentos).
+        - `min_per_second`: tokens que se reponen por segundo aunque haya poco tráfico.
+        - `max_tokens`: tope del balde (ráfaga máxima de reintentos).
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._last = time.monotonic()
+        self.denied = 0  # Reintentos negados por falta de presupuesto
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._last) * self.min_per_second)
+        self._last = now
+
+    def deposit(self) -> None:
+        """
+        Registra un request original (aporta `ratio` tokens).
+        """
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Pide permiso para un reintento (o un hedge): consume un token si hay.
+        """
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.denied += 1
+        return False
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_rate: float = 0.5, min_requests: int = 10, window: int = 20,
+                 open_seconds: float = 10.0, name: str = "llm"):
+        """
+        Circuit breaker por tasa de fallas.
+
+        - Mira las últimas `window` llamadas; con al menos `min_requests` y una
+          fracción de fallas >= `failure_rate`, se abre por `open_seconds`.
+        - Semi-abierto: una sola llamada de prueba; si sale bien, se cierra.
+        """
+        self.failure_rate = failure_rate
+        self.min_requests = max(1, min_requests)
+        self.open_seconds = open_seconds
+        self.name = name
+        self.state = self.CLOSED
+        self._results: deque[bool] = deque(maxlen=max(self.min_requests, window))
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self.rejected = 0  # Llamadas cortadas con el circuito abierto
+
+    def ready(self) -> bool:
+        """
+        Como `allow()`, pero sin efectos: no cuenta rechazos ni toma la llamada de prueba.
+        """
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            return now - self._opened_at >= self.open_seconds
+        if self.state == self.HALF_OPEN:
+            return not self._probe_in_flight or now - self._probe_started >= self.open_seconds
+        return True
+
+    def allow(self) -> bool:
+        """
+        Indica si se puede llamar al proveedor ahora.
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            now = time.monotonic()
+            # Una prueba que nunca informó su resultado (cancelada) no bloquea para siempre
+            if self._probe_in_flight and now - self._probe_started < self.open_seconds:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+            self._probe_started = now
+        return True
+
+    def record(self, ok: bool) -> None:
+        """
+        Registra el resultado de una llamada (ok = el proveedor respondió sano).
+        """
+        if self.state == self.HALF_OPEN:
+            self._probe_in_flight = False
+            if ok:
+                self._close()
+            else:
+                self._open()
+            return
+        self._results.append(ok)
+        if self.state == self.CLOSED and len(self._results) >= self.min_requests:
+            failures = self._results.count(False)
+            if failures / len(self._results) >= self.failure_rate:
+                self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._results.clear()
+        log.warning(f"Circuit breaker {self.name}: abierto por {self.open_seconds:.0f}s")
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self._results.clear()
+        log.info(f"Circuit breaker {self.name}: cerrado")
+
+class LatencyTracker:
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        """
+        Latencias de las últimas `size` llamadas exitosas.
+
+        - `percentile()` devuelve None hasta tener `min_samples` muestras.
+        """
+        self._samples: deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def breaker_from_settings(name: str = "llm") -> CircuitBreaker:
+    """
+    Crea un circuit breaker con los umbrales `LLM_BREAKER_*`.
+    """
+    return CircuitBreaker(
+        failure_rate=float(getattr(settings, "LLM_BREAKER_FAILURE_RATE", None) or 0.5),
+        min_requests=int(getattr(settings, "LLM_BREAKER_MIN_REQUESTS", None) or 10),
+        window=int(getattr(settings, "LLM_BREAKER_WINDOW", None) or 20),
+        open_seconds=float(getattr(settings, "LLM_BREAKER_OPEN_SECONDS", None) or 10.0),
+        name=name,
+    )
+
+def backoff_delay(attempt: int, retry_after: str | None = None) -> float:
+    """
+    Espera antes del reintento `attempt` (1, 2, ...).
+
+    - Si el proveedor envió `Retry-After` (segundos), se respeta.
+    - Si no, jitter completo: uniforme entre 0 y el backoff exponencial,
+      así los reintentos de muchas sesiones no llegan todos juntos.
+    """
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    cap = min(settings.LLM_BACKOFF_MAX, settings.LLM_BACKOFF_INITIAL * (2 ** (attempt - 1)))
+    return random.uniform(0, cap)
+
+# --- Instancias del proceso, configuradas desde Settings ---
+retry_budget = RetryBudget(
+    ratio=float(getattr(settings, "LLM_RETRY_BUDGET_RATIO", None) or 0.2),
+    min_per_second=float(getattr(settings, "LLM_RETRY_BUDGET_MIN_PER_SEC", None) or 1.0),
+    max_tokens=float(getattr(settings, "LLM_RETRY_BUDGET_MAX", None) or 10.0),
+)
+latencies = LatencyTracker()
+# Request de respaldo: URL secundaria y percentil de latencia a partir del cual se lanza
+HEDGE_URL = getattr(settings, "LLM_HEDGE_URL", None) or None
+HEDGE_PERCENTILE = float(getattr(settings, "LLM_HEDGE_PERCENTILE", None) or 95.0)
@@ -0,0 +1,198 @@
+"""
+Caché opcional de respuestas del LLM para pedidos repetidos (botones de respuesta rápida).
+
+- Clave: hash SHA-256 del payload completo que se enviaría (`messages` ya construido,
+  modelo, temperatura y `max_tokens`): sólo coinciden pedidos idénticos.
+- Sólo se cachean conversaciones nuevas (system + mensaje del usuario, sin historia):
+  nada personal de una conversación en curso termina en la caché ni en disco.
+- Mensajes con palabras de riesgo (`app.services.risk`) nunca se cachean (configurable).
+- Variantes: cada clave junta hasta `LLM_CACHE_VARIANTS` respuestas distintas del
+  modelo; hasta completarlas cada pedido va al proveedor, después se responde
+  con una variante al azar (así no todos reciben el mismo texto).
+- Límites: `LLM_CACHE_MAX_ENTRIES` claves (LRU) y `LLM_CACHE_TTL_SECONDS` de vida.
+- Persistencia opcional en un archivo JSON (`LLM_CACHE_PATH`), cargado al iniciar
+  y guardado al apagar.
+- Contadores de aciertos/fallos (`stats()`).
+"""
+
+# Importaciones necesarias
+import hashlib  # Hash de la clave
+import json  # Serializar payload y archivo de persistencia
+import os  # Reemplazo atómico del archivo
+import random  # Elegir variante
+import time  # Expiración
+from collections import OrderedDict  # Orden LRU
+from pathlib import Path  # Archivo de persistencia
+
+from app.config import settings  # Configuración del proyecto
+from app.services.payload import LLMRequest  # Pedido ya codificado
+from app.services.risk import is_risky  # Palabras de alarma del prompt
+from app.utils import metrics  # Métricas del proceso
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("cache")
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1000, ttl: float = 86400.0, variants: int = 3,
+                 path: str | None = None, skip_risky: bool = True):
+        """
+        Inicializa la caché.
+
+        - `variants`: respuestas distintas que se juntan por clave antes de servir aciertos.
+        - `path`: archivo JSON de persistencia (None = sólo memoria).
+        - `skip_risky`: no cachear mensajes con palabras de riesgo.
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self.path = path
+        self.skip_risky = skip_risky
+        # clave → (expira en epoch, variantes); el más reciente al final
+        self._entries: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0  # Pedidos no cacheables (con historia o de riesgo)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key_for(self, payload: LLMRequest, user_text: str) -> str | None:
+        """
+        Devuelve la clave del pedido, o None si no es cacheable.
+
+        - Cacheable: conversación nueva (sólo system + user) y sin palabras de riesgo.
+        - Se hashean los bytes ya codificados del pedido (`LLMRequest.key_bytes`).
+        """
+        if len(payload.messages) > 2 or (self.skip_risky and is_risky(user_text)):
+            self.skipped += 1
+            return None
+        return hashlib.sha256(payload.key_bytes()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Devuelve una variante cacheada, o None (fallo) si expiró o faltan variantes.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.time():
+            del self._entries[key]
+            entry = None
+        if entry is None or len(entry[1]) < self.variants:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return random.choice(entry[1])
+
+    def put(self, key: str, reply: str) -> None:
+        """
+        Agrega `reply` como variante de `key` (las repetidas no cuentan).
+        """
+        if not reply:
+            return
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            entry = self._entries[key] = (time.time() + self.ttl, [])
+        if reply not in entry[1] and len(entry[1]) < self.variants:
+            entry[1].append(reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Contadores: entradas, aciertos, fallos, no cacheables y tasa de aciertos.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def load(self) -> None:
+        """
+        Carga las entradas vigentes del archivo de persistencia (si existe).
+        """
+        if not self.path or not Path(self.path).exists():
+            return
+        try:
+            data = json.loads(Path(self.path).read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            log.warning(f"No pude leer la caché {self.path}: {e}")
+            return
+        now = time.time()
+        for key, expires, replies in data.get("entries", []):
+            if expires > now:
+                self._entries[key] = (expires, list(replies)[: self.variants])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        log.info(f"Caché de respuestas: {len(self._entries)} entradas cargadas de {self.path}")
+
+    def save(self) -> None:
+        """
+        Guarda las entradas vigentes (escritura atómica: archivo temporal + rename).
+        """
+        if not self.path:
+            return
+        now = time.time()
+        entries = [[k, exp, replies] for k, (exp, replies) in self._entries.items() if exp > now]
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+# --- Caché del proceso (opt-in) ---
+_cache: ResponseCache | None = None
+_loaded = False
+
+def get_cache() -> ResponseCache | None:
+    """
+    Devuelve la caché del proceso, o None si `LLM_CACHE_ENABLED` no está activo.
+    """
+    global _cache, _loaded
+    if _loaded:
+        return _cache
+    _loaded = True
+    if not getattr(settings, "LLM_CACHE_ENABLED", False):
+        return None
+    skip_risky = getattr(settings, "LLM_CACHE_SKIP_RISK", None)
+    _cache = ResponseCache(
+        max_entries=int(getattr(settings, "LLM_CACHE_MAX_ENTRIES", None) or 1000),
+        ttl=float(getattr(settings, "LLM_CACHE_TTL_SECONDS", None) or 86400.0),
+        variants=int(getattr(settings, "LLM_CACHE_VARIANTS", None) or 3),
+        path=getattr(settings, "LLM_CACHE_PATH", None) or None,
+        skip_risky=True if skip_risky is None else bool(skip_risky),
+    )
+    _cache.load()
+    return _cache
+
+def close_cache() -> None:
+    """
+    Guarda la caché en disco (si hay persistencia) y registra sus contadores.
+    """
+    global _cache, _loaded
+    if _cache is None:
+        return
+    stats = _cache.stats()
+    log.info(
+        f"Caché de respuestas: {stats['hits']} aciertos, {stats['misses']} fallos, "
+        f"{stats['skipped']} no cacheables, {stats['entries']} entradas"
+    )
+    try:
+        _cache.save()
+    except OSError as e:
+        log.warning(f"No pude guardar la caché {_cache.path}: {e}")
+    _cache = None
+    _loaded = False
+
+def _cache_stat(key: str) -> float:
+    return _cache.stats()[key] if _cache is not None else 0
+
+# Métricas (se calculan al scrapear)
+metrics.counter("psicoia_llm_cache_hits_total", "Respuestas servidas desde la caché", fn=lambda: _cache_stat("hits"))
+metrics.counter("psicoia_llm_cache_misses_total", "Consultas cacheables sin respuesta guardada", fn=lambda: _cache_stat("misses"))
+metrics.gauge("psicoia_llm_cache_entries", "Claves en la caché de respuestas", fn=lambda: _cache_stat("entries"))
@@ -0,0 +1,124 @@
+"""
+Clasificador local de mensajes por palabras clave (riesgo, ansiedad, depresión, apoyo, esperanza).
+
+- Compila UNA vez el diccionario `KEYWORDS` de `promptgeneral.py` (la misma lista que ve
+  el modelo) en un autómata de Aho-Corasick: una sola pasada por el mensaje encuentra las
+  palabras de todas las categorías, sin importar cuántas haya.
+- Compara sin mayúsculas ni acentos y desde el inicio de palabra ("morir" también detecta
+  "morirme"): ante la duda, se marca.
+- El texto se pasa a bytes Latin-1 y se traduce al alfabeto del autómata con
+  `bytes.translate` (en C); todo carácter que no aparece en ninguna palabra clave
+  (espacios, signos, emojis) es un separador.
+- `classify()` devuelve las categorías del mensaje; `is_risky()` sólo mira `riesgo`.
+- Lo usan `handle_client` (carril prioritario, respuesta de crisis inmediata y contadores
+  por categoría) y la caché de respuestas (no cachear).
+"""
+
+# Importaciones necesarias
+import unicodedata  # Normalizar acentos
+from collections import deque  # Recorrido en anchura del trie
+from collections.abc import Iterable  # Listas de palabras
+
+from app.prompts.promptgeneral import KEYWORDS  # Palabras clave por categoría
+
+# Categoría de las palabras de alarma
+RISK = "riesgo"
+# Código de los separadores en el alfabeto del autómata
+_SEP = 0
+
+def fold(text: str) -> str:
+    """
+    Minúsculas y sin acentos (para comparar "más" con "mas").
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+class KeywordClassifier:
+    def __init__(self, keywords: dict[str, Iterable[str]]):
+        """
+        Compila `keywords` (categoría → palabras o frases) en el autómata.
+
+        - Cada palabra empieza con un separador implícito: sólo coincide al inicio de palabra.
+        - Las transiciones se precalculan para todo estado y símbolo (sin enlaces de
+          falla en tiempo de búsqueda): una búsqueda en lista por carácter.
+        """
+        self.categories = tuple(keywords)
+        folded = {category: [fold(word) for word in words] for category, words in keywords.items()}
+        alphabet = sorted({ch for words in folded.values() for word in words for ch in word if ch != " "})
+        code = {ch: i + 1 for i, ch in enumerate(alphabet)}
+        width = len(alphabet) + 1
+        # Byte Latin-1 → símbolo del alfabeto (mayúsculas y acentos ya plegados)
+        self._table = bytes(code.get(fold(chr(b)), _SEP) for b in range(256))
+
+        # Trie de las palabras (con el separador inicial) y categorías de cada estado
+        goto: list[dict[int, int]] = [{}]
+        out = [0]
+        for bit, category in enumerate(self.categories):
+            for word in folded[category]:
+                state = 0
+                for symbol in (_SEP, *(code.get(ch, _SEP) for ch in word)):
+                    nxt = goto[state].get(symbol)
+                    if nxt is None:
+                        nxt = goto[state][symbol] = len(goto)
+                        goto.append({})
+                        out.append(0)
+                    state = nxt
+                out[state] |= 1 << bit
+
+        # Autómata determinista: enlaces de falla en anchura y transiciones completas
+        delta = [[0] * width for _ in goto]
+        fail = [0] * len(goto)
+        queue = deque([0])
+        while queue:
+            state = queue.popleft()
+            for symbol in range(width):
+                nxt = goto[state].get(symbol)
+                if nxt is None:
+                    delta[state][symbol] = delta[fail[state]][symbol] if state else 0
+                    continue
+                delta[state][symbol] = nxt
+                fail[nxt] = delta[fail[state]][symbol] if state else 0
+                out[nxt] |= out[fail[nxt]]
+                queue.append(nxt)
+
+        # Tablas planas con el estado premultiplicado por `width` (estado + símbolo = índice)
+        self._next = [target * width for row in delta for target in row]
+        self._out = [0] * len(self._next)
+        for state, mask in enumerate(out):
+            self._out[state * width] = mask
+        self._start = self._next[_SEP]  # El inicio del texto cuenta como separador
+        self._sets = [frozenset(c for bit, c in enumerate(self.categories) if mask >> bit & 1)
+                      for mask in range(1 << len(self.categories))]
+        self.states = len(goto)
+
+    def mask(self, text: str) -> int:
+        """
+        Categorías de `text` como máscara de bits (bit i = `categories[i]`).
+        """
+        if not text.isascii() and not unicodedata.is_normalized("NFC", text):
+            # Acentos como caracteres combinantes: componerlos para que entren en Latin-1
+            text = unicodedata.normalize("NFC", text)
+        nxt, out = self._next, self._out
+        state = self._start
+        found = 0
+        for symbol in text.encode("latin-1", "replace").translate(self._table):
+            state = nxt[state + symbol]
+            found |= out[state]
+        return found
+
+    def classify(self, text: str) -> frozenset[str]:
+        """
+        Categorías presentes en `text` (vacío si ninguna).
+        """
+        return self._sets[self.mask(text or "")]
+
+# Clasificador del proceso, compilado al importar
+classifier = KeywordClassifier(KEYWORDS)
+classify = classifier.classify
+_RISK_BIT = 1 << classifier.categories.index(RISK)
+
+def is_risky(text: str) -> bool:
+    """
+    Indica si `text` contiene alguna palabra de alarma/riesgo.
+    """
+    return bool(classifier.mask(text or "") & _RISK_BIT)
@@ -0,0 +1,212 @@
+"""
+Almacén acotado de sesiones de conversación (historia + lock por `conversation_id`).
+
+- Reemplaza los dicts globales `_histories`/`_locks`, que sólo crecían.
+- Límite de sesiones vivas (`SESSION_MAX`) con desalojo LRU.
+- Expiración por inactividad (`SESSION_IDLE_TTL_SECONDS`) aplicada por una tarea barredora.
+- `release()` libera una sesión al cerrarse la conexión del cliente.
+- Gauges de sesiones vivas y bytes retenidos (`stats()`).
+"""
+
+# Importaciones necesarias
+import asyncio  # Locks y tarea barredora
+import time  # Marcas de tiempo monotónicas
+from collections import OrderedDict  # Orden LRU de sesiones
+from collections.abc import Callable, Iterator  # Tipos de la fábrica de historias y de `in_use`
+from contextlib import contextmanager  # Sesión fijada durante un turno
+
+from app.config import settings  # Configuración del proyecto
+from app.services.history import ConversationHistory  # Historia con tokens memoizados
+from app.utils import metrics  # Métricas del proceso
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("sessions")
+
+class Session:
+    """
+    Estado de una conversación: historia, lock y último acceso.
+
+    - `loaded`: la historia ya se cargó del store persistente (si hay uno).
+    - `summary`/`summarizing`: resumen de los mensajes viejos y si hay uno en curso
+      (ver `app.services.summarizer`).
+    - `users`: turnos en curso sobre la sesión (ver `SessionStore.in_use`); el lock sólo
+      se toma por tramos cortos, no durante la llamada al LLM.
+    """
+    __slots__ = ("history", "lock", "last_access", "loaded", "summary", "summarizing", "users")
+
+    def __init__(self, history: ConversationHistory):
+        self.history = history
+        self.lock = asyncio.Lock()
+        self.last_access = time.monotonic()
+        self.loaded = False
+        self.summary = None
+        self.summarizing = False
+        self.users = 0
+
+    @property
+    def busy(self) -> bool:
+        """La sesión está en uso (lock tomado o turno en curso): no se puede desalojar."""
+        return self.users > 0 or self.lock.locked()
+
+class SessionStore:
+    def __init__(self, max_sessions: int, idle_ttl: float,
+                 history_factory: Callable[[], ConversationHistory]):
+        """
+        Inicializa el almacén.
+
+        - `max_sessions`: sesiones vivas máximas; al superarlo se desaloja la menos usada
+          que no esté en uso (si todas lo están, se tolera el exceso hasta que se liberen).
+        - `idle_ttl`: segundos sin acceso tras los cuales la barredora libera la sesión
+          (salvo que esté en uso).
+        - `history_factory`: crea la historia vacía de una sesión nueva.
+        """
+        self.max_sessions = max(1, max_sessions)
+        self.idle_ttl = idle_ttl
+        self._new_history = history_factory
+        # Orden de inserción = orden LRU (el más reciente al final)
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self.evicted = 0  # Sesiones desalojadas por LRU o TTL
+        self._sweeper: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, cid: str) -> Session:
+        """
+        Devuelve la sesión `cid`, creándola si no existe, y la marca como usada.
+        """
+        session = self._sessions.get(cid)
+        if session is None:
+            session = self._sessions[cid] = Session(self._new_history())
+            if len(self._sessions) > self.max_sessions:
+                self._evict_lru()
+        else:
+            self._sessions.move_to_end(cid)
+        session.last_access = time.monotonic()
+        return session
+
+    @contextmanager
+    def in_use(self, cid: str | None) -> Iterator[Session | None]:
+        """
+        Fija la sesión `cid` mientras dura el bloque (un turno completo, incluida la
+        llamada al LLM): ni el TTL ni el LRU la desalojan a mitad del turno.
+
+        - Con `cid` None no hace nada (pedido sin conversación).
+        """
+        if cid is None:
+            yield None
+            return
+        session = self.get(cid)
+        session.users += 1
+        try:
+            yield session
+        finally:
+            session.users -= 1
+            session.last_access = time.monotonic()
+
+    def peek(self, cid: str) -> Session | None:
+        """
+        Devuelve la sesión `cid` si existe, sin crearla ni cambiar el orden LRU.
+        """
+        return self._sessions.get(cid)
+
+    def release(self, cid: str) -> None:
+        """
+        Libera la sesión `cid` (por ejemplo, al desconectarse el cliente).
+        """
+        self._sessions.pop(cid, None)
+
+    def _evict_lru(self) -> None:
+        """
+        Desaloja la sesión menos usada que no esté en uso (`Session.busy`).
+        """
+        for cid, session in self._sessions.items():
+            if not session.busy:
+                del self._sessions[cid]
+                self.evicted += 1
+                return
+
+    def sweep(self, now: float | None = None) -> int:
+        """
+        Libera las sesiones inactivas por más de `idle_ttl` segundos.
+
+        - Recorre desde la menos usada y corta en la primera todavía vigente.
+        - Las sesiones en uso (`Session.busy`) no se liberan aunque estén vencidas.
+        - Devuelve cuántas sesiones liberó.
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        for cid, session in self._sessions.items():
+            if now - session.last_access < self.idle_ttl:
+                break
+            if not session.busy:
+                expired.append(cid)
+        for cid in expired:
+            del self._sessions[cid]
+        self.evicted += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        """
+        Gauges del almacén: sesiones vivas, mensajes y bytes de texto retenidos.
+        """
+        messages = 0
+        nbytes = 0
+        for session in self._sessions.values():
+            messages += len(session.history)
+            nbytes += session.history.nbytes
+        return {
+            "sessions": len(self._sessions),
+            "messages": messages,
+            "bytes": nbytes,
+            "evicted": self.evicted,
+        }
+
+    async def _sweep_loop(self, interval: float) -> None:
+        """
+        Tarea barredora: expira sesiones inactivas cada `interval` segundos.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            freed = self.sweep()
+            stats = self.stats()
+            log.info(
+                f"Sesiones vivas={stats['sessions']} bytes={stats['bytes']} "
+                f"liberadas={freed} desalojadas_total={stats['evicted']}"
+            )
+
+    def start_sweeper(self, interval: float) -> None:
+        """
+        Inicia la tarea barredora (una sola vez por proceso).
+        """
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    async def stop_sweeper(self) -> None:
+        """
+        Detiene la tarea barredora.
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+# Almacén del proceso, configurado desde Settings
+_HISTORY_MAX = int(getattr(settings, "LLM_HISTORY_MAX_MESSAGES", 200) or 200)
+sessions = SessionStore(
+    max_sessions=int(getattr(settings, "SESSION_MAX", None) or 10000),
+    idle_ttl=float(getattr(settings, "SESSION_IDLE_TTL_SECONDS", None) or 1800.0),
+    history_factory=lambda: ConversationHistory(_HISTORY_MAX),
+)
+# Intervalo de la barredora en segundos
+SWEEP_INTERVAL = float(getattr(settings, "SESSION_SWEEP_INTERVAL_SECONDS", None) or 60.0)
+
+# Métricas (se calculan al scrapear, no en cada mensaje)
+metrics.gauge("psicoia_sessions_active", "Sesiones con historia en RAM", fn=lambda: len(sessions))
+metrics.gauge("psicoia_history_messages", "Mensajes retenidos en las historias", fn=lambda: sessions.stats()["messages"])
+metrics.gauge("psicoia_history_bytes", "Bytes de texto retenidos en las historias", fn=lambda: sessions.stats()["bytes"])
+metrics.counter("psicoia_sessions_evicted_total", "Sesiones desalojadas por LRU", fn=lambda: sessions.evicted)
@@ -0,0 +1,173 @@
+"""
+Resumen incremental de conversaciones largas (opt-in, `LLM_SUMMARY_ENABLED`).
+
+- Cuando la parte de la historia todavía sin resumir supera `LLM_SUMMARY_TRIGGER_TOKENS`,
+  una tarea en segundo plano le pide al LLM un resumen actualizado (resumen anterior +
+  turnos nuevos, `SUMMARY_PROMPT`) y lo guarda en la sesión. El request del usuario nunca
+  espera a esa llamada.
+- Los últimos `LLM_SUMMARY_KEEP_MESSAGES` mensajes quedan fuera del resumen: el modelo los
+  sigue viendo textuales.
+- El pedido al modelo lleva system + resumen + los mensajes posteriores al resumen que
+  entren en el presupuesto (ver `build_messages`); el resumen tiene su JSON y su costo en
+  tokens calculados una sola vez.
+- Una sesión resume de a una tarea por vez y el proceso a lo sumo `_CONCURRENCY` en
+  paralelo; si la llamada falla, se reintenta al crecer de nuevo la historia.
+- El resumen vive en RAM con la sesión (se pierde al liberarla; con `HISTORY_BACKEND=sqlite`
+  se vuelve a calcular cuando la historia recargada supera el umbral).
+"""
+
+# Importaciones necesarias
+import asyncio  # Tareas en segundo plano
+import time  # Latencia para el router
+
+import httpx  # Errores de red
+
+from app.config import settings  # Configuración del proyecto
+from app.prompts.promptresumen import SUMMARY_PROMPT  # Instrucciones del resumen
+from app.services.history import ConversationHistory  # Historia con suma acumulada
+from app.services.http_pool import get_http_client, trace_extensions  # Pool HTTP compartido
+from app.services.llm_router import router  # Endpoint para la llamada
+from app.services.payload import LLMRequest, encode, loads  # Cuerpo del request
+from app.services.tokenizer import get_tokenizer  # Costo del resumen
+from app.utils import metrics  # Resúmenes por resultado
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("summarizer")
+
+# --- Parámetros leídos una sola vez ---
+ENABLED = bool(getattr(settings, "LLM_SUMMARY_ENABLED", False))
+_budget = int(getattr(settings, "LLM_INPUT_TOKEN_BUDGET", 2000) or 2000)
+TRIGGER_TOKENS = int(getattr(settings, "LLM_SUMMARY_TRIGGER_TOKENS", None) or _budget // 2)
+KEEP_MESSAGES = int(getattr(settings, "LLM_SUMMARY_KEEP_MESSAGES", None) or 6)
+MAX_TOKENS = int(getattr(settings, "LLM_SUMMARY_MAX_TOKENS", None) or 200)
+# Resúmenes simultáneos por proceso (compiten con los chats por la cuota del proveedor)
+_CONCURRENCY = 2
+# Temperatura baja: el resumen debe ser fiel, no creativo
+_TEMPERATURE = 0.2
+
+_TOKENIZER = get_tokenizer()
+_SLOTS = asyncio.Semaphore(_CONCURRENCY)
+_tasks: set[asyncio.Task] = set()
+
+_SUMMARIES = metrics.counter("psicoia_llm_summaries_total", "Resúmenes de conversación por resultado", ("result",))
+_SUMMARY_TOKENS = metrics.counter("psicoia_llm_summary_input_tokens_total",
+                                  "Tokens estimados enviados para resumir")
+
+class Summary:
+    """
+    Resumen de los mensajes de una historia anteriores a la posición absoluta `upto`.
+
+    - `message`/`encoded`/`tokens`: listo para ir después del system prompt.
+    """
+    __slots__ = ("text", "upto", "message", "encoded", "tokens")
+
+    def __init__(self, text: str, upto: int):
+        self.text = text
+        self.upto = upto
+        self.message = {"role": "system", "content": f"Resumen de la conversación hasta ahora:\n{text}"}
+        self.encoded = encode(self.message)
+        self.tokens = max(1, _TOKENIZER.count(self.message["content"]))
+
+def summary_start(history: ConversationHistory, summary: Summary | None) -> int:
+    """
+    Índice (en `history.messages`) del primer mensaje todavía sin resumir.
+    """
+    if summary is None:
+        return 0
+    return min(len(history), max(0, summary.upto - history.offset))
+
+def maybe_summarize(session) -> None:
+    """
+    Agenda el resumen de `session` si su parte sin resumir superó el umbral.
+
+    - Llamar con el lock de la sesión tomado, después de agregar un mensaje.
+    - Barato: una resta sobre la suma acumulada de tokens.
+    """
+    if not ENABLED or session.summarizing or not router.endpoints:
+        return
+    history = session.history
+    start = summary_start(history, session.summary)
+    if len(history) - KEEP_MESSAGES <= start or history.tokens_from(start) < TRIGGER_TOKENS:
+        return
+    session.summarizing = True
+    task = asyncio.create_task(_summarize(session))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+async def _summarize(session) -> None:
+    """
+    Compacta en el resumen los mensajes sin resumir, salvo los últimos `KEEP_MESSAGES`.
+    """
+    try:
+        async with _SLOTS:
+            async with session.lock:
+                history = session.history
+                previous = session.summary
+                start = summary_start(history, previous)
+                end = len(history) - KEEP_MESSAGES
+                if end <= start:
+                    return
+                turns = history.messages[start:end].as_dicts()
+                upto = history.offset + end
+            text = await _call(previous.text if previous is not None else "", turns)
+            if text:
+                # La sesión pudo liberarse mientras tanto: asignar a un objeto suelto no molesta
+                session.summary = Summary(text, upto)
+                _SUMMARIES.labels("ok").inc()
+                log.info(f"Resumen actualizado: {upto - (previous.upto if previous else 0)} mensajes "
+                         f"compactados en {session.summary.tokens} tokens")
+            else:
+                _SUMMARIES.labels("error").inc()
+    finally:
+        session.summarizing = False
+
+async def _call(previous: str, turns: list[dict]) -> str | None:
+    """
+    Pide el resumen al LLM (un intento, sin reintentos: es trabajo de fondo).
+    """
+    endpoint = await router.acquire()
+    if endpoint is None:
+        return None
+    transcript = "\n".join(
+        f"{'Usuario' if msg['role'] == 'user' else 'Asistente'}: {msg['content']}" for msg in turns
+    )
+    user_text = (f"Resumen anterior:\n{previous}\n\n" if previous else "") + f"Turnos nuevos:\n{transcript}"
+    system_msg = {"role": "system", "content": SUMMARY_PROMPT}
+    user_msg = {"role": "user", "content": user_text}
+    request = LLMRequest(
+        model=settings.MODEL_NAME, messages=[system_msg, user_msg],
+        encoded=[encode(system_msg), encode(user_msg)],
+        temperature=_TEMPERATURE, max_tokens=MAX_TOKENS, stream=False,
+    )
+    _SUMMARY_TOKENS.inc(_TOKENIZER.count(SUMMARY_PROMPT) + _TOKENIZER.count(user_text))
+    t0 = time.perf_counter()
+    try:
+        resp = await get_http_client().post(endpoint.url, headers=endpoint.request_headers(None),
+                                            content=request.body(endpoint.model), extensions=trace_extensions())
+    except httpx.HTTPError as e:
+        endpoint.observe(None, False)
+        log.warning(f"Resumen: error de red con {endpoint.name}: {e}")
+        return None
+    finally:
+        router.release(endpoint)
+    endpoint.update_limits(resp.headers, resp.status_code)
+    transient = resp.status_code == 429 or resp.status_code >= 500
+    endpoint.observe(None if transient else time.perf_counter() - t0, not transient)
+    if resp.is_error:
+        log.warning(f"Resumen: {endpoint.name} respondió {resp.status_code}")
+        return None
+    try:
+        data = loads(resp.content)
+        return (data["choices"][0]["message"]["content"] or "").strip() or None
+    except (ValueError, LookupError, TypeError):
+        return None
+
+async def stop_summaries() -> None:
+    """
+    Cancela los resúmenes en curso (al apagar).
+    """
+    for task in list(_tasks):
+        task.cancel()
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
@@ -0,0 +1,216 @@
+"""
+Tokenizadores para el control del presupuesto de entrada al LLM.
+
+- `CharsPerTokenTokenizer`: heurística `len(texto) / LLM_CHARS_PER_TOKEN` (comportamiento original).
+- `BPETokenizer`: BPE a nivel de bytes con un vocabulario local (formato `.tiktoken`:
+  una línea `<token en base64> <rank>` por entrada). No usa red.
+- `CachedTokenizer`: memoiza los conteos en un LRU acotado, con clave el texto.
+- `get_tokenizer()` elige el backend según `Settings` (`LLM_TOKENIZER`).
+"""
+
+# Importaciones necesarias
+import base64  # Decodificar tokens del vocabulario
+import heapq  # Próximo merge por rank
+from abc import ABC, abstractmethod  # Interfaz de los tokenizadores
+import re  # Pre-tokenización en palabras/números/símbolos
+from collections import OrderedDict  # LRU acotado
+from pathlib import Path  # Archivo de vocabulario
+
+from app.config import settings  # Configuración del proyecto
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("tokenizer")
+
+# Pre-tokenización aproximada al patrón de cl100k usando sólo `re` de la stdlib:
+# contracciones, palabras (con espacio previo), números de hasta 3 dígitos,
+# símbolos y espacios.
+_PRETOKENIZE = re.compile(
+    r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+
+# Una palabra pre-tokenizada más larga que esto se cuenta por tramos de este tamaño:
+# el conteo es aproximado, pero el costo de un mensaje sin espacios queda acotado.
+_MAX_PIECE_BYTES = 256
+
+class Tokenizer(ABC):
+    """
+    Interfaz común: `count(texto)` devuelve la cantidad de tokens.
+    """
+    name = "base"
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """Cantidad de tokens de `text`."""
+
+class CharsPerTokenTokenizer(Tokenizer):
+    name = "chars"
+
+    def __init__(self, chars_per_token: int):
+        """
+        - `chars_per_token`: chars promedio por token (al menos 1).
+        """
+        self.cpt = max(1, chars_per_token)
+
+    def count(self, text: str) -> int:
+        # Redondeo hacia arriba de len(text)/cpt
+        return (len(text) + self.cpt - 1) // self.cpt
+
+class BPETokenizer(Tokenizer):
+    name = "bpe"
+
+    def __init__(self, ranks: dict[bytes, int], piece_cache_size: int = 20000):
+        """
+        - `ranks`: token (bytes) → prioridad de merge (menor = antes).
+        - `piece_cache_size`: cache de conteos por palabra pre-tokenizada.
+        """
+        self.ranks = ranks
+        self._piece_cache: OrderedDict[str, int] = OrderedDict()
+        self._piece_cache_size = piece_cache_size
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> "BPETokenizer":
+        """
+        Carga un vocabulario en formato `.tiktoken` desde disco.
+        """
+        ranks: dict[bytes, int] = {}
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                token, rank = line.split()
+                ranks[base64.b64decode(token)] = int(rank)
+        return cls(ranks)
+
+    def _bpe_len(self, piece: bytes) -> int:
+        """
+        Aplica los merges de BPE sobre `piece` y devuelve cuántos tokens quedan.
+
+        - Los pares candidatos van en un heap `(rank, posición)`: cada merge cuesta
+          O(log n) en vez de recorrer todos los pares otra vez.
+        - Las partes forman una lista enlazada (`nxt`/`prv`); una parte absorbida queda en
+          `None` y las entradas del heap que ya no corresponden se descartan al sacarlas.
+        """
+        ranks = self.ranks
+        if piece in ranks:
+            return 1
+        n = len(piece)
+        parts: list[bytes | None] = [piece[i:i + 1] for i in range(n)]
+        nxt = list(range(1, n + 1))
+        prv = list(range(-1, n - 1))
+        heap = []
+        for i in range(n - 1):
+            rank = ranks.get(parts[i] + parts[i + 1])
+            if rank is not None:
+                heap.append((rank, i))
+        heapq.heapify(heap)
+        count = n
+        while heap:
+            rank, i = heapq.heappop(heap)
+            left = parts[i]
+            j = nxt[i]
+            if left is None or j >= n:
+                continue
+            merged = left + parts[j]
+            # Entrada vieja: alguna de las dos partes ya cambió desde que se agregó
+            if ranks.get(merged) != rank:
+                continue
+            parts[i] = merged
+            parts[j] = None
+            nxt[i] = nxt[j]
+            if nxt[i] < n:
+                prv[nxt[i]] = i
+            count -= 1
+            # Pares nuevos con los vecinos de la parte fusionada
+            if prv[i] >= 0:
+                rank = ranks.get(parts[prv[i]] + merged)
+                if rank is not None:
+                    heapq.heappush(heap, (rank, prv[i]))
+            if nxt[i] < n:
+                rank = ranks.get(merged + parts[nxt[i]])
+                if rank is not None:
+                    heapq.heappush(heap, (rank, i))
+        return count
+
+    def _piece_len(self, piece: bytes) -> int:
+        """Tokens de una palabra; las muy largas se cuentan por tramos de `_MAX_PIECE_BYTES`."""
+        if len(piece) <= _MAX_PIECE_BYTES:
+            return self._bpe_len(piece)
+        return sum(self._bpe_len(piece[i:i + _MAX_PIECE_BYTES])
+                   for i in range(0, len(piece), _MAX_PIECE_BYTES))
+
+    def count(self, text: str) -> int:
+        total = 0
+        cache = self._piece_cache
+        for piece in _PRETOKENIZE.findall(text):
+            n = cache.get(piece)
+            if n is not None:
+                cache.move_to_end(piece)
+            else:
+                n = self._piece_len(piece.encode("utf-8"))
+                cache[piece] = n
+                if len(cache) > self._piece_cache_size:
+                    cache.popitem(last=False)
+            total += n
+        return total
+
+class CachedTokenizer(Tokenizer):
+    def __init__(self, backend: Tokenizer, max_entries: int):
+        """
+        Envuelve `backend` con un LRU acotado de conteos.
+
+        - La clave es el texto mismo: el hash de un `str` se calcula una vez y queda guardado
+          en el objeto, así que repetir la consulta es O(1); dos textos distintos nunca
+          comparten entrada (la comparación de igualdad resuelve las colisiones de hash).
+        """
+        self.backend = backend
+        self.name = backend.name
+        self.max_entries = max(0, max_entries)
+        self._cache: OrderedDict[str, int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: str) -> int:
+        cache = self._cache
+        n = cache.get(text)
+        if n is not None:
+            self.hits += 1
+            cache.move_to_end(text)
+            return n
+        self.misses += 1
+        n = self.backend.count(text)
+        if self.max_entries:
+            cache[text] = n
+            if len(cache) > self.max_entries:
+                cache.popitem(last=False)
+        return n
+
+def get_tokenizer() -> Tokenizer:
+    """
+    Crea el tokenizador configurado en `Settings`.
+
+    - `LLM_TOKENIZER`: `chars` (default) o `bpe`.
+    - `LLM_TOKENIZER_VOCAB`: ruta al vocabulario `.tiktoken` para `bpe`.
+    - `LLM_TOKEN_CACHE_SIZE`: entradas del LRU de conteos (0 = sin cache).
+    - Si falta el vocabulario, se registra una advertencia y se usa `chars`.
+    """
+    kind = (getattr(settings, "LLM_TOKENIZER", None) or "chars").lower()
+    cpt = int(getattr(settings, "LLM_CHARS_PER_TOKEN", 4) or 4)
+    cache_size = getattr(settings, "LLM_TOKEN_CACHE_SIZE", None)
+    cache_size = 4096 if cache_size is None else int(cache_size)
+
+    backend: Tokenizer = CharsPerTokenTokenizer(cpt)
+    if kind == "bpe":
+        vocab = getattr(settings, "LLM_TOKENIZER_VOCAB", None)
+        try:
+            backend = BPETokenizer.from_file(vocab)
+            log.info(f"Tokenizer BPE cargado desde {vocab} ({len(backend.ranks)} tokens)")
+        except (OSError, TypeError, ValueError) as e:
+            log.warning(f"No pude cargar el vocabulario BPE ({vocab}): {e}; uso chars/token")
+    elif kind != "chars":
+        log.warning(f"LLM_TOKENIZER desconocido: {kind!r}; uso chars/token")
+
+    # La heurística es más barata que una consulta al LRU: sólo se cachea BPE
+    if cache_size and not isinstance(backend, CharsPerTokenTokenizer):
+        return CachedTokenizer(backend, cache_size)
+    return backend
@@ -0,0 +1,288 @@
+"""
+Diagnóstico del event loop (opt-in): lag, bloqueos con su stack, tramos por mensaje y perfil.
+
+- Lag: una tarea duerme `lag_interval` y mide cuánto tarda en volver; va al histograma
+  `psicoia_loop_lag_seconds`.
+- Bloqueos: un hilo vigila el latido de esa tarea; si el loop no vuelve en `slow_callback`,
+  guarda el stack del hilo del loop en ese momento (el código que lo está bloqueando) y se
+  loguea como WARNING con la duración total del bloqueo.
+- Tramos por mensaje: `start_spans()`/`add_span()`/`span()`/`finish_spans()` acumulan el
+  tiempo en cola, en HTTP, decodificando JSON y escribiendo al cliente, ligados al
+  `trace_id`. Sin diagnóstico activo son no-ops (una lectura de ContextVar).
+- Perfil: con SIGUSR1 muestrea el stack del loop (timer de CPU) durante `profile_seconds` y
+  escribe un archivo `.folded` (stacks colapsados de flamegraph.pl / speedscope), con la
+  corrutina de la tarea en curso como raíz de cada stack.
+- Sin dependencias de la configuración: lo usan la app y el gateway.
+"""
+
+# Importaciones necesarias
+import asyncio  # Tarea de lag y tarea en curso
+import collections  # Conteo de stacks del perfil
+import contextvars  # Tramos del mensaje en curso
+import logging  # Bloqueos y tramos
+import os  # Nombre del archivo de perfil
+import signal  # Perfil a pedido
+import sys  # Stack de otro hilo
+import threading  # Vigía de bloqueos
+import time  # Medición
+import traceback  # Formato del stack de un bloqueo
+from app.utils import metrics  # Histogramas de lag y tramos
+
+log = logging.getLogger("diagnostics")
+
+# Buckets para lag y tramos (segundos): de 1 ms a 2.5 s
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_LOOP_LAG = metrics.histogram("psicoia_loop_lag_seconds", "Retraso del event loop", buckets=LAG_BUCKETS)
+_LOOP_STALLS = metrics.counter("psicoia_loop_stalls_total", "Bloqueos del event loop sobre el umbral")
+_SPANS = metrics.histogram("psicoia_request_span_seconds", "Tiempo por tramo de cada mensaje", ("span",),
+                           buckets=LAG_BUCKETS)
+
+# Tramos del mensaje en curso (None = sin diagnóstico o fuera de un mensaje)
+_current: contextvars.ContextVar[dict | None] = contextvars.ContextVar("diagnostics_spans", default=None)
+# Se activa con `Diagnostics.start()`
+_enabled = False
+
+def start_spans() -> contextvars.Token | None:
+    """
+    Empieza a acumular tramos para el mensaje actual (no-op sin diagnóstico).
+    """
+    if not _enabled:
+        return None
+    return _current.set({})
+
+def add_span(name: str, seconds: float) -> None:
+    """Suma `seconds` al tramo `name` del mensaje actual."""
+    spans = _current.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        add_span(self.name, time.perf_counter() - self.t0)
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+_NO_SPAN = _NoSpan()
+
+def span(name: str) -> _Span | _NoSpan:
+    """
+    `with span("write"): ...` mide el bloque como tramo `name` del mensaje actual.
+    """
+    return _Span(name) if _current.get() is not None else _NO_SPAN
+
+def finish_spans(token: contextvars.Token | None, trace_id: str, total: float) -> None:
+    """
+    Cierra los tramos del mensaje: los registra en métricas y en el log con `trace_id`.
+
+    - `otro` es el tiempo de respuesta no cubierto por ningún tramo (historia,
+      tokens, esperas entre reintentos, turnos de otras tareas en el loop).
+    """
+    record_spans(take_spans(token), trace_id, total)
+
+def take_spans(token: contextvars.Token | None) -> dict | None:
+    """
+    Saca los tramos del mensaje del contexto actual sin registrarlos.
+
+    - Para cerrarlos en otra tarea con `record_spans` (por ejemplo, la que escribe la
+      respuesta); la tarea actual queda libre para el mensaje siguiente.
+    """
+    if token is None:
+        return None
+    spans = _current.get() or {}
+    _current.reset(token)
+    return spans
+
+def record_spans(spans: dict | None, trace_id: str, total: float) -> None:
+    """
+    Registra en métricas y en el log los tramos obtenidos con `take_spans` (no-op con None).
+    """
+    if spans is None:
+        return
+    for name, seconds in spans.items():
+        _SPANS.labels(name).observe(seconds)
+    covered = sum(seconds for name, seconds in spans.items() if name != "queue")
+    other = max(0.0, total - covered)
+    _SPANS.labels("other").observe(other)
+    detail = " ".join(f"{name}={seconds * 1000:.1f}" for name, seconds in spans.items())
+    log.info("[%s] tramos %s otro=%.1f total=%.1f ms", trace_id, detail, other * 1000,
+             (total + spans.get("queue", 0.0)) * 1000, extra={"trace_id": trace_id, "spans": spans})
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class Diagnostics:
+    def __init__(self, name: str = "app", lag_interval: float = 0.1, slow_callback: float = 0.1,
+                 profile_seconds: float = 10.0, profile_dir: str = ".", profile_interval: float = 0.005):
+        """
+        Diagnóstico de un event loop.
+
+        - `lag_interval`: cada cuánto se mide el lag (segundos).
+        - `slow_callback`: bloqueo a partir del cual se captura y loguea el stack.
+        - `profile_seconds`/`profile_interval`: duración y período (de CPU) del muestreo con SIGUSR1.
+        - `profile_dir`: carpeta de los archivos `<name>-<pid>-<fecha>.folded`.
+        """
+        self.name = name
+        self.lag_interval = lag_interval
+        self.slow_callback = slow_callback
+        self.profile_seconds = profile_seconds
+        self.profile_dir = profile_dir
+        self.profile_interval = profile_interval
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread = 0
+        self._beat = 0.0
+        self._stall_stack: str | None = None
+        self._stop = threading.Event()
+        self._lag_task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._profiling = False
+        self._profile_timer: asyncio.TimerHandle | None = None
+        # Perfil en curso: muestras por stack y handler de SIGPROF a restaurar
+        self._profile_counts: collections.Counter[str] = collections.Counter()
+        self._profile_previous = None
+
+    def start(self) -> None:
+        """
+        Arranca la medición de lag, el vigía de bloqueos y el perfil con SIGUSR1
+        (llamar desde el event loop).
+        """
+        global _enabled
+        _enabled = True
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._lag_task = asyncio.create_task(self._measure_lag())
+        self._watchdog = threading.Thread(target=self._watch, name=f"{self.name}-watchdog", daemon=True)
+        self._watchdog.start()
+        if hasattr(signal, "SIGUSR1"):
+            try:
+                self._loop.add_signal_handler(signal.SIGUSR1, self.profile)
+            except (NotImplementedError, RuntimeError):
+                pass
+        log.info(f"Diagnóstico activo: lag cada {self.lag_interval * 1000:.0f} ms, bloqueos > "
+                 f"{self.slow_callback * 1000:.0f} ms, perfil con SIGUSR1 (pid {os.getpid()})")
+
+    async def stop(self) -> None:
+        """Detiene la medición (un perfil en curso se escribe con lo muestreado)."""
+        global _enabled
+        _enabled = False
+        self._stop.set()
+        if self._profile_timer is not None:
+            self._profile_timer.cancel()
+            await self._finish_profile()
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+        if self._loop is not None and hasattr(signal, "SIGUSR1"):
+            self._loop.remove_signal_handler(signal.SIGUSR1)
+
+    async def _measure_lag(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - t0 - self.lag_interval)
+            self._beat = time.monotonic()
+            _LOOP_LAG.observe(lag)
+            if lag >= self.slow_callback:
+                _LOOP_STALLS.inc()
+                stack, self._stall_stack = self._stall_stack, None
+                log.warning("Event loop bloqueado %.0f ms%s", lag * 1000,
+                            f"; stack durante el bloqueo:\n{stack}" if stack else "")
+
+    def _watch(self) -> None:
+        """
+        Hilo vigía: si el latido se atrasa más que `slow_callback`, captura el stack del loop.
+        """
+        period = min(self.slow_callback, self.lag_interval) / 2
+        while not self._stop.wait(period):
+            behind = time.monotonic() - self._beat - self.lag_interval
+            if behind >= self.slow_callback and self._stall_stack is None:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._stall_stack = "".join(traceback.format_stack(frame)).rstrip()
+
+    def profile(self) -> None:
+        """
+        Muestrea el stack del loop durante `profile_seconds` y escribe el `.folded`.
+
+        - Usa un timer de CPU (`SIGPROF`): el handler corre en el hilo del loop entre dos
+          instrucciones y ve el frame real (un hilo muestreador sólo obtendría el GIL
+          cuando el loop lo suelta en `select`, y vería casi siempre eso).
+        - Sólo mide tiempo de CPU: la espera ociosa del loop no aparece.
+        """
+        if self._profiling:
+            log.info("Perfil ya en curso")
+            return
+        if not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+            log.warning("Perfil no disponible: requiere setitimer y el loop en el hilo principal")
+            return
+        self._profiling = True
+        self._profile_counts = counts = collections.Counter()
+
+        def on_sample(signum, frame) -> None:
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(self._root())
+            counts[";".join(reversed(stack))] += 1
+
+        self._profile_previous = signal.signal(signal.SIGPROF, on_sample)
+        signal.setitimer(signal.ITIMER_PROF, self.profile_interval, self.profile_interval)
+        self._profile_timer = self._loop.call_later(self.profile_seconds, self._finish_profile)
+        log.info(f"Perfilando el event loop {self.profile_seconds:g} s")
+
+    def _root(self) -> str:
+        """Corrutina de la tarea que está corriendo en el loop (o `loop` si ninguna)."""
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return "loop"
+        coro = task.get_coro()
+        return f"task:{getattr(coro, '__qualname__', task.get_name())}"
+
+    def _finish_profile(self) -> asyncio.Future:
+        """
+        Detiene el muestreo, restaura SIGPROF y escribe el `.folded` fuera del loop.
+
+        - Devuelve la escritura (`stop` la espera; el timer del perfil no).
+        """
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._profile_previous)
+        self._profiling = False
+        self._profile_timer = None
+        counts, self._profile_counts, self._profile_previous = self._profile_counts, collections.Counter(), None
+        path = os.path.join(self.profile_dir, f"{self.name}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        # Escribir fuera del loop
+        return self._loop.run_in_executor(None, self._write_profile, path, dict(counts))
+
+    @staticmethod
+    def _write_profile(path: str, counts: dict[str, int]) -> None:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                    f.write(f"{stack} {count}\n")
+            log.info(f"Perfil escrito en {path} ({sum(counts.values())} muestras)")
+        except OSError as e:
+            log.error(f"No se pudo escribir el perfil: {e}")
@@ -1,3 +1,276 @@
-import logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+"""
+Logging del proceso: escritura fuera del event loop, registros estructurados y muestreo.
+
+- Los `log.*` sólo encolan el registro (`QueueHandler`); un hilo (`QueueListener`) lo
+  formatea y lo escribe en stderr. Un stderr lento (driver de logs de Docker bajo presión)
+  ya no frena al servidor.
+- Cola acotada (`LOG_QUEUE_SIZE`) con política al llenarse (`LOG_DROP_POLICY`):
+  `drop_new` descarta el registro nuevo, `drop_old` el más viejo y `block` espera lugar.
+  El último 10% de la cola queda reservado para ERROR/CRITICAL con las tres políticas: un
+  registro de menor nivel nunca ocupa la reserva (`block` espera a que baje la cola por
+  debajo de ella; `drop_old` descarta el nuevo en vez de sacar uno viejo, que podría ser
+  un ERROR). Así una ráfaga de INFO no desplaza a los ERROR ni los hace esperar lugar; un
+  ERROR sólo se pierde (o espera, con `block`) si se llenó también la reserva. Los
+  descartes se avisan en el log y se cuentan en `psicoia_log_dropped_total`.
+- `LOG_FORMAT=json`: una línea JSON por registro con `ts`, `level`, `logger`, `msg` y los
+  campos extra (`trace_id`, ...). `text` (default) mantiene el formato de siempre.
+- Formateo diferido: `log.info("[%s] ...", trace_id, extra=trace_fields(trace_id))` arma el
+  texto en el hilo escritor, no en el event loop.
+- Muestreo: cada plantilla de mensaje por debajo de WARNING pasa a lo sumo `LOG_RATE_PER_KEY`
+  veces por segundo; la siguiente que pasa informa cuántas se omitieron.
+- `LOG_ASYNC=false` escribe en el hilo que loguea (como antes).
+"""
+
+# Importaciones necesarias
+import atexit  # Vaciar la cola al salir
+import json  # Formato estructurado
+import logging  # Logging estándar
+import os  # Reiniciar el hilo escritor tras fork (workers)
+import queue  # Cola acotada hacia el hilo escritor
+import time  # Timestamps ISO
+from logging.handlers import QueueHandler, QueueListener  # Escritura en otro hilo
+from typing import TextIO  # Destino configurable (benchmarks)
+from app.config import settings  # Configuración del proyecto
+from app.utils import metrics  # Descartes y muestreo
+
+# Formato de texto (el histórico del proyecto)
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+# Espera entre consultas de la cola con `block` (registros por debajo de ERROR)
+_BLOCK_POLL_S = 0.001
+# Políticas con la cola llena
+DROP_POLICIES = ("drop_new", "drop_old", "block")
+# Plantillas distintas que sigue el muestreo antes de reiniciar la tabla
+_MAX_SAMPLE_KEYS = 4096
+# Atributos propios de `LogRecord` (el resto son campos extra)
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "suppressed"}
+
+def trace_fields(trace_id: str | None) -> dict:
+    """
+    Campos estructurados de un registro ligado a un mensaje (`extra=`).
+    """
+    return {"trace_id": trace_id or "-"}
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        """Formato de texto; agrega cuántas líneas iguales se omitieron por muestreo."""
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} (+{suppressed} similares omitidos)" if suppressed else text
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Una línea JSON por registro: `ts`, `level`, `logger`, `msg`, `pid` y campos extra.
+        """
+        data = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class SampleFilter(logging.Filter):
+    def __init__(self, per_second: int):
+        """
+        Deja pasar cada plantilla (logger + mensaje sin formatear) hasta `per_second` veces por segundo.
+
+        - WARNING y superiores pasan siempre; `per_second=0` no limita.
+        - El primer registro de la ventana siguiente lleva `suppressed` con los omitidos.
+        """
+        super().__init__()
+        self.per_second = per_second
+        self.sampled = 0  # Registros omitidos en total
+        self._windows: dict[tuple, list] = {}  # plantilla → [inicio, pasados, omitidos]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.per_second or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        window = self._windows.get(key)
+        if window is None or record.created - window[0] >= 1.0:
+            if window is None and len(self._windows) >= _MAX_SAMPLE_KEYS:
+                # Mensajes ya formateados (f-strings) no se repiten: no acumularlos
+                self._windows.clear()
+            if window is not None and window[2]:
+                record.suppressed = window[2]
+            self._windows[key] = [record.created, 1, 0]
+            return True
+        if window[1] < self.per_second:
+            window[1] += 1
+            return True
+        window[2] += 1
+        self.sampled += 1
+        return False
+
+class BoundedQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue, policy: str = "drop_new", error_reserve: int | None = None):
+        """
+        Encola registros sin formatearlos, aplicando `policy` con la cola llena.
+
+        - `error_reserve`: lugares del final de la cola que sólo pueden ocupar los ERROR
+          (default: 10% del tamaño), con cualquier política. Nunca se bloquea al event loop
+          por un ERROR: con la reserva también llena se aplica la política (salvo `block`,
+          que espera).
+        - Un registro por debajo de ERROR que encuentra la cola en `_soft_max`: con `block`
+          espera a que baje de ahí (no a que haya lugar en la reserva); con `drop_new` y
+          `drop_old` se descarta él (nunca se saca otro registro para hacerle lugar).
+        """
+        super().__init__(log_queue)
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"LOG_DROP_POLICY debe ser uno de {DROP_POLICIES}")
+        self.policy = policy
+        size = log_queue.maxsize
+        reserve = size // 10 if error_reserve is None else error_reserve
+        # Tope para los registros por debajo de ERROR (0 = cola sin límite)
+        self._soft_max = max(1, size - reserve) if size > 0 else 0
+        self.dropped = 0  # Registros descartados en total
+        self._unreported = 0  # Descartes todavía no avisados en el log
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Deja el mensaje sin formatear (se arma en el hilo escritor).
+
+        - Sólo la traza de una excepción se formatea acá: el traceback no debe
+          viajar a otro hilo ni retener los frames.
+        """
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        below_error = self._soft_max and record.levelno < logging.ERROR
+        try:
+            if below_error and self.queue.qsize() >= self._soft_max:
+                raise queue.Full  # El resto de la cola es la reserva de los ERROR
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.policy == "block":
+                if below_error:
+                    self._wait_below_reserve()
+                self.queue.put(record)
+                return
+            if self.policy == "drop_old" and not below_error:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+            self.dropped += 1
+            self._unreported += 1
+            return
+        if self._unreported and not (self._soft_max and self.queue.qsize() >= self._soft_max):
+            # Hubo lugar otra vez (fuera de la reserva: el aviso es un WARNING): avisar cuántos se perdieron
+            notice = logging.makeLogRecord({
+                "name": "logging", "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": "%d registros de log descartados (cola llena)", "args": (self._unreported,),
+            })
+            try:
+                self.queue.put_nowait(notice)
+                self._unreported = 0
+            except queue.Full:
+                pass
+
+    def _wait_below_reserve(self) -> None:
+        """
+        `block` con un registro por debajo de ERROR: esperar a que el hilo escritor baje la
+        cola de `_soft_max` (la condición de `queue.Queue` sólo avisa que hay algún lugar).
+        """
+        while self.queue.qsize() >= self._soft_max:
+            time.sleep(_BLOCK_POLL_S)
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Con la cola llena, esperar a que el hilo escritor haga lugar
+        self.queue.put(self._sentinel)
+
+# Estado del logging del proceso
+_listener: _Listener | None = None
+_queue_handler: BoundedQueueHandler | None = None
+_sampler: SampleFilter | None = None
+
+def setup_logging(stream: TextIO | None = None, use_queue: bool | None = None,
+                  drop_policy: str | None = None, rate_per_key: int | None = None,
+                  queue_size: int | None = None) -> None:
+    """
+    Configura el logger raíz del proceso (se llama al importar este módulo).
+
+    - Cada parámetro omitido sale de la configuración (`LOG_*`).
+    - `stream`: destino de las líneas (default stderr).
+    - Reemplaza la configuración anterior (y detiene su hilo escritor).
+    """
+    global _listener, _queue_handler, _sampler
+    shutdown_logging()
+
+    level = (getattr(settings, "LOG_LEVEL", None) or "INFO").upper()
+    if (getattr(settings, "LOG_FORMAT", None) or "text").lower() == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter(TEXT_FORMAT)
+    writer = logging.StreamHandler(stream)
+    writer.setFormatter(formatter)
+
+    if use_queue is None:
+        use_queue = getattr(settings, "LOG_ASYNC", None) is not False
+    if use_queue:
+        log_queue = queue.Queue(queue_size or int(getattr(settings, "LOG_QUEUE_SIZE", None) or 10000))
+        policy = (drop_policy or getattr(settings, "LOG_DROP_POLICY", None) or "drop_new").lower()
+        _queue_handler = handler = BoundedQueueHandler(log_queue, policy)
+        _listener = _Listener(log_queue, writer)
+        _listener.start()
+    else:
+        handler = writer
+
+    if rate_per_key is None:
+        rate_per_key = getattr(settings, "LOG_RATE_PER_KEY", None)
+        rate_per_key = 50 if rate_per_key is None else int(rate_per_key)
+    _sampler = SampleFilter(rate_per_key)
+    handler.addFilter(_sampler)
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+def shutdown_logging() -> None:
+    """
+    Escribe lo pendiente y detiene el hilo escritor (si hay).
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    _queue_handler = None
+
+def _after_fork() -> None:
+    """
+    En un worker recién creado el hilo escritor no existe: armar cola e hilo propios.
+    """
+    global _listener
+    if _listener is not None:
+        _listener = None  # El hilo era del padre; no detenerlo desde acá
+        setup_logging()
+
 get_logger = logging.getLogger
+
+setup_logging()
+atexit.register(shutdown_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+metrics.counter("psicoia_log_dropped_total", "Registros de log descartados con la cola llena",
+                fn=lambda: _queue_handler.dropped if _queue_handler is not None else 0)
+metrics.counter("psicoia_log_sampled_total", "Registros de log omitidos por muestreo",
+                fn=lambda: _sampler.sampled if _sampler is not None else 0)
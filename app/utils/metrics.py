@@ -0,0 +1,245 @@
+"""
+Registro de métricas en proceso con formato de texto de Prometheus.
+
+- `Counter`, `Gauge` e `Histogram` (buckets fijos), con etiquetas opcionales.
+- Registrar es sumar a un float en memoria: nada se formatea ni se escribe
+  hasta que alguien pide `/metrics` (costo casi nulo si no se scrapea).
+- Un `Gauge` puede calcularse al momento del scrape (`fn`), por ejemplo
+  conexiones activas o tamaños de historia, sin tocar el camino caliente.
+- `start_metrics_server` expone `GET /metrics` en un puerto HTTP local, y `GET /ready`
+  (200 cuando el proceso terminó de arrancar, `set_ready`; 503 antes y durante el apagado).
+- Sin dependencias de la configuración: lo usan la app y el gateway.
+"""
+
+# Importaciones necesarias
+import asyncio  # Servidor HTTP mínimo
+import math  # Bucket +Inf
+from abc import ABC, abstractmethod  # Interfaz de las métricas
+from bisect import bisect_left  # Bucket de una observación
+from collections.abc import Callable, Iterable  # Tipos de los callbacks
+
+# Buckets por defecto (segundos): de 5 ms a 30 s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], le: str | None = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """
+        Serie con esos valores de etiqueta (conviene guardarla y reutilizarla).
+        """
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: se esperaban etiquetas {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """Serie nueva para una combinación de etiquetas."""
+
+    @abstractmethod
+    def _samples(self) -> Iterable[str]:
+        """Líneas de texto de todas las series."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 fn: Callable[[], float | dict[tuple[str, ...], float]] | None = None):
+        """
+        Contador monótono. Sin etiquetas se usa directo: `counter.inc()`.
+
+        - `fn`: se llama en cada scrape en lugar de usar el valor acumulado (para
+          contadores que ya lleva otro objeto); devuelve el valor, o
+          `{(etiquetas...): valor}` si la métrica tiene etiquetas.
+        """
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self._value = self.labels() if not self.labelnames else None
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._value.value += amount
+
+    def _samples(self) -> Iterable[str]:
+        if self.fn is None:
+            values = {key: child.value for key, child in self._children.items()}
+        else:
+            values = self.fn()
+            if not isinstance(values, dict):
+                values = {(): values}
+        for key, value in values.items():
+            yield f"{self.name}{_labels(self.labelnames, key)} {_fmt(float(value))}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self._value.value = value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._value.value -= amount
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        """
+        Histograma de buckets fijos (límites superiores inclusivos, como Prometheus).
+        """
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._value = self.labels() if not self.labelnames else None
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._value.observe(value)
+
+    def _samples(self) -> Iterable[str]:
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.bounds, math.inf), child.counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, _fmt(bound))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(child.sum)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {child.count}"
+
+class Registry:
+    def __init__(self):
+        """
+        Conjunto de métricas de un proceso.
+        """
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Registra `metric`; si ya hay una con ese nombre, devuelve la existente.
+        """
+        return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """
+        Todas las métricas en formato de texto de Prometheus (0.0.4).
+        """
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+# Registro del proceso
+REGISTRY = Registry()
+
+def counter(name: str, help: str, labelnames: Iterable[str] = (), fn=None) -> Counter:
+    """Crea (o devuelve) un contador del registro del proceso."""
+    return REGISTRY.register(Counter(name, help, labelnames, fn=fn))
+
+def gauge(name: str, help: str, labelnames: Iterable[str] = (), fn=None) -> Gauge:
+    """Crea (o devuelve) un gauge del registro del proceso."""
+    return REGISTRY.register(Gauge(name, help, labelnames, fn=fn))
+
+def histogram(name: str, help: str, labelnames: Iterable[str] = (),
+              buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Crea (o devuelve) un histograma del registro del proceso."""
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+# Listo para recibir tráfico (lo marca el proceso al terminar de arrancar)
+_ready = False
+
+def set_ready(ready: bool) -> None:
+    """Marca el proceso como listo (o no) para `/ready` y `psicoia_ready`."""
+    global _ready
+    _ready = ready
+
+gauge("psicoia_ready", "1 si el proceso terminó de arrancar y acepta tráfico", fn=lambda: float(_ready))
+
+async def _serve(registry: Registry, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Atiende un request HTTP/1.x: `GET /metrics` → texto de Prometheus, `GET /ready` → 200/503,
+    otro → 404.
+    """
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5.0)
+        parts = head.split(b" ", 2)
+        path = parts[1].split(b"?", 1)[0] if len(parts) > 1 else b""
+        if parts[0] == b"GET" and path == b"/metrics":
+            status, body = "200 OK", registry.render().encode("utf-8")
+        elif parts[0] == b"GET" and path == b"/ready":
+            status, body = ("200 OK", b"ready\n") if _ready else ("503 Service Unavailable", b"starting\n")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int, registry: Registry = REGISTRY) -> asyncio.AbstractServer:
+    """
+    Expone `registry` en `http://host:port/metrics` (y la readiness en `/ready`).
+    """
+    return await asyncio.start_server(lambda r, w: _serve(registry, r, w), host, port)
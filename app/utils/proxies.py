@@ -0,0 +1,82 @@
+"""
+Gateways/proxies de confianza (`TRUSTED_PROXIES`): IPs, redes CIDR o nombres de host.
+
+- Cada entrada es una IP (`10.0.0.5`), una red (`172.16.0.0/12`) o un nombre de host
+  (`gateway`, el servicio del compose); las IPs y redes se comparan sin red de por medio.
+- Los nombres se resuelven con el resolver del sistema (`loop.getaddrinfo`, fuera del
+  event loop) y se vuelven a resolver, como mucho cada `refresh_s` segundos, cuando llega
+  una IP que no está entre las conocidas: un contenedor reiniciado cambia de IP.
+- `is_internal(ip)`: dirección privada o de loopback (un proxy de la red interna).
+"""
+
+import asyncio  # Resolución de nombres fuera del event loop
+import ipaddress  # IPs y redes CIDR
+import socket  # Tipo de socket para getaddrinfo
+import time  # Intervalo entre resoluciones
+
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("proxies")
+
+def _address(ip: str) -> ipaddress.IPv4Address | ipaddress.IPv6Address | None:
+    """IP de `ip` (sin zona `%eth0`; una IPv4 mapeada en IPv6 se toma como IPv4), o None."""
+    try:
+        addr = ipaddress.ip_address(ip.split("%", 1)[0])
+    except ValueError:
+        return None
+    if addr.version == 6 and addr.ipv4_mapped is not None:
+        return addr.ipv4_mapped
+    return addr
+
+def is_internal(ip: str) -> bool:
+    """`ip` es privada o de loopback (red interna, como la de Docker)."""
+    addr = _address(ip)
+    return addr is not None and (addr.is_private or addr.is_loopback)
+
+class TrustedProxies:
+    def __init__(self, spec: str, refresh_s: float = 30.0):
+        """
+        - `spec`: entradas separadas por coma (IP, red CIDR o nombre de host).
+        - `refresh_s`: mínimo entre dos resoluciones de los nombres.
+        """
+        self.networks: list[ipaddress.IPv4Network | ipaddress.IPv6Network] = []
+        self.hosts: list[str] = []
+        for entry in spec.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            try:
+                self.networks.append(ipaddress.ip_network(entry, strict=False))
+            except ValueError:
+                self.hosts.append(entry)
+        self.refresh_s = refresh_s
+        self._resolved: set = set()  # IPs de `hosts` en la última resolución
+        self._resolved_at = float("-inf")
+
+    async def contains(self, ip: str) -> bool:
+        """`ip` es de un proxy de confianza."""
+        addr = _address(ip)
+        if addr is None:
+            return False
+        if any(addr in network for network in self.networks):
+            return True
+        if not self.hosts:
+            return False
+        if addr not in self._resolved and time.monotonic() - self._resolved_at >= self.refresh_s:
+            await self._resolve()
+        return addr in self._resolved
+
+    async def _resolve(self) -> None:
+        """Resuelve `hosts`; un nombre que no resuelve se loguea y se saltea."""
+        self._resolved_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        resolved = set()
+        for host in self.hosts:
+            try:
+                infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+            except OSError as e:
+                log.warning("TRUSTED_PROXIES: no pude resolver %r: %s", host, e)
+                continue
+            resolved.update(addr for info in infos if (addr := _address(info[4][0])) is not None)
+        self._resolved = resolved
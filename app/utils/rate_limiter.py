@@ -1,13 +1,29 @@
 """
-Implementación de un limitador de tasa basado en una ventana deslizante.
+Limitadores de tasa.
 
-- Permite controlar la cantidad de eventos que pueden ocurrir en un intervalo de tiempo definido.
-- Utiliza una cola (deque) para almacenar marcas de tiempo de los eventos recientes.
+- `SlidingWindowLimiter`: ventana deslizante por conexión; guarda una marca de
+  tiempo por evento en un deque.
+- `RateLimiterRegistry`: GCRA (equivalente a un token bucket) por clave
+  (usuario/sesión/IP), con memoria constante por clave y backend intercambiable:
+  - `MemoryRateBackend`: dict del proceso con desalojo de claves inactivas.
+  - `SharedMemoryRateBackend`: tabla de tamaño fijo en memoria compartida,
+    para que varios workers (`--workers N`) vean el mismo límite.
 """
 
+import hashlib  # Hash estable de claves (backend compartido)
+import mmap  # Memoria compartida entre procesos
+import os  # Archivo de la memoria compartida
+import struct  # Slots binarios de la tabla compartida
+import tempfile  # Directorio alternativo a /dev/shm
 import time  # Para obtener marcas de tiempo monotónicas
+from abc import ABC, abstractmethod  # Interfaz de los backends
 from collections import deque  # Cola eficiente para manejar eventos recientes
 
+try:
+    import fcntl  # Lock entre procesos (sólo Unix)
+except ImportError:  # Windows
+    fcntl = None
+
 class SlidingWindowLimiter:
     def __init__(self, max_events: int, window_seconds: int):
         """
@@ -37,3 +53,185 @@ class SlidingWindowLimiter:
             self.events.append(now)  # Registrar el nuevo evento
             return True
         return False  # Rechazar el evento si se excede el límite
+
+# --- Limitador global GCRA (memoria constante por clave, compartible entre procesos) ---
+
+class RateBackend(ABC):
+    """
+    Almacén del estado GCRA: un único float por clave (TAT, "theoretical arrival time").
+
+    - `allow()` debe ser atómico para la clave (leer, decidir y escribir).
+    - Una clave cuyo TAT ya pasó equivale a una clave nueva: se puede desalojar.
+    """
+    @abstractmethod
+    def allow(self, key: str, now: float, interval: float, limit: float) -> bool:
+        """True si el evento de `key` en `now` entra en el límite (y lo registra)."""
+
+    def __len__(self) -> int:
+        return 0
+
+def _gcra(tat: float | None, now: float, interval: float, limit: float) -> float | None:
+    """
+    Paso GCRA: devuelve el TAT nuevo si el evento se permite, o None si se rechaza.
+
+    - `interval`: segundos entre eventos a ritmo sostenido (`window / max_events`).
+    - `limit`: ráfaga tolerada en segundos (`window`: hasta `max_events` seguidos).
+    """
+    new_tat = max(tat or now, now) + interval
+    return new_tat if new_tat - now <= limit else None
+
+class MemoryRateBackend(RateBackend):
+    def __init__(self, max_keys: int = 100_000, sweep_interval: float = 60.0):
+        """
+        Backend en memoria del proceso.
+
+        - `max_keys`: tope de claves; al superarlo se desaloja la más antigua.
+        - Cada `sweep_interval` segundos se borran las claves inactivas (TAT vencido).
+        """
+        self.max_keys = max(1, max_keys)
+        self.sweep_interval = sweep_interval
+        self._tat: dict[str, float] = {}
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def allow(self, key: str, now: float, interval: float, limit: float) -> bool:
+        if now >= self._next_sweep:
+            self.sweep(now)
+            self._next_sweep = now + self.sweep_interval
+        # `_gcra` en línea: es el camino caliente de cada mensaje
+        tat = self._tat.get(key, now)
+        new_tat = (tat if tat > now else now) + interval
+        if new_tat - now > limit:
+            return False
+        self._tat[key] = new_tat
+        if len(self._tat) > self.max_keys:
+            del self._tat[next(iter(self._tat))]
+        return True
+
+    def sweep(self, now: float) -> int:
+        """
+        Borra las claves inactivas; devuelve cuántas.
+        """
+        idle = [k for k, tat in self._tat.items() if tat <= now]
+        for k in idle:
+            del self._tat[k]
+        return len(idle)
+
+class SharedMemoryRateBackend(RateBackend):
+    # Slot: hash de la clave (u64, 0 = libre) + TAT (f64)
+    _SLOT = struct.Struct("<Qd")
+    # Slots revisados por clave (direccionamiento abierto)
+    _PROBES = 8
+
+    def __init__(self, path: str, slots: int = 65536):
+        """
+        Backend compartido entre procesos: tabla hash de tamaño fijo en un archivo
+        mapeado en memoria (por ejemplo en `/dev/shm`), protegida con `flock`.
+
+        - Memoria constante: `slots * 16` bytes, sin importar cuántos usuarios haya.
+        - Si los slots de una clave están ocupados, se reemplaza el menos reciente
+          (los vencidos primero): desalojo de inactivos sin barredora.
+        - Cada proceso abre su propio descriptor (también tras un fork), así
+          el lock excluye de verdad entre workers.
+        """
+        self.path = path
+        self.slots = max(self._PROBES, slots)
+        self._pid = None
+        self._fd = -1
+        self._mm: mmap.mmap | None = None
+
+    def _open(self) -> mmap.mmap:
+        if self._pid != os.getpid():
+            size = self.slots * self._SLOT.size
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._mm = mmap.mmap(self._fd, size)
+            self._pid = os.getpid()
+        return self._mm
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # Estable entre procesos (`hash()` de str cambia con PYTHONHASHSEED); nunca 0
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") | 1
+
+    def allow(self, key: str, now: float, interval: float, limit: float) -> bool:
+        mm = self._open()
+        h = self._hash(key)
+        slot_size = self._SLOT.size
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            target = None
+            victim, victim_tat = None, float("inf")
+            for i in range(self._PROBES):
+                off = ((h + i) % self.slots) * slot_size
+                slot_key, tat = self._SLOT.unpack_from(mm, off)
+                if slot_key == h:
+                    target = off
+                    break
+                if slot_key == 0 or tat <= now:
+                    tat = float("-inf")  # Libre o inactivo: el mejor candidato
+                if tat < victim_tat:
+                    victim, victim_tat = off, tat
+            if target is None:
+                target, tat = victim, None
+            new_tat = _gcra(tat, now, interval, limit)
+            if new_tat is None:
+                return False
+            self._SLOT.pack_into(mm, target, h, new_tat)
+            return True
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        mm = self._open()
+        now = time.monotonic()
+        return sum(
+            1 for off in range(0, len(mm), self._SLOT.size)
+            if self._SLOT.unpack_from(mm, off)[1] > now
+        )
+
+class RateLimiterRegistry:
+    def __init__(self, max_events: int, window_seconds: float, backend: RateBackend | None = None):
+        """
+        Limitador de tasa GCRA por clave (usuario, sesión o IP), no por conexión.
+
+        - Permite ráfagas de hasta `max_events` y, sostenido, `max_events` por ventana.
+        - O(1) en tiempo y memoria por clave (un float), contra un deque por evento.
+        - Reconectar no reinicia el límite: el estado vive en el registro (o en el
+          backend compartido), no en la conexión.
+        """
+        self.max = max(1, max_events)
+        self.win = float(window_seconds)
+        self.interval = self.win / self.max
+        self.backend = backend if backend is not None else MemoryRateBackend()
+
+    def allow(self, key: str) -> bool:
+        """
+        Registra un evento para `key` y devuelve si está permitido.
+        """
+        return self.backend.allow(key, time.monotonic(), self.interval, self.win)
+
+    def __len__(self) -> int:
+        return len(self.backend)
+
+def rate_limiter_from_settings() -> RateLimiterRegistry:
+    """
+    Crea el registro del proceso según `RATE_BACKEND` ("memory" o "shm").
+    """
+    from app.config import settings  # Importación diferida: el módulo no depende de la configuración
+    from app.utils.logger import get_logger
+
+    backend: RateBackend | None = None
+    if (getattr(settings, "RATE_BACKEND", None) or "memory").lower() == "shm":
+        if fcntl is None:
+            get_logger("rate").warning("RATE_BACKEND=shm requiere fcntl (Unix); usando memoria del proceso")
+        else:
+            default_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            backend = SharedMemoryRateBackend(
+                getattr(settings, "RATE_SHM_PATH", None) or os.path.join(default_dir, "psicoia-rate"),
+                slots=int(getattr(settings, "RATE_SHM_SLOTS", None) or 65536),
+            )
+    return RateLimiterRegistry(settings.RATE_MAX_MESSAGES, settings.RATE_WINDOW_SECONDS, backend)
@@ -0,0 +1,202 @@
+"""
+Scheduler de admisión hacia el LLM (reemplaza el semáforo global FIFO).
+
+- `capacity` (`MAX_IN_FLIGHT`): requests simultáneos al LLM en el proceso.
+- `per_user_max` (`PER_USER_MAX`): requests simultáneos de un mismo usuario.
+- Cola justa ponderada entre usuarios (start-time fair queuing): cada pedido recibe
+  una etiqueta virtual `max(reloj, última del usuario) + 1/peso` y se atiende la
+  menor; un usuario que encola muchos mensajes no pasa delante de los demás.
+- Carril prioritario: los mensajes de riesgo se atienden antes que cualquier otro
+  y nunca se rechazan por cola llena.
+- Cola acotada (`QUEUE_MAX`): si está llena, el pedido se rechaza al instante
+  (`SchedulerFull`) en vez de esperar indefinidamente.
+- Cada admisión devuelve el tiempo que el pedido esperó en la cola.
+"""
+
+import asyncio  # Futures de espera
+import heapq  # Cola ordenada por etiqueta virtual
+import itertools  # Desempate FIFO
+import time  # Tiempo de espera en cola
+from collections import deque  # Carril prioritario FIFO
+from contextlib import asynccontextmanager  # `async with scheduler.slot(...)`
+
+class SchedulerFull(Exception):
+    """
+    La cola de espera está llena: el pedido se rechaza sin esperar.
+    """
+
+class _Waiter:
+    __slots__ = ("user", "tag", "urgent", "future", "enqueued")
+
+    def __init__(self, user: str, tag: float, urgent: bool, future: asyncio.Future):
+        self.user = user
+        self.tag = tag  # Etiqueta virtual (orden justo entre usuarios)
+        self.urgent = urgent
+        self.future = future
+        self.enqueued = time.monotonic()
+
+class FairScheduler:
+    def __init__(self, capacity: int, per_user_max: int, max_queue: int):
+        """
+        Inicializa el scheduler.
+
+        - `capacity`: requests simultáneos en total.
+        - `per_user_max`: requests simultáneos por usuario.
+        - `max_queue`: pedidos normales en espera antes de rechazar.
+        """
+        self.capacity = max(1, capacity)
+        self.per_user_max = max(1, per_user_max)
+        self.max_queue = max(1, max_queue)
+        self.in_flight = 0
+        self._running: dict[str, int] = {}  # Requests en curso por usuario
+        self._finish: dict[str, float] = {}  # Última etiqueta virtual por usuario
+        self._vtime = 0.0  # Reloj virtual: etiqueta del último pedido admitido
+        self._urgent: deque[_Waiter] = deque()
+        self._heap: list[tuple[float, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self.queued = 0  # Pedidos normales esperando (sin contar cancelados)
+        # Contadores
+        self.admitted = 0
+        self.rejected = 0
+        self.urgent_admitted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def has_room(self, urgent: bool = False) -> bool:
+        """
+        Indica si un pedido nuevo sería aceptado (los urgentes siempre).
+        """
+        return urgent or self.queued < self.max_queue
+
+    async def acquire(self, user: str, urgent: bool = False, weight: float = 1.0) -> float:
+        """
+        Espera un lugar para `user` y devuelve los segundos que esperó en la cola.
+
+        - Lanza `SchedulerFull` si la cola normal está llena.
+        - Si la espera se cancela, el pedido sale de la cola (o devuelve el lugar).
+        """
+        future = asyncio.get_running_loop().create_future()
+        if urgent:
+            waiter = _Waiter(user, 0.0, True, future)
+            self._urgent.append(waiter)
+        else:
+            previous = self._finish.get(user, 0.0)
+            tag = max(self._vtime, previous) + 1.0 / max(weight, 1e-6)
+            waiter = _Waiter(user, tag, False, future)
+            self._finish[user] = tag
+            heapq.heappush(self._heap, (tag, next(self._seq), waiter))
+            self.queued += 1
+        self._dispatch()
+
+        if not future.done() and not urgent and self.queued > self.max_queue:
+            # Cola llena: rechazo inmediato
+            future.cancel()
+            self.queued -= 1
+            self.rejected += 1
+            self._finish[user] = previous  # El rechazo no cuenta para la justicia
+            raise SchedulerFull(f"cola llena ({self.max_queue})")
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(user)  # Admitido justo antes de cancelarse
+            elif urgent:
+                self._urgent.remove(waiter)  # Sin esperar a que llegue al frente del carril
+            else:
+                self.queued -= 1
+            future.cancel()
+            raise
+
+        wait = time.monotonic() - waiter.enqueued
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        return wait
+
+    def release(self, user: str) -> None:
+        """
+        Devuelve el lugar de `user` y admite a los siguientes.
+        """
+        self.in_flight -= 1
+        running = self._running.get(user, 1) - 1
+        if running > 0:
+            self._running[user] = running
+        else:
+            self._running.pop(user, None)
+            if self._finish.get(user, 0.0) <= self._vtime:
+                # Sin pedidos pendientes: no retener estado del usuario
+                self._finish.pop(user, None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: str, urgent: bool = False, weight: float = 1.0):
+        """
+        `async with scheduler.slot(user) as wait:` — admite, ejecuta y libera.
+        """
+        wait = await self.acquire(user, urgent=urgent, weight=weight)
+        try:
+            yield wait
+        finally:
+            self.release(user)
+
+    def _eligible(self, user: str) -> bool:
+        return self._running.get(user, 0) < self.per_user_max
+
+    def _next(self) -> _Waiter | None:
+        """
+        Próximo pedido a admitir: primero el carril prioritario, después la menor etiqueta.
+
+        - Se saltean usuarios que ya están en su tope, y en el heap los cancelados (los
+          urgentes cancelados salen del carril al cancelarse).
+        """
+        for waiter in self._urgent:
+            if self._eligible(waiter.user):
+                self._urgent.remove(waiter)
+                return waiter
+
+        skipped = []
+        chosen = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            waiter = entry[2]
+            if waiter.future.done():
+                continue  # Cancelado o rechazado
+            if self._eligible(waiter.user):
+                chosen = waiter
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return chosen
+
+    def _dispatch(self) -> None:
+        """
+        Admite pedidos mientras haya capacidad.
+        """
+        while self.in_flight < self.capacity:
+            waiter = self._next()
+            if waiter is None:
+                return
+            self.in_flight += 1
+            self._running[waiter.user] = self._running.get(waiter.user, 0) + 1
+            self.admitted += 1
+            if waiter.urgent:
+                self.urgent_admitted += 1
+            else:
+                self.queued -= 1
+                self._vtime = max(self._vtime, waiter.tag)
+            waiter.future.set_result(None)
+
+    def stats(self) -> dict:
+        """
+        Contadores: en curso, en cola, admitidos, rechazados y espera en cola.
+        """
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued + len(self._urgent),
+            "admitted": self.admitted,
+            "urgent": self.urgent_admitted,
+            "rejected": self.rejected,
+            "wait_avg_ms": self.wait_total / self.admitted * 1000 if self.admitted else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+        }
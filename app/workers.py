@@ -0,0 +1,128 @@
+"""
+Modo multi-proceso del servidor TCP (`python -m app.server --workers N`).
+
+- Un proceso supervisor lanza N workers; cada uno corre su propio event loop
+  (`app.server.main`) y reparte el CPU de JSON, logs y parseo de líneas.
+- Todos escuchan en el mismo puerto:
+  - `reuseport` (default si el SO lo soporta): cada worker abre su socket con
+    SO_REUSEPORT y el kernel balancea las conexiones nuevas.
+  - `shared`: el supervisor abre UN socket y los workers lo heredan por fork.
+- Afinidad: una conexión TCP vive entera en un worker (con su sesión en RAM).
+  Para retomar una conversación desde otro worker hay que compartir la historia
+  con `HISTORY_BACKEND=sqlite`: al desconectarse se escribe a disco y el worker
+  que reciba la reconexión la carga perezosamente.
+- Apagado ordenado: SIGTERM/SIGINT se reenvía a los workers, que dejan de aceptar
+  y esperan a sus conexiones activas (`WORKER_SHUTDOWN_TIMEOUT`).
+- Un worker que termina inesperadamente se reinicia (con un mínimo entre reinicios).
+"""
+
+# Importaciones necesarias
+import asyncio  # Event loop de cada worker
+import multiprocessing  # Procesos worker
+import signal  # Apagado ordenado
+import socket  # Socket compartido / SO_REUSEPORT
+import time  # Control de reinicios
+from multiprocessing.connection import wait  # Esperar a que termine algún worker
+
+from app.config import settings  # Configuración del proyecto
+from app.utils.logger import get_logger  # Logger configurado
+
+# Logger para este módulo
+log = get_logger("workers")
+
+# Segundos mínimos entre reinicios del mismo worker (evita loops de crash)
+RESTART_MIN_INTERVAL = 1.0
+
+def _bind_shared_socket(host: str | None, port: int) -> socket.socket:
+    """
+    Abre el socket de escucha en el supervisor para que los workers lo hereden.
+    """
+    sock = socket.create_server((host or "0.0.0.0", port), reuse_port=False, backlog=1024)
+    sock.setblocking(False)
+    return sock
+
+def _worker_main(index: int, sock: socket.socket | None) -> None:
+    """
+    Punto de entrada de cada proceso worker.
+    """
+    # Importación diferida: el supervisor no necesita el servidor ni sus dependencias
+    from app.server import main
+    from app.utils.logger import shutdown_logging
+
+    # El supervisor coordina el apagado: Ctrl+C en la consola no debe matar al worker a medias
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(main(sock=sock, worker=index))
+    finally:
+        # multiprocessing sale con os._exit (sin atexit): escribir los logs encolados
+        shutdown_logging()
+
+def run_workers(count: int) -> None:
+    """
+    Lanza y supervisa `count` workers hasta recibir SIGTERM/SIGINT.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        # Sin fork (Windows) no se puede heredar el socket ni el estado importado
+        log.warning("--workers requiere fork; se ejecuta un solo proceso")
+        from app.server import main
+        asyncio.run(main())
+        return
+
+    ctx = multiprocessing.get_context("fork")
+    mode = (getattr(settings, "WORKER_BIND", None) or "").lower()
+    if mode not in ("reuseport", "shared"):
+        mode = "reuseport" if hasattr(socket, "SO_REUSEPORT") else "shared"
+    sock = _bind_shared_socket(settings.APP_HOST, settings.APP_PORT) if mode == "shared" else None
+    if (getattr(settings, "HISTORY_BACKEND", None) or "memory").lower() == "memory":
+        log.warning("Con varios workers y HISTORY_BACKEND=memory, una sesión sólo se retoma en el mismo worker")
+
+    procs: dict[int, multiprocessing.Process] = {}
+    started: dict[int, float] = {}
+    stopping = False
+
+    def spawn(index: int) -> None:
+        proc = ctx.Process(target=_worker_main, args=(index, sock), name=f"psicoia-worker-{index}")
+        proc.start()
+        procs[index] = proc
+        started[index] = time.monotonic()
+        log.info(f"Worker {index} iniciado (pid={proc.pid}, bind={mode})")
+
+    def shutdown(signum, frame) -> None:
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        log.info(f"Señal {signum}: apagando {len(procs)} workers")
+        for proc in procs.values():
+            if proc.is_alive():
+                proc.terminate()  # SIGTERM → apagado ordenado en el worker
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(count):
+        spawn(index)
+
+    # Supervisar: reiniciar workers caídos hasta que se pida apagar
+    while not stopping:
+        wait([p.sentinel for p in procs.values()], timeout=1.0)
+        for index, proc in list(procs.items()):
+            if proc.is_alive() or stopping:
+                continue
+            log.warning(f"Worker {index} terminó (exit={proc.exitcode}); reiniciando")
+            delay = RESTART_MIN_INTERVAL - (time.monotonic() - started[index])
+            if delay > 0:
+                time.sleep(delay)
+            if not stopping:
+                spawn(index)
+
+    timeout = float(getattr(settings, "WORKER_SHUTDOWN_TIMEOUT", None) or 10.0)
+    for index, proc in procs.items():
+        proc.join(timeout + 5)
+        if proc.is_alive():
+            log.warning(f"Worker {index} no terminó a tiempo; forzando cierre")
+            proc.kill()
+            proc.join()
+    if sock is not None:
+        sock.close()
+    log.info("Workers detenidos")
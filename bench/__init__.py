@@ -0,0 +1,8 @@
+"""
+Benchmarks locales de PsicoIA.
+
+- No forman parte del servidor; se ejecutan a mano con `python -m bench.<modulo>`.
+- Usan un stub OpenAI-compatible local (`bench.stub_llm`) para no depender del proveedor.
+- `bench.loadgen` es la prueba de punta a punta (TCP o WS) y `bench.report` guarda y compara
+  sus resultados en JSON.
+"""
@@ -0,0 +1,73 @@
+"""
+Micro-benchmark de `build_messages`: versión anterior vs. suma acumulada.
+
+- Anterior: copia la historia (`get_history`) y re-estima cada mensaje desde el final,
+  leyendo `settings` en cada paso.
+- Actual: `ConversationHistory` con tokens memoizados y ventana por búsqueda binaria.
+
+Uso:
+    python -m bench.bench_build_messages --budget 100000
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import timeit  # Medición de micro-tiempos
+
+from app.config import settings
+from app.prompts.promptgeneral import SYSTEM_PROMPT
+from app.services import llm_client
+from app.services.history import ConversationHistory
+
+def _legacy_est_tokens_msg(msg: dict) -> int:
+    """Estimación anterior: lee `settings` en cada llamada."""
+    s = msg.get("content", "") or ""
+    cpt = max(1, int(getattr(settings, "LLM_CHARS_PER_TOKEN", 4) or 4))
+    return max(1, (len(s or "") + cpt - 1) // cpt)
+
+def legacy_build_messages(system_prompt: str, history: list[dict], user_text: str) -> list[dict]:
+    """Copia fiel de `build_messages` antes del cambio."""
+    budget = int(getattr(settings, "LLM_INPUT_TOKEN_BUDGET", 2000) or 2000)
+    system_msg = {"role": "system", "content": system_prompt}
+    user_msg = {"role": "user", "content": user_text}
+    remaining = budget - _legacy_est_tokens_msg(system_msg) - _legacy_est_tokens_msg(user_msg) - 32
+    remaining = max(0, remaining)
+    picked: list[dict] = []
+    total = 0
+    for msg in reversed(history):
+        t = _legacy_est_tokens_msg(msg)
+        if total + t > remaining:
+            break
+        picked.append(msg)
+        total += t
+    picked.reverse()
+    return [system_msg] + picked + [user_msg]
+
+def main(sizes: list[int], budget: int) -> None:
+    # El presupuesto se fija para ambos caminos (el anterior lo lee de settings)
+    settings.LLM_INPUT_TOKEN_BUDGET = budget
+    llm_client._INPUT_BUDGET = budget
+    text = "Hoy me siento un poco mejor, aunque me cuesta dormir y pienso mucho. " * 2
+
+    for n in sizes:
+        flat = [{"role": "user" if i % 2 == 0 else "assistant", "content": text} for i in range(n)]
+        hist = ConversationHistory(n)
+        for msg in flat:
+            hist.append(msg["role"], msg["content"], llm_client._est_tokens_msg(msg))
+
+        reps = max(50, 20000 // n)
+        # Anterior: copia (get_history) + recorrido completo
+        old = timeit.timeit(lambda: legacy_build_messages(SYSTEM_PROMPT, list(flat), "hola"), number=reps)
+        new = timeit.timeit(lambda: llm_client.build_messages(SYSTEM_PROMPT, hist, "hola"), number=reps)
+        assert legacy_build_messages(SYSTEM_PROMPT, flat, "hola") == llm_client.build_messages(SYSTEM_PROMPT, hist, "hola")
+        print(
+            f"n={n:5d}  anterior={old / reps * 1e6:9.1f} µs  actual={new / reps * 1e6:8.1f} µs  "
+            f"x{old / new:5.1f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--budget", type=int, default=100000,
+                        help="presupuesto de tokens (alto para que entre toda la historia)")
+    args = parser.parse_args()
+    main(args.sizes, args.budget)
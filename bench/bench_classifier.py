@@ -0,0 +1,80 @@
+"""
+Benchmark del clasificador local de mensajes (`app.services.risk`).
+
+- Corpus sintético de `--messages` mensajes en español (largo variable, mayúsculas,
+  acentos, emojis) con palabras clave de todas las categorías en `--keyword-rate` de ellos.
+- Compara el clasificador por regex (el de antes, extendido: plegado NFKD + una regex
+  por categoría) con el autómata de Aho-Corasick, y verifica que coincidan.
+- Reporta mensajes por segundo, µs por mensaje y MB/s de texto.
+
+Uso:
+    python -m bench.bench_classifier --messages 200000
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import random  # Corpus reproducible
+import re  # Clasificador por regex
+import time  # Medición
+
+from app.prompts.promptgeneral import KEYWORDS
+from app.services.risk import classifier, fold
+
+FILLER = (
+    "hoy me siento bastante raro con el trabajo y la facultad pero no sé bien por qué "
+    "a veces pienso que todo va demasiado rápido y me cuesta dormir tranquilo después de cenar "
+    "mi jefe me pidió más cosas esta semana y no llegué a terminarlas ÚLTIMAMENTE estoy así 😔"
+).split()
+
+class RegexClassifier:
+    def __init__(self, keywords: dict):
+        """Una regex por categoría sobre el texto plegado con NFKD (inicio de palabra)."""
+        self.patterns = [
+            (category, re.compile(r"\b(?:" + "|".join(re.escape(fold(k)) for k in words) + ")"))
+            for category, words in keywords.items()
+        ]
+
+    def classify(self, text: str) -> frozenset[str]:
+        folded = fold(text)
+        return frozenset(category for category, pattern in self.patterns if pattern.search(folded))
+
+def corpus(n: int, keyword_rate: float, seed: int) -> list[str]:
+    """Mensajes de 3 a 60 palabras; `keyword_rate` de ellos con 1-3 palabras clave."""
+    rnd = random.Random(seed)
+    keywords = [word for words in KEYWORDS.values() for word in words]
+    messages = []
+    for _ in range(n):
+        words = [rnd.choice(FILLER) for _ in range(rnd.randint(3, 60))]
+        if rnd.random() < keyword_rate:
+            for _ in range(rnd.randint(1, 3)):
+                keyword = rnd.choice(keywords)
+                words.insert(rnd.randrange(len(words) + 1), keyword.upper() if rnd.random() < 0.2 else keyword)
+        messages.append(" ".join(words))
+    return messages
+
+def measure(name: str, classify, messages: list[str], nbytes: int) -> list:
+    t0 = time.perf_counter()
+    results = [classify(m) for m in messages]
+    elapsed = time.perf_counter() - t0
+    print(f"  {name:14s} {len(messages) / elapsed:10,.0f} msg/s  {elapsed / len(messages) * 1e6:6.2f} µs/msg  "
+          f"{nbytes / elapsed / 1e6:6.1f} MB/s")
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--keyword-rate", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    messages = corpus(args.messages, args.keyword_rate, args.seed)
+    nbytes = sum(len(m.encode("utf-8")) for m in messages)
+    print(f"{len(messages)} mensajes, {nbytes / 1e6:.1f} MB, {sum(len(w) for w in KEYWORDS.values())} palabras "
+          f"clave, autómata de {classifier.states} estados")
+    legacy = measure("regex", RegexClassifier(KEYWORDS).classify, messages, nbytes)
+    current = measure("aho-corasick", classifier.classify, messages, nbytes)
+    mismatches = sum(a != b for a, b in zip(legacy, current))
+    print(f"  coincidencias: {len(messages) - mismatches}/{len(messages)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Throughput de appends con historias persistentes (SQLite WAL + write-behind).
+
+- S sesiones concurrentes agregan M turnos cada una vía `append_user`/`append_assistant`.
+- Mide appends/seg en el camino del request (sólo encolar) y el tiempo hasta que
+  todo queda escrito en disco (`flush`), comparado con `HISTORY_BACKEND=memory`.
+
+Uso:
+    python -m bench.bench_conversation_store --sessions 1000 --turns 20
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Sesiones concurrentes
+import tempfile  # Base temporal
+import time  # Medición
+from pathlib import Path  # Ruta de la base
+
+from app.services import conversation_store, llm_client
+from app.services.conversation_store import SQLiteConversationStore
+from app.services.session_store import sessions
+
+async def _run(sessions_n: int, turns: int) -> float:
+    """Ejecuta la carga y devuelve los segundos en el camino del request."""
+    text = "Hoy me siento un poco mejor, aunque todavía me cuesta dormir."
+
+    async def one(i: int):
+        cid = f"bench-{i}"
+        for _ in range(turns):
+            await llm_client.append_user(cid, text)
+            await llm_client.append_assistant(cid, text)
+            await asyncio.sleep(0)  # Intercalar sesiones como en el servidor
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(sessions_n)))
+    return time.perf_counter() - t0
+
+async def main(sessions_n: int, turns: int, flush_ms: float) -> None:
+    total = sessions_n * turns * 2
+    sessions.max_sessions = sessions_n * 2
+
+    # Sólo memoria
+    dt = await _run(sessions_n, turns)
+    print(f"memory  {total / dt:10.0f} appends/s")
+
+    # SQLite con escritura diferida
+    for cid in list(sessions._sessions):
+        sessions.release(cid)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteConversationStore(str(Path(tmp) / "bench.db"), flush_interval=flush_ms / 1000)
+        conversation_store._store = store
+        dt = await _run(sessions_n, turns)
+        t0 = time.perf_counter()
+        await store.flush()
+        drain = time.perf_counter() - t0
+        print(
+            f"sqlite  {total / dt:10.0f} appends/s en el request  "
+            f"({total / (dt + drain):8.0f}/s hasta disco, {store.batches} lotes, "
+            f"{store.written / max(1, store.batches):.0f} msgs/lote)"
+        )
+        conversation_store._store = None
+        store.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--flush-ms", type=float, default=50.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.turns, args.flush_ms))
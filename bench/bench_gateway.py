@@ -0,0 +1,293 @@
+"""
+Gateway WebSocket ↔ TCP: compresión (CPU vs. bytes) y memoria con navegadores lentos.
+
+- Levanta una app TCP falsa en este proceso (saludo y una respuesta en streaming de
+  `--chunks` deltas por mensaje, escritos de una vez) y el gateway en un subproceso.
+- `stream`: `--clients` navegadores envían `--messages` mensajes cada uno y leen toda la
+  respuesta; por cada valor de `--compression` reporta CPU del gateway, bytes recibidos
+  por los navegadores (en el socket, comprimidos), frames recibidos y deltas por segundo.
+- `slow`: `--slow-clients` navegadores hacen el handshake (ofreciendo permessage-deflate,
+  como un navegador) y nunca leen, con un buffer de recepción de `--rcvbuf` bytes para que
+  el kernel no absorba demasiado; con todos conectados, la app intenta escribirles `--push-kb`
+  KB a cada uno tan rápido como lo permita `drain()`. Reporta el RSS del gateway cada segundo
+  durante `--duration` segundos, lo que la app logró escribir, cuántas conexiones quedaron
+  frenadas en `drain()` (contrapresión) y las métricas de la cola de envío del gateway.
+  - Como no leen, tampoco responden los pings: el keepalive del gateway (20 s + 20 s) los
+    cierra a partir de los ~40 s de conectados, por eso `--duration` es 30 por defecto.
+
+Uso:
+    python -m bench.bench_gateway stream --compression none deflate:1 deflate:6
+    python -m bench.bench_gateway slow --slow-clients 5000 --policy block drop close
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # App falsa, navegadores y subproceso
+import base64  # Clave del handshake WebSocket
+import os  # /proc y entorno del gateway
+import random  # Texto de las respuestas
+import resource  # Subir el límite de descriptores
+import socket  # Buffer de recepción chico en los navegadores lentos
+import sys  # Intérprete actual
+import time  # Medición
+
+import websockets
+from websockets.asyncio.client import ClientConnection
+
+from app.protocol import CONTROL, encode_chunk, encode_end
+from bench.report import ProcessMeter
+
+# Texto de las respuestas: cada delta son 1-3 palabras consecutivas desde un punto al azar
+TEXT = (
+    "Entiendo que estés pasando por un momento difícil y es muy valioso que puedas ponerlo en "
+    "palabras. A veces el cansancio, el trabajo y las preocupaciones se juntan y cuesta encontrar "
+    "un espacio para descansar de verdad. ¿Qué cosas te ayudaron en otras semanas parecidas? "
+    "Podemos pensar juntos pequeños pasos para hoy, como una caminata corta, escribir lo que te "
+    "preocupa antes de dormir o hablar con alguien de confianza sobre cómo te sentís."
+).split()
+
+class _CountingConnection(ClientConnection):
+    """Cliente WebSocket que cuenta los bytes recibidos del socket."""
+    received = 0
+
+    def data_received(self, data: bytes) -> None:
+        _CountingConnection.received += len(data)
+        super().data_received(data)
+
+def _rss_mb(pid: int) -> float:
+    """Memoria residente de `pid` en MB (Linux)."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+class FakeApp:
+    def __init__(self, chunks: int, push_kb: float = 0.0):
+        """
+        App TCP falsa: responde cada mensaje con `chunks` deltas o, con `push_kb`, escribe
+        respuestas hasta `push_kb` KB por conexión respetando `drain()`.
+        """
+        self.chunks = chunks
+        self.push_kb = push_kb
+        self.pushed = 0  # Bytes escritos hacia el gateway
+        self.stalled = 0  # Conexiones esperando en `drain()` ahora mismo
+        self.closed = 0  # Conexiones que el gateway cerró
+        self.running = True  # False: las conexiones que empujan terminan
+        self.go = asyncio.Event()  # Empezar a empujar (con todos los navegadores conectados)
+
+    @staticmethod
+    def _reply(chunks: int, rnd: random.Random) -> bytes:
+        i = rnd.randrange(len(TEXT))
+        deltas = []
+        for _ in range(chunks):
+            n = rnd.randint(1, 3)
+            deltas.append(encode_chunk("".join(" " + TEXT[(i + k) % len(TEXT)] for k in range(n))))
+            i += n
+        return b"".join(deltas) + encode_end()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        rnd = random.Random(id(writer))
+        reply = self._reply(self.chunks, rnd)
+        try:
+            writer.write("¡Hola! Contame cómo estás.\n".encode("utf-8"))
+            if self.push_kb:
+                await self.go.wait()
+                left = int(self.push_kb * 1024)
+                while left > 0 and self.running and not reader.at_eof():
+                    writer.write(reply)
+                    self.stalled += 1
+                    try:
+                        await writer.drain()
+                    finally:
+                        self.stalled -= 1
+                    self.pushed += len(reply)
+                    left -= len(reply)
+                await reader.read()  # Mantener la conexión hasta que el gateway la cierre
+            else:
+                while line := await reader.readline():
+                    if line.startswith(CONTROL.encode()):
+                        continue
+                    reply = self._reply(self.chunks, rnd)
+                    writer.write(reply)
+                    self.pushed += len(reply)
+                    await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.closed += 1
+            writer.close()
+
+async def _gateway(args, extra: dict) -> asyncio.subprocess.Process:
+    env = dict(
+        os.environ,
+        TCP_HOST="127.0.0.1", TCP_PORT=str(args.app_port),
+        WS_HOST="127.0.0.1", WS_PORT=str(args.ws_port),
+        METRICS_HOST="127.0.0.1", GATEWAY_METRICS_PORT=str(args.ws_port + 1),
+        **extra,
+    )
+    gateway = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "gateway.ws_gateway", env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    await asyncio.sleep(1.5)
+    return gateway
+
+async def _metrics(port: int) -> dict[str, float]:
+    """Métricas del gateway (sin etiquetas) por nombre."""
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.0\r\nHost: bench\r\n\r\n")
+        body = (await reader.read()).decode("utf-8", "replace")
+        writer.close()
+    except OSError:
+        return {}
+    values = {}
+    for line in body.splitlines():
+        if line.startswith("psicoia_gateway") and "{" not in line:
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+def _compression_env(spec: str) -> dict:
+    """`none` o `deflate:<nivel>` → variables del gateway."""
+    if spec == "none":
+        return {"GATEWAY_COMPRESSION": "none"}
+    level = spec.partition(":")[2] or "6"
+    return {"GATEWAY_COMPRESSION": "deflate", "GATEWAY_DEFLATE_LEVEL": level}
+
+async def run_stream(args) -> None:
+    app = FakeApp(args.chunks)
+    server = await asyncio.start_server(app.handle, "127.0.0.1", args.app_port)
+    try:
+        for spec in args.compression:
+            gateway = await _gateway(args, _compression_env(spec))
+            try:
+                frames = 0
+                sem = asyncio.Semaphore(200)  # No saturar el backlog de accept
+
+                async def browser():
+                    nonlocal frames
+                    async with sem:
+                        ws = await websockets.connect(f"ws://127.0.0.1:{args.ws_port}", max_size=None,
+                                                      create_connection=_CountingConnection)
+                    async with ws:
+                        await ws.recv()  # Saludo
+                        for _ in range(args.messages):
+                            await ws.send("hola, hoy estoy cansado")
+                            while True:
+                                frame = await ws.recv()
+                                frames += 1
+                                if frame.endswith("\x03"):
+                                    break
+
+                meter = ProcessMeter(gateway.pid).start()
+                _CountingConnection.received = 0
+                t0 = time.perf_counter()
+                await asyncio.gather(*(browser() for _ in range(args.clients)))
+                elapsed = time.perf_counter() - t0
+                usage = meter.stop()
+                deltas = args.clients * args.messages * args.chunks
+                print(
+                    f"{spec:10s} cpu={usage['cpu_s']:6.2f} s  recibido={_CountingConnection.received / 1e6:7.2f} MB  "
+                    f"frames={frames:7d} ({frames / (args.clients * args.messages):5.1f}/respuesta)  "
+                    f"{deltas / elapsed:9,.0f} deltas/s  rss={usage['rss_mb']:6.1f} MB"
+                )
+            finally:
+                gateway.terminate()
+                await gateway.wait()
+    finally:
+        server.close()
+
+async def _slow_browser(port: int, rcvbuf: int) -> asyncio.StreamWriter | None:
+    """Handshake WebSocket a mano; después no se lee nunca más."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)  # Antes de conectar: fija la ventana
+    sock.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write(
+            f"GET / HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n"
+            f"Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n\r\n".encode()
+        )
+        await reader.readuntil(b"\r\n\r\n")
+        return writer
+    except (ConnectionError, OSError, asyncio.IncompleteReadError):
+        sock.close()
+        return None
+
+async def run_slow(args) -> None:
+    app = FakeApp(args.chunks, push_kb=args.push_kb)
+    server = await asyncio.start_server(app.handle, "127.0.0.1", args.app_port, backlog=4096)
+    try:
+        for policy, spec in ((p, c) for p in args.policy for c in args.compression):
+            gateway = await _gateway(args, {"GATEWAY_SLOW_POLICY": policy, **_compression_env(spec)})
+            app.pushed = app.closed = 0
+            app.running = True
+            app.go.clear()
+            try:
+                base = _rss_mb(gateway.pid)
+                sem = asyncio.Semaphore(50)  # Menos que el backlog de accept del gateway (100)
+
+                async def connect():
+                    async with sem:
+                        return await _slow_browser(args.ws_port, args.rcvbuf)
+
+                t0 = time.perf_counter()
+                writers = [w for w in await asyncio.gather(*(connect() for _ in range(args.slow_clients))) if w]
+                print(f"[{policy}, {spec}] {len(writers)} navegadores lentos en {time.perf_counter() - t0:.1f} s, "
+                      f"RSS del gateway {base:.1f} → {_rss_mb(gateway.pid):.1f} MB")
+                app.go.set()
+                samples = []
+                for second in range(1, args.duration + 1):
+                    await asyncio.sleep(1)
+                    rss = _rss_mb(gateway.pid)
+                    samples.append(rss)
+                    if second % max(1, args.duration // 10) == 0:
+                        m = await _metrics(args.ws_port + 1)
+                        print(f"  t={second:3d} s  rss={rss:7.1f} MB  app escribió {app.pushed / 1e6:8.1f} MB  "
+                              f"app en drain={app.stalled:5d}  cerradas={app.closed:5d}  "
+                              f"cola={m.get('psicoia_gateway_send_queue_bytes', 0) / 1e6:6.1f} MB  "
+                              f"descartados={m.get('psicoia_gateway_frames_dropped_total', 0):,.0f}")
+                half = samples[len(samples) // 2:]
+                print(f"  RSS 2ª mitad: min={min(half):.1f} max={max(half):.1f} MB (pico {max(samples):.1f} MB)")
+                app.running = False
+                for writer in writers:
+                    writer.close()
+                await asyncio.sleep(1)  # Que terminen las conexiones de la app falsa
+            finally:
+                gateway.terminate()
+                await gateway.wait()
+    finally:
+        server.close()
+
+async def main(args) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))  # Lo hereda el gateway
+    if args.scenario == "stream":
+        args.compression = args.compression or ["none", "deflate:1", "deflate:6"]
+        await run_stream(args)
+    else:
+        args.compression = args.compression or ["deflate:6"]
+        await run_slow(args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("scenario", choices=("stream", "slow"))
+    parser.add_argument("--compression", nargs="+",
+                        help="none o deflate:<nivel> (stream: none deflate:1 deflate:6; slow: deflate:6)")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=40, help="deltas por respuesta")
+    parser.add_argument("--slow-clients", type=int, default=5000)
+    parser.add_argument("--policy", nargs="+", default=["block"], help="GATEWAY_SLOW_POLICY a probar")
+    parser.add_argument("--push-kb", type=float, default=32.0,
+                        help="KB por navegador lento (la app real tiene a lo sumo 2 × PIPELINE_MAX_PENDING respuestas)")
+    parser.add_argument("--rcvbuf", type=int, default=4096, help="SO_RCVBUF de los navegadores lentos")
+    parser.add_argument("--duration", type=int, default=30, help="segundos de medición en slow")
+    parser.add_argument("--app-port", type=int, default=5097)
+    parser.add_argument("--ws-port", type=int, default=8797, help="el siguiente es /metrics del gateway")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,180 @@
+"""
+Memoria y costo por turno de la historia: lista de dicts vs. anillo de registros compactos.
+
+- Anterior: `ConversationHistory` con un dict `{"role", "content"}` por mensaje, el texto
+  como `str` más su JSON, una suma acumulada de `int` y recorte con `del lista[:n]`.
+- Actual: `app.services.history` (registros `Message` con `__slots__`, roles internados,
+  sólo el JSON, suma acumulada en `array` y anillo con recorte O(1)).
+- Memoria: `--sessions` historias de `--messages` mensajes, cada variante en un proceso
+  nuevo; reporta bytes vivos (`tracemalloc`) por mensaje y por sesión, y el RSS agregado.
+  Con `--roles store` los roles son strings nuevos por mensaje, como los devuelve SQLite
+  al cargar una sesión; con `literal` son las constantes del código.
+- CPU: `append` con la historia llena (incluye el recorte) y la ventana de un request como
+  `_build_request` (`window_start` + los bytes de cada mensaje elegido).
+- Antes de medir verifica que ambas variantes elijan la misma ventana.
+
+Uso:
+    python -m bench.bench_history --sessions 1000 --messages 200
+    python -m bench.bench_history --messages 2000 --roles literal
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import gc  # Memoria estable antes de medir
+import multiprocessing  # Un proceso por medición de memoria
+import sys  # Tamaño en memoria de los textos
+import timeit  # CPU por operación
+import tracemalloc  # Bytes vivos
+from bisect import bisect_left  # Ventana de la versión anterior
+
+from app.services.history import ConversationHistory
+from app.services.payload import encode
+
+USER_TEXTS = (
+    "Hoy me siento un poco mejor, aunque me cuesta dormir y pienso mucho en el trabajo.",
+    "Discutí otra vez con mi hermana y me quedé con mucha bronca, no sé cómo manejarlo.",
+    "No tengo ganas de salir, todo me cansa y siento que no avanzo con nada.",
+)
+REPLY = ("Gracias por contarlo. Lo que describís suena agotador; probemos ver qué pasó justo antes "
+         "de que aparezca esa sensación y qué te ayudó otras veces a bajar un cambio. ")
+
+class LegacyHistory:
+    """Copia de la `ConversationHistory` anterior (dict + texto + JSON por mensaje)."""
+
+    def __init__(self, max_messages: int):
+        self.max_messages = max(1, max_messages)
+        self.messages: list[dict] = []
+        self.encoded: list[bytes] = []
+        self._cum: list[int] = [0]
+        self.nbytes = 0
+        self.offset = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def append(self, role: str, content: str, tokens: int) -> None:
+        msg = {"role": role, "content": content}
+        encoded = encode(msg)
+        self.messages.append(msg)
+        self.encoded.append(encoded)
+        self._cum.append(self._cum[-1] + tokens)
+        self.nbytes += sys.getsizeof(msg["content"]) + sys.getsizeof(encoded)
+        excess = len(self.messages) - self.max_messages
+        if excess > 0:
+            for old, old_encoded in zip(self.messages[:excess], self.encoded[:excess]):
+                self.nbytes -= sys.getsizeof(old["content"]) + sys.getsizeof(old_encoded)
+            del self.messages[:excess]
+            del self.encoded[:excess]
+            del self._cum[:excess]
+            self.offset += excess
+
+    def tokens_from(self, start: int) -> int:
+        return self._cum[-1] - self._cum[start]
+
+    def window_start(self, budget: int) -> int:
+        if budget <= 0 or not self.messages:
+            return len(self.messages)
+        return bisect_left(self._cum, self._cum[-1] - budget, 0, len(self.messages))
+
+VARIANTS = {"anterior": LegacyHistory, "actual": ConversationHistory}
+
+def _role(i: int, roles: str) -> str:
+    """Rol del mensaje `i`: constante del código o string nuevo (como una fila de SQLite)."""
+    role = "user" if i % 2 == 0 else "assistant"
+    return "".join(list(role)) if roles == "store" else role
+
+def _content(session: int, i: int) -> str:
+    """Texto único por mensaje (no se comparten objetos entre mensajes)."""
+    if i % 2 == 0:
+        return f"{USER_TEXTS[i // 2 % len(USER_TEXTS)]} ({session}.{i})"
+    return f"{REPLY * 2}({session}.{i})"
+
+def _fill(history, session: int, messages: int, roles: str) -> None:
+    for i in range(messages):
+        content = _content(session, i)
+        history.append(_role(i, roles), content, len(content) // 4 + 1)
+
+def _rss_kib() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4
+
+def _memory_child(variant: str, args, out) -> None:
+    """Arma `args.sessions` historias y manda (bytes vivos, KiB de RSS agregados)."""
+    cls = VARIANTS[variant]
+    gc.collect()
+    rss0 = _rss_kib()
+    tracemalloc.start()
+    histories = []
+    for s in range(args.sessions):
+        history = cls(args.messages)
+        _fill(history, s, args.messages, args.roles)
+        histories.append(history)
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    out.send((traced, _rss_kib() - rss0))
+
+def memory(variant: str, args) -> tuple[int, int]:
+    ctx = multiprocessing.get_context("fork")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_memory_child, args=(variant, args, child))
+    proc.start()
+    result = parent.recv()
+    proc.join()
+    return result
+
+def cpu(variant: str, args) -> tuple[float, float]:
+    """µs por `append` con la historia llena y por ventana de request (presupuesto `--budget`)."""
+    cls = VARIANTS[variant]
+    history = cls(args.messages)
+    _fill(history, 0, args.messages, args.roles)
+    content = _content(1, 1)
+    reps = 20000
+    append = timeit.timeit(lambda: history.append("assistant", content, 60), number=reps) / reps
+
+    if variant == "anterior":
+        def window():
+            start = history.window_start(args.budget)
+            return history.messages[start:], history.encoded[start:], history.tokens_from(start)
+    else:
+        def window():
+            start = history.window_start(args.budget)
+            picked = history.messages[start:].records()
+            return picked, [msg.json for msg in picked], history.tokens_from(start)
+    window_us = timeit.timeit(window, number=reps) / reps
+    return append * 1e6, window_us * 1e6
+
+def check(args) -> None:
+    """Ambas variantes eligen la misma ventana, con el anillo ya dado vuelta."""
+    old, new = LegacyHistory(args.messages), ConversationHistory(args.messages)
+    for history in (old, new):
+        _fill(history, 0, args.messages + args.messages // 3, args.roles)
+    assert old.offset == new.offset and len(old) == len(new)
+    for budget in range(0, args.budget * 2, 97):
+        start = old.window_start(budget)
+        assert start == new.window_start(budget), budget
+        assert old.tokens_from(start) == new.tokens_from(start)
+        assert old.encoded[start:] == [msg.json for msg in new.messages[start:]]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200, help="mensajes por sesión (= LLM_HISTORY_MAX_MESSAGES)")
+    parser.add_argument("--roles", choices=("store", "literal"), default="store")
+    parser.add_argument("--budget", type=int, default=6000, help="presupuesto de tokens de la ventana")
+    args = parser.parse_args()
+
+    check(args)
+    total = args.sessions * args.messages
+    print(f"{args.sessions} sesiones × {args.messages} mensajes, roles={args.roles}")
+    results = {}
+    for variant in VARIANTS:
+        traced, rss = memory(variant, args)
+        append_us, window_us = cpu(variant, args)
+        results[variant] = traced
+        print(f"{variant:9s} {traced / total:6.0f} B/mensaje  {traced / args.sessions / 1024:7.1f} KiB/sesión  "
+              f"RSS +{rss / 1024:6.1f} MiB  append {append_us:5.2f} µs  ventana {window_us:6.2f} µs")
+    print(f"memoria: x{results['anterior'] / results['actual']:.2f} menos")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark: cliente HTTP por request vs. pool compartido (`app.services.http_pool`).
+
+- Levanta `StubLLM` local y dispara N requests con C en paralelo.
+- Reporta p50/p99 de latencia y conexiones abiertas en el stub por modo.
+
+Uso:
+    python -m bench.bench_http_pool --requests 2000 --concurrency 20
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Concurrencia asíncrona
+import logging  # Silenciar logs por request de httpx
+import statistics  # Percentiles
+import time  # Medir latencia
+
+import httpx  # Cliente HTTP asíncrono
+
+from app.services.http_pool import close_http_client, start_http_client, trace_extensions
+from bench.stub_llm import StubLLM
+
+PAYLOAD = {"model": "stub", "messages": [{"role": "user", "content": "hola"}], "stream": False}
+
+def _percentile(samples: list[float], p: float) -> float:
+    """Percentil `p` (0-100) de `samples` en milisegundos."""
+    return statistics.quantiles(samples, n=100, method="inclusive")[int(p) - 1] * 1000
+
+async def _run(mode: str, url: str, total: int, concurrency: int) -> list[float]:
+    """
+    Ejecuta `total` requests en el modo indicado y devuelve latencias (s).
+
+    - `per-request`: abre y cierra un `httpx.AsyncClient` por llamada (comportamiento anterior).
+    - `pooled`: usa el cliente compartido del proceso.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    client = await start_http_client() if mode == "pooled" else None
+
+    async def one():
+        async with sem:
+            t0 = time.perf_counter()
+            if client is None:
+                async with httpx.AsyncClient(timeout=30.0) as c:
+                    resp = await c.post(url, json=PAYLOAD)
+            else:
+                resp = await client.post(url, json=PAYLOAD, extensions=trace_extensions())
+            resp.json()
+            latencies.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(one() for _ in range(total)))
+    if client is not None:
+        await close_http_client()
+    return latencies
+
+async def main(total: int, concurrency: int, latency_ms: float) -> None:
+    for mode in ("per-request", "pooled"):
+        async with StubLLM(latency_s=latency_ms / 1000) as stub:
+            t0 = time.perf_counter()
+            lat = await _run(mode, stub.url, total, concurrency)
+            wall = time.perf_counter() - t0
+            print(
+                f"{mode:12s} p50={_percentile(lat, 50):7.2f} ms  p99={_percentile(lat, 99):7.2f} ms  "
+                f"req/s={total / wall:8.0f}  conexiones={stub.connections}"
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latencia simulada del stub")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(main(args.requests, args.concurrency, args.latency_ms))
@@ -0,0 +1,113 @@
+"""
+Benchmark: lag del event loop logueando contra un stderr lento (`app.utils.logger`).
+
+- El destino de los logs es un pipe que otro hilo vacía a `--drain-kbps` (como un driver
+  de logs de Docker bajo presión): cuando el buffer del pipe se llena, escribir bloquea.
+- Una tarea emite las líneas por mensaje de `handle_client` a `--lines-per-s`, mientras
+  otra mide el lag del loop (cuánto tarda en volver un `sleep` de 1 ms).
+- Compara: escritura sincrónica (como antes), cola + hilo escritor, y cola + muestreo.
+- Reporta p50/p99/max del lag, líneas escritas, descartadas y omitidas por muestreo.
+
+Uso:
+    python -m bench.bench_logging --lines-per-s 5000 --drain-kbps 100 --duration-s 3
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Event loop bajo prueba
+import os  # Pipe como stderr lento
+import threading  # Hilo que vacía el pipe
+import time  # Medición
+
+from bench.bench_resilience import _pct  # Percentiles (configura Settings mínimos)
+from app.utils import logger as logging_setup
+from app.utils.logger import get_logger, trace_fields
+
+log = get_logger("client")
+
+class _SlowDrain:
+    def __init__(self, read_fd: int, kbps: float):
+        """Vacía `read_fd` a `kbps` KB/s en un hilo (`kbps=0`: sin límite)."""
+        self.read_fd = read_fd
+        self.kbps = kbps
+        self.bytes = 0
+        self.lines = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            data = os.read(self.read_fd, 4096)
+            if not data:
+                return
+            self.bytes += len(data)
+            self.lines += data.count(b"\n")
+            if self.kbps:
+                time.sleep(len(data) / (self.kbps * 1024))
+
+    def join(self) -> None:
+        self._thread.join()
+
+async def _produce(lines_per_s: float, duration: float) -> None:
+    """Líneas por mensaje como las de `handle_client`, en ráfagas cada 1 ms."""
+    per_tick = max(1, round(lines_per_s / 1000))
+    deadline = time.monotonic() + duration
+    n = 0
+    while time.monotonic() < deadline:
+        for _ in range(per_tick):
+            n += 1
+            trace_id = f"Usuario-{n % 500}:m{n}"
+            log.info("[%s] → LLM start (len=%d) cola=%.0f ms%s", trace_id, 42, 0.0, "",
+                     extra=trace_fields(trace_id))
+        await asyncio.sleep(0.001)
+
+async def _lag(duration: float) -> list[float]:
+    """Retraso de cada `sleep(1 ms)` respecto de lo pedido."""
+    samples = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.001)
+        samples.append(time.perf_counter() - t0 - 0.001)
+    return samples
+
+async def _measure(args) -> list[float]:
+    lag, _ = await asyncio.gather(_lag(args.duration_s), _produce(args.lines_per_s, args.duration_s))
+    return lag
+
+def run(mode: str, args) -> None:
+    read_fd, write_fd = os.pipe()
+    stream = os.fdopen(write_fd, "w", encoding="utf-8")
+    drain = _SlowDrain(read_fd, args.drain_kbps)
+    logging_setup.setup_logging(
+        stream=stream, use_queue=mode != "sincrónico", drop_policy="drop_new",
+        rate_per_key=args.rate_per_key if mode == "cola+muestreo" else 0, queue_size=args.queue_size,
+    )
+    lag = asyncio.run(_measure(args))
+    handler, sampler = logging_setup._queue_handler, logging_setup._sampler
+    dropped = handler.dropped if handler is not None else 0
+    sampled = sampler.sampled
+    drain.kbps = 0  # Vaciar lo pendiente rápido antes de apagar
+    logging_setup.shutdown_logging()
+    stream.close()
+    drain.join()
+    os.close(read_fd)
+    lag_ms = [x * 1000 for x in lag]
+    print(f"  {mode:14s} lag p50={_pct(lag, 50):7.2f} ms  p99={_pct(lag, 99):7.2f} ms  "
+          f"max={max(lag_ms):7.1f} ms  escritas={drain.lines:6d}  descartadas={dropped:6d}  muestreadas={sampled:6d}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lines-per-s", type=float, default=5000.0)
+    parser.add_argument("--drain-kbps", type=float, default=100.0, help="velocidad del stderr lento (0 = sin límite)")
+    parser.add_argument("--duration-s", type=float, default=3.0)
+    parser.add_argument("--queue-size", type=int, default=2000)
+    parser.add_argument("--rate-per-key", type=int, default=50, help="LOG_RATE_PER_KEY del modo con muestreo")
+    args = parser.parse_args()
+    print(f"{args.lines_per_s:g} líneas/s contra un stderr de {args.drain_kbps:g} KB/s")
+    for mode in ("sincrónico", "cola", "cola+muestreo"):
+        run(mode, args)
+    logging_setup.setup_logging()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Gateway → app: una conexión TCP por sesión vs. sesiones multiplexadas (`app.mux`).
+
+- Levanta `StubLLM` y el servidor TCP (con `APP_MUX_PORT`) en un subproceso.
+- Abre S sesiones como lo haría el gateway: S sockets (legacy) o S sesiones sobre
+  L links (mux), y espera el saludo de cada una.
+- Reporta fds y RSS del proceso app y del lado gateway (este proceso), y la latencia
+  p50/p99 de un mensaje en una muestra de sesiones con todas abiertas.
+
+Uso:
+    python -m bench.bench_mux --sessions 1000 10000 --links 4
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Sesiones concurrentes
+import os  # /proc y entorno del servidor
+import resource  # Subir el límite de descriptores
+import statistics  # Percentiles
+import sys  # Intérprete actual
+import time  # Medición
+
+from app.mux import MuxPool
+from bench.stub_llm import StubLLM
+
+GREETING_LINES = 3  # Líneas de bienvenida de `handle_client`
+
+def _fds(pid: int) -> int:
+    """Descriptores abiertos por `pid` (Linux)."""
+    return len(os.listdir(f"/proc/{pid}/fd"))
+
+def _rss_mb(pid: int) -> float:
+    """Memoria residente de `pid` en MB (Linux)."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+async def _open_sessions(mode: str, n: int, port: int, mux_port: int, links: int):
+    """Abre `n` sesiones y devuelve `(pares reader/writer, pool)`."""
+    pool = MuxPool("127.0.0.1", mux_port, links) if mode == "mux" else None
+    sem = asyncio.Semaphore(200)  # No saturar el backlog de accept
+
+    async def one():
+        async with sem:
+            if pool is not None:
+                reader, writer = await pool.open_stream()
+            else:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            for _ in range(GREETING_LINES):
+                await reader.readline()
+            return reader, writer
+
+    return await asyncio.gather(*(one() for _ in range(n))), pool
+
+async def _latencies(pairs, sample: int) -> list[float]:
+    """Envía un mensaje por sesión en `sample` sesiones y mide la respuesta."""
+    async def one(reader, writer):
+        t0 = time.perf_counter()
+        writer.write(b"hola, hoy estoy cansado\n")
+        await writer.drain()
+        await reader.readline()
+        return time.perf_counter() - t0
+
+    step = max(1, len(pairs) // sample)
+    return await asyncio.gather(*(one(r, w) for r, w in pairs[::step][:sample]))
+
+async def run(mode: str, n: int, args, stub: StubLLM) -> None:
+    env = dict(
+        os.environ,
+        APP_HOST="127.0.0.1", APP_PORT=str(args.port), APP_MUX_PORT=str(args.port + 1),
+        LLM_URL=stub.url, GROQ_API_KEY="bench", MODEL_NAME="stub",
+        MAX_IN_FLIGHT=str(args.sample), PER_USER_MAX="1",
+        RATE_WINDOW_SECONDS="1", RATE_MAX_MESSAGES="1000",
+        SESSION_MAX=str(n * 2), LLM_STREAM="false", HISTORY_BACKEND="memory",
+    )
+    app = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "app.server", env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        await asyncio.sleep(1.5)
+        base_fds, base_rss = _fds(app.pid), _rss_mb(app.pid)
+        gw_fds, gw_rss = _fds(os.getpid()), _rss_mb(os.getpid())
+        t0 = time.perf_counter()
+        pairs, pool = await _open_sessions(mode, n, args.port, args.port + 1, args.links)
+        opened = time.perf_counter() - t0
+        lat = sorted(await _latencies(pairs, args.sample))
+        print(
+            f"{mode:6s} sesiones={n:6d}  app: +{_fds(app.pid) - base_fds:6d} fds "
+            f"+{_rss_mb(app.pid) - base_rss:7.1f} MB  gateway: +{_fds(os.getpid()) - gw_fds:6d} fds "
+            f"+{_rss_mb(os.getpid()) - gw_rss:7.1f} MB  apertura={opened:5.2f} s  "
+            f"p50={statistics.median(lat) * 1000:6.1f} ms  p99={lat[int(len(lat) * 0.99) - 1] * 1000:6.1f} ms"
+        )
+        for _, writer in pairs:
+            writer.close()
+        if pool is not None:
+            await pool.close()
+    finally:
+        app.terminate()
+        await app.wait()
+
+async def main(args) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))  # Lo heredan los subprocesos
+    async with StubLLM(latency_s=args.latency_ms / 1000) as stub:
+        for n in args.sessions:
+            for mode in ("legacy", "mux"):
+                await run(mode, n, args, stub)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--links", type=int, default=4, help="links TCP en modo mux")
+    parser.add_argument("--sample", type=int, default=200, help="sesiones que envían un mensaje")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latencia simulada del stub")
+    parser.add_argument("--port", type=int, default=5095, help="puerto legacy (mux usa el siguiente)")
+    asyncio.run(main(parser.parse_args()))
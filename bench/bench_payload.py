@@ -0,0 +1,103 @@
+"""
+Micro-benchmark del cuerpo del request al LLM: dict + `json=` vs. bytes ya codificados.
+
+- Anterior: arma el dict del payload (mensajes nuevos de system + ventana + user) y
+  httpx lo serializa con `json=` en cada request (el system prompt incluido).
+- Actual: `LLMRequest` une los bytes ya codificados del system (registro de prompts) y de
+  la historia (`Message.json` de cada registro) y se envía con `content=`.
+- Ambos arman el `httpx.Request` (la serialización de httpx entra en la medición) y
+  decodifican una respuesta de chat completions (`json.loads` vs. `payload.loads`).
+- Reporta CPU por request (µs) y bytes asignados por request (pico de `tracemalloc`).
+
+Uso:
+    python -m bench.bench_payload --history 20 --reps 2000
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import json  # Camino anterior
+import time  # CPU por request
+import tracemalloc  # Bytes asignados por request
+
+import httpx
+
+from app.config import settings
+from app.services import llm_client
+from app.services.history import ConversationHistory
+from app.services.payload import JSON_BACKEND, LLMRequest, encode, loads
+from app.services.prompts import prompts
+
+URL = "http://127.0.0.1:9/v1/chat/completions"
+USER_TEXT = "Hoy me siento un poco mejor, aunque me cuesta dormir."
+
+def legacy_request(history: ConversationHistory, response: bytes) -> str:
+    """Camino anterior: dict nuevo por request, `json=` y `resp.json()` con el json estándar."""
+    system_prompt = prompts.get()
+    messages = llm_client.build_messages(system_prompt.text, history, USER_TEXT)
+    payload = {
+        "model": settings.MODEL_NAME, "messages": messages, "temperature": settings.LLM_TEMPERATURE,
+        "max_tokens": settings.LLM_MAX_TOKENS, "stream": False,
+    }
+    httpx.Request("POST", URL, json=payload)
+    return json.loads(response)["choices"][0]["message"]["content"]
+
+def current_request(history: ConversationHistory, response: bytes) -> str:
+    """Camino actual: como `_build_request` + `_send` + decodificación de `llm_generate`."""
+    system_prompt = prompts.get()
+    user_msg = {"role": "user", "content": USER_TEXT}
+    remaining = max(0, llm_client._INPUT_BUDGET - system_prompt.tokens
+                    - llm_client._est_tokens_text(USER_TEXT) - llm_client._BUDGET_MARGIN)
+    start = history.window_start(remaining)
+    picked = history.messages[start:].records()
+    request = LLMRequest(
+        model=settings.MODEL_NAME,
+        messages=[system_prompt.message, *picked, user_msg],
+        encoded=[system_prompt.json, *(msg.json for msg in picked), encode(user_msg)],
+        temperature=settings.LLM_TEMPERATURE, max_tokens=settings.LLM_MAX_TOKENS, stream=False,
+    )
+    httpx.Request("POST", URL, content=request.body())
+    return loads(response)["choices"][0]["message"]["content"]
+
+def _measure(fn, history: ConversationHistory, response: bytes, reps: int) -> tuple[float, float]:
+    """(µs de CPU por request, bytes asignados por request)."""
+    fn(history, response)  # Calentar cachés (tokens del system, encabezados)
+    t0 = time.process_time()
+    for _ in range(reps):
+        fn(history, response)
+    cpu_us = (time.process_time() - t0) / reps * 1e6
+
+    samples = []
+    tracemalloc.start()
+    for _ in range(min(reps, 200)):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(history, response)
+        samples.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return cpu_us, sum(samples) / len(samples)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 20, 100], help="mensajes en la historia")
+    parser.add_argument("--reps", type=int, default=2000)
+    parser.add_argument("--budget", type=int, default=8000, help="LLM_INPUT_TOKEN_BUDGET")
+    args = parser.parse_args()
+    llm_client._INPUT_BUDGET = args.budget
+
+    text = "Hoy me siento un poco mejor, aunque me cuesta dormir y pienso mucho. " * 2
+    reply = "Gracias por contarlo. Dormir mal pesa mucho; probemos una rutina suave antes de acostarte. " * 3
+    response = encode({"choices": [{"message": {"role": "assistant", "content": reply}}]})
+    print(f"system={len(prompts.get().json)} bytes, decodificación con {JSON_BACKEND}")
+    for n in args.history:
+        history = ConversationHistory(max(1, n))
+        for i in range(n):
+            content = text if i % 2 == 0 else reply
+            history.append("user" if i % 2 == 0 else "assistant", content, llm_client._est_tokens_text(content))
+        assert legacy_request(history, response) == current_request(history, response)
+        old_cpu, old_bytes = _measure(legacy_request, history, response, args.reps)
+        new_cpu, new_bytes = _measure(current_request, history, response, args.reps)
+        print(f"historia={n:4d}  anterior={old_cpu:7.1f} µs {old_bytes / 1024:7.1f} KiB  "
+              f"actual={new_cpu:7.1f} µs {new_bytes / 1024:7.1f} KiB  x{old_cpu / new_cpu:5.1f} CPU")
+
+if __name__ == "__main__":
+    main()
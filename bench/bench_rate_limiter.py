@@ -0,0 +1,86 @@
+"""
+Micro-benchmark: costo de `allow()` y memoria, deque por conexión vs. GCRA por clave.
+
+- `deque`: un `SlidingWindowLimiter` por clave (una marca de tiempo por evento).
+- `gcra-mem`: `RateLimiterRegistry` con `MemoryRateBackend` (un float por clave).
+- `gcra-shm`: `RateLimiterRegistry` con `SharedMemoryRateBackend` (tabla fija + flock).
+- Tasa alta: cada clave recibe muchos eventos dentro de la ventana.
+
+Uso:
+    python -m bench.bench_rate_limiter --keys 1000 --events 200000 --max-events 1000
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import os  # Archivo temporal del backend compartido
+import tempfile  # Directorio temporal
+import time  # Medición
+import tracemalloc  # Memoria asignada
+
+from app.utils.rate_limiter import (
+    MemoryRateBackend, RateLimiterRegistry, SharedMemoryRateBackend, SlidingWindowLimiter,
+)
+
+def _drive(allow, keys: list[str], events: int) -> int:
+    """Llama `events` veces a `allow` repartiendo entre las claves."""
+    allowed = 0
+    n = len(keys)
+    for i in range(events):
+        allowed += allow(keys[i % n])
+    return allowed
+
+def _run(name: str, make, keys: list[str], events: int, fixed_bytes: int = 0) -> None:
+    """
+    Mide ns por `allow()` y memoria retenida tras `events` llamadas.
+
+    - El tiempo se mide sin `tracemalloc` (que agrega costo por asignación).
+    - `fixed_bytes`: memoria fuera del heap de Python (el mapeo compartido).
+    """
+    allow = make()
+    t0 = time.perf_counter()
+    allowed = _drive(allow, keys, events)
+    dt = time.perf_counter() - t0
+
+    tracemalloc.start()
+    allow = make()  # Mantener la referencia: medir lo que queda retenido
+    _drive(allow, keys, events)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:9s} {dt / events * 1e9:8.0f} ns/allow  memoria={(current + fixed_bytes) / 1024:9.1f} KiB  "
+        f"permitidos={allowed}"
+    )
+
+def main(args) -> None:
+    keys = [f"session:{i:08d}" for i in range(args.keys)]
+
+    def deque_limiter():
+        limiters: dict[str, SlidingWindowLimiter] = {}
+
+        def allow(key: str) -> bool:
+            limiter = limiters.get(key)
+            if limiter is None:
+                limiter = limiters[key] = SlidingWindowLimiter(args.max_events, args.window)
+            return limiter.allow()
+        return allow
+
+    def gcra_mem():
+        return RateLimiterRegistry(args.max_events, args.window, MemoryRateBackend()).allow
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def gcra_shm():
+            backend = SharedMemoryRateBackend(os.path.join(tmp, "rate"), slots=args.slots)
+            return RateLimiterRegistry(args.max_events, args.window, backend).allow
+
+        _run("deque", deque_limiter, keys, args.events)
+        _run("gcra-mem", gcra_mem, keys, args.events)
+        _run("gcra-shm", gcra_shm, keys, args.events, fixed_bytes=args.slots * 16)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--max-events", type=int, default=1000, help="eventos permitidos por ventana")
+    parser.add_argument("--window", type=float, default=60.0)
+    parser.add_argument("--slots", type=int, default=65536, help="slots de la tabla compartida")
+    main(parser.parse_args())
@@ -0,0 +1,143 @@
+"""
+Benchmark: reintentos sin control vs. presupuesto de reintentos + circuit breaker,
+y latencia de cola con/sin hedging (`app.services.resilience`).
+
+- Caída parcial: `StubLLM` sano → `--fail-rate` de errores 503 → sano, con llegadas a
+  tasa fija (`--rps`). Se compara la amplificación de carga hacia el proveedor
+  (requests al stub / requests originales), las respuestas OK y la latencia.
+- Hedging: el stub principal tiene una fracción `--slow-rate` de respuestas lentas;
+  se compara p50/p99 sin hedge y con `LLM_HEDGE_URL` apuntando a un segundo stub.
+
+Uso:
+    python -m bench.bench_resilience --rps 100 --phase-s 3 --fail-rate 0.9
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Carga concurrente
+import logging  # Silenciar logs por request
+import os  # Configuración mínima antes de importar la app
+import statistics  # Percentiles
+import time  # Medición
+
+# Settings se leen al importar la app: valores mínimos para hablar con el stub
+for _key, _value in {
+    "GROQ_API_KEY": "bench", "MODEL_NAME": "stub", "LLM_TEMPERATURE": "0.5", "LLM_MAX_TOKENS": "50",
+    "LLM_TIMEOUT_SECONDS": "10", "LLM_MAX_RETRIES": "4", "LLM_BACKOFF_INITIAL": "0.1",
+    "LLM_BACKOFF_MAX": "1", "LLM_HISTORY_MAX_MESSAGES": "10", "LLM_INPUT_TOKEN_BUDGET": "1000",
+    "LLM_CHARS_PER_TOKEN": "3",
+}.items():
+    os.environ.setdefault(_key, _value)
+
+from app.services import llm_client
+from app.services.http_pool import close_http_client, start_http_client
+from app.services.llm_router import Endpoint, Router
+from app.services.resilience import CircuitBreaker, LatencyTracker, RetryBudget
+from bench.stub_llm import StubLLM
+
+def _pct(samples: list[float], p: float) -> float:
+    """Percentil `p` (0-100) en milisegundos."""
+    if len(samples) < 2:
+        return (samples[0] if samples else 0.0) * 1000
+    return statistics.quantiles(samples, n=100, method="inclusive")[int(p) - 1] * 1000
+
+def _configure(mode: str, url: str, hedge_url: str | None = None) -> None:
+    """
+    Instala presupuesto, endpoint (con su breaker) y hedge nuevos en `llm_client` según el modo.
+
+    - `sin-control`: presupuesto ilimitado y breaker que nunca se abre (reintentos
+      hasta `LLM_MAX_RETRIES` como antes).
+    - `resiliente`: los valores por defecto de `resilience`.
+    """
+    if mode == "sin-control":
+        llm_client.retry_budget = RetryBudget(ratio=1e9, min_per_second=1e9, max_tokens=1e9)
+        breaker = CircuitBreaker(failure_rate=2.0)
+    else:
+        llm_client.retry_budget = RetryBudget()
+        breaker = CircuitBreaker(open_seconds=1.0)
+    llm_client.router = Router([Endpoint("stub", url, "bench", "stub", breaker=breaker)])
+    llm_client.latencies = LatencyTracker()
+    llm_client.hedge_endpoint = Endpoint("hedge", hedge_url, "bench", "stub") if hedge_url else None
+
+async def _load(rps: float, duration: float, on_tick=None) -> list[tuple[float, bool]]:
+    """
+    Dispara `llm_generate` a tasa fija durante `duration` segundos (lazo abierto).
+
+    - Devuelve `(latencia, ok)` por request; `on_tick(t)` permite cambiar el stub en caliente.
+    """
+    results: list[tuple[float, bool]] = []
+    fallbacks = {llm_client.BUSY_REPLY, "Ocurrió un error al consultar el modelo. Intentá de nuevo."}
+
+    async def one(i: int):
+        t0 = time.perf_counter()
+        reply = await llm_client.llm_generate(f"mensaje {i}", trace_id=f"b{i}")
+        results.append((time.perf_counter() - t0, reply not in fallbacks))
+
+    tasks = []
+    start = time.perf_counter()
+    i = 0
+    while (elapsed := time.perf_counter() - start) < duration:
+        if on_tick is not None:
+            on_tick(elapsed)
+        tasks.append(asyncio.create_task(one(i)))
+        i += 1
+        await asyncio.sleep(max(0.0, start + i / rps - time.perf_counter()))
+    await asyncio.gather(*tasks)
+    return results
+
+async def brownout(args) -> None:
+    print(f"caída parcial: {args.phase_s:g}s sano → {args.phase_s:g}s con {args.fail_rate:.0%} de 503 → "
+          f"{args.phase_s:g}s sano, {args.rps:g} req/s")
+    for mode in ("sin-control", "resiliente"):
+        async with StubLLM(latency_s=args.latency_ms / 1000, fail_status=503, seed=1) as stub:
+            _configure(mode, stub.url)
+            await start_http_client()
+
+            def tick(t: float):
+                phase = int(t // args.phase_s)
+                stub.fail_rate = args.fail_rate if phase == 1 else 0.0
+
+            results = await _load(args.rps, 3 * args.phase_s, tick)
+            await close_http_client()
+        lat = [dt for dt, _ in results]
+        ok = sum(1 for _, good in results if good)
+        print(
+            f"  {mode:11s} originales={len(results):5d}  al_proveedor={stub.requests:5d} "
+            f"(x{stub.requests / len(results):.2f})  503={stub.failures:5d}  ok={ok:5d}  "
+            f"p50={_pct(lat, 50):6.0f} ms  p99={_pct(lat, 99):6.0f} ms  "
+            f"sin_presupuesto={llm_client.retry_budget.denied}  cortadas_breaker={llm_client.router.unavailable}"
+        )
+
+async def hedging(args) -> None:
+    print(f"hedging: {args.slow_rate:.0%} de respuestas a {args.slow_ms:g} ms, {args.rps:g} req/s")
+    for mode in ("sin hedge", "con hedge"):
+        async with StubLLM(latency_s=args.latency_ms / 1000, slow_rate=args.slow_rate,
+                           slow_latency_s=args.slow_ms / 1000, seed=2) as primary, \
+                   StubLLM(latency_s=args.latency_ms / 1000) as secondary:
+            _configure("resiliente", primary.url, secondary.url if mode == "con hedge" else None)
+            await start_http_client()
+            results = await _load(args.rps, 3 * args.phase_s)
+            await close_http_client()
+            # Dejar terminar las respuestas lentas de los pedidos cancelados por el hedge
+            await asyncio.sleep(args.slow_ms / 1000)
+        lat = [dt for dt, _ in results]
+        print(
+            f"  {mode:11s} p50={_pct(lat, 50):6.0f} ms  p99={_pct(lat, 99):6.0f} ms  "
+            f"max={max(lat) * 1000:6.0f} ms  requests_extra={secondary.requests}"
+        )
+
+async def main(args) -> None:
+    await brownout(args)
+    await hedging(args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rps", type=float, default=100.0, help="requests originales por segundo")
+    parser.add_argument("--phase-s", type=float, default=3.0, help="duración de cada fase")
+    parser.add_argument("--fail-rate", type=float, default=0.9, help="fracción de 503 durante la caída")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia normal del stub")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="fracción de respuestas lentas")
+    parser.add_argument("--slow-ms", type=float, default=500.0, help="latencia de las respuestas lentas")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    asyncio.run(main(args))
@@ -0,0 +1,93 @@
+"""
+Benchmark: reparto entre varios endpoints con `app.services.llm_router`.
+
+- Latencia: tres stubs con latencias distintas (`--latencies-ms`); se compara elegir
+  al azar vs. el router (EWMA × en curso), con un tope de concurrencia en el más rápido.
+- Cuota: el endpoint rápido tiene una cuota (`--quota` req/s) que informa en los headers
+  `x-ratelimit-*`; se comparan los 429 recibidos ignorando los headers vs. usándolos.
+- Reporta p50/p99, requests por endpoint y 429.
+
+Uso:
+    python -m bench.bench_router --rps 150 --duration-s 5
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Carga concurrente
+import logging  # Silenciar logs por request
+import random  # Elección al azar (línea base)
+from contextlib import AsyncExitStack  # Varios stubs a la vez
+
+from bench.bench_resilience import _load, _pct  # Carga a tasa fija (configura Settings mínimos)
+from app.services import llm_client
+from app.services.http_pool import close_http_client, start_http_client
+from app.services.llm_router import Endpoint, Router
+from app.services.resilience import RetryBudget
+from bench.stub_llm import StubLLM
+
+class _RandomRouter(Router):
+    """Línea base: endpoint sano al azar, sin mirar latencia ni carga."""
+    def _take(self, candidates, now):
+        random.shuffle(candidates)
+        for endpoint in candidates:
+            if endpoint.breaker.allow():
+                endpoint.in_flight += 1
+                return endpoint
+        return None
+
+class _BlindEndpoint(Endpoint):
+    """Línea base: ignora `x-ratelimit-*` y `Retry-After` (sólo ve los 429 como errores)."""
+    def update_limits(self, headers, status):
+        pass
+
+async def _scenario(title: str, stubs_kwargs: list[dict], modes: dict, args) -> None:
+    print(title)
+    for mode, (router_cls, endpoint_cls) in modes.items():
+        async with AsyncExitStack() as stack:
+            stubs = [
+                await stack.enter_async_context(StubLLM(seed=i, **{k: v for k, v in kw.items() if k != "cap"}))
+                for i, kw in enumerate(stubs_kwargs)
+            ]
+            endpoints = [
+                endpoint_cls(f"ep{i}", stub.url, "bench", "stub", max_concurrency=kw.get("cap", 0))
+                for i, (stub, kw) in enumerate(zip(stubs, stubs_kwargs))
+            ]
+            llm_client.router = router_cls(endpoints)
+            llm_client.retry_budget = RetryBudget()
+            await start_http_client()
+            results = await _load(args.rps, args.duration_s)
+            await close_http_client()
+        lat = [dt for dt, _ in results]
+        ok = sum(1 for _, good in results if good)
+        split = " ".join(f"ep{i}={stub.requests}" for i, stub in enumerate(stubs))
+        throttled = sum(stub.throttled for stub in stubs)
+        print(f"  {mode:14s} p50={_pct(lat, 50):6.0f} ms  p99={_pct(lat, 99):6.0f} ms  ok={ok}/{len(results)}  "
+              f"429={throttled:4d}  {split}")
+
+async def main(args) -> None:
+    fast, medium, slow = (ms / 1000 for ms in args.latencies_ms)
+    await _scenario(
+        f"latencia: endpoints de {'/'.join(f'{ms:g}' for ms in args.latencies_ms)} ms, "
+        f"tope {args.cap} en el rápido, {args.rps:g} req/s",
+        [{"latency_s": fast, "cap": args.cap}, {"latency_s": medium}, {"latency_s": slow}],
+        {"al azar": (_RandomRouter, Endpoint), "router": (Router, Endpoint)},
+        args,
+    )
+    # La cuota ocupa el 2/3 del tráfico: parte tiene que ir al endpoint lento
+    await _scenario(
+        f"cuota: endpoint rápido con {args.quota} req/s, {args.rps:g} req/s",
+        [{"latency_s": fast, "rate_limit": args.quota}, {"latency_s": medium}],
+        {"sin headers": (Router, _BlindEndpoint), "con headers": (Router, Endpoint)},
+        args,
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rps", type=float, default=150.0, help="requests por segundo")
+    parser.add_argument("--duration-s", type=float, default=5.0)
+    parser.add_argument("--latencies-ms", type=float, nargs=3, default=[20.0, 60.0, 150.0])
+    parser.add_argument("--cap", type=int, default=4, help="max_concurrency del endpoint rápido")
+    parser.add_argument("--quota", type=int, default=100, help="cuota por segundo del endpoint rápido")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    asyncio.run(main(args))
@@ -0,0 +1,104 @@
+"""
+Simulación: latencia de cola bajo carga sesgada, semáforo FIFO vs. `FairScheduler`.
+
+- Un usuario "ruidoso" mantiene muchos pedidos en espera a la vez; varios usuarios
+  "normales" envían de a uno; algunos mensajes son de riesgo (carril prioritario).
+- El LLM se simula con una demora fija por pedido (`--service-ms`).
+- Reporta p50/p99 del tiempo en cola por tipo de usuario y los rechazos.
+
+Uso:
+    python -m bench.bench_scheduler --capacity 4 --noisy 40 --users 20
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Simulación concurrente
+import random  # Llegadas aleatorias
+import statistics  # Percentiles
+import time  # Medición
+
+from app.utils.scheduler import FairScheduler, SchedulerFull
+
+def _pct(samples: list[float], p: float) -> float:
+    """Percentil `p` (0-100) en milisegundos."""
+    if len(samples) < 2:
+        return (samples[0] if samples else 0.0) * 1000
+    return statistics.quantiles(samples, n=100, method="inclusive")[int(p) - 1] * 1000
+
+class _FifoSemaphore:
+    """El comportamiento anterior: `asyncio.Semaphore(MAX_IN_FLIGHT)`, sin tope por usuario."""
+    def __init__(self, capacity: int):
+        self._sem = asyncio.Semaphore(capacity)
+
+    def has_room(self, urgent: bool = False) -> bool:
+        return True
+
+    async def acquire(self, user: str, urgent: bool = False) -> float:
+        t0 = time.monotonic()
+        await self._sem.acquire()
+        return time.monotonic() - t0
+
+    def release(self, user: str) -> None:
+        self._sem.release()
+
+async def _simulate(sched, args) -> dict[str, list[float]]:
+    waits: dict[str, list[float]] = {"ruidoso": [], "normal": [], "riesgo": []}
+    rejected = 0
+    service = args.service_ms / 1000
+
+    async def request(user: str, kind: str, urgent: bool = False):
+        nonlocal rejected
+        if not sched.has_room(urgent):
+            rejected += 1
+            return
+        try:
+            wait = await sched.acquire(user, urgent=urgent)
+        except SchedulerFull:
+            rejected += 1
+            return
+        try:
+            waits[kind].append(wait)
+            await asyncio.sleep(service)
+        finally:
+            sched.release(user)
+
+    async def noisy():
+        # Ráfagas: `--noisy` pedidos en paralelo, una y otra vez
+        for _ in range(args.rounds):
+            await asyncio.gather(*(request("ruidoso", "ruidoso") for _ in range(args.noisy)))
+
+    async def normal(i: int):
+        rng = random.Random(i)
+        for _ in range(args.rounds * 2):
+            await asyncio.sleep(rng.uniform(0, service * 4))
+            urgent = rng.random() < args.risk_ratio
+            await request(f"user-{i}", "riesgo" if urgent else "normal", urgent=urgent)
+
+    await asyncio.gather(noisy(), *(normal(i) for i in range(args.users)))
+    waits["rechazados"] = [rejected]
+    return waits
+
+async def main(args) -> None:
+    for name, sched in (
+        ("fifo", _FifoSemaphore(args.capacity)),
+        ("fair", FairScheduler(args.capacity, per_user_max=args.per_user, max_queue=args.max_queue)),
+    ):
+        waits = await _simulate(sched, args)
+        rejected = waits.pop("rechazados")[0]
+        parts = [
+            f"{kind} p50={_pct(w, 50):7.1f} p99={_pct(w, 99):7.1f} ms (n={len(w)})"
+            for kind, w in waits.items()
+        ]
+        print(f"{name:5s} " + "  ".join(parts) + f"  rechazados={rejected}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--capacity", type=int, default=4, help="MAX_IN_FLIGHT")
+    parser.add_argument("--per-user", type=int, default=2, help="PER_USER_MAX")
+    parser.add_argument("--max-queue", type=int, default=100, help="QUEUE_MAX")
+    parser.add_argument("--noisy", type=int, default=40, help="pedidos simultáneos del usuario ruidoso")
+    parser.add_argument("--users", type=int, default=20, help="usuarios normales")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--risk-ratio", type=float, default=0.05, help="fracción de mensajes de riesgo")
+    parser.add_argument("--service-ms", type=float, default=20.0, help="demora simulada del LLM")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,60 @@
+"""
+Soak test del `SessionStore`: RSS estable tras muchas conexiones simuladas.
+
+- Cada "conexión" guarda algunos turnos en la historia (como `llm_generate` offline)
+  y al terminar se libera (`clear_history`, como hace `handle_client`).
+- Una fracción de conexiones se "abandona" sin liberar: esas las acota el tope
+  `SESSION_MAX` (LRU) y la expiración por inactividad.
+- Imprime RSS y sesiones vivas cada 10% del recorrido.
+
+Uso:
+    python -m bench.bench_session_soak --connections 100000 --abandon 0.2
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Las funciones de historia son corutinas
+import gc  # Forzar recolección antes de medir
+import resource  # RSS pico (fallback)
+
+from app.services import llm_client
+from app.services.session_store import sessions
+
+def rss_mb() -> float:
+    """RSS actual en MB (Linux: /proc/self/status; si no, el pico de getrusage)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def main(connections: int, turns: int, abandon: float, max_sessions: int) -> None:
+    sessions.max_sessions = max_sessions
+    text = "Hoy me siento un poco mejor, aunque todavía me cuesta dormir. " * 3
+    step = max(1, connections // 10)
+    every_abandoned = int(1 / abandon) if abandon > 0 else 0
+
+    print(f"{'conexiones':>10}  {'RSS MB':>8}  {'sesiones':>8}  {'bytes':>10}")
+    for i in range(1, connections + 1):
+        cid = f"Usuario-{i}"
+        for _ in range(turns):
+            await llm_client.append_user(cid, text)
+            await llm_client.append_assistant(cid, text)
+        if not (every_abandoned and i % every_abandoned == 0):
+            await llm_client.clear_history(cid)  # Desconexión normal
+        if i % step == 0:
+            gc.collect()
+            stats = sessions.stats()
+            print(f"{i:10d}  {rss_mb():8.1f}  {stats['sessions']:8d}  {stats['bytes']:10d}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--abandon", type=float, default=0.2, help="fracción de conexiones sin liberar")
+    parser.add_argument("--max-sessions", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.connections, args.turns, args.abandon, args.max_sessions))
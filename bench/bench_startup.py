@@ -0,0 +1,188 @@
+"""
+Tiempo de arranque del servidor y del gateway, con presupuesto (chequeo de regresiones).
+
+- Importación: `python -X importtime -c "import <módulo>"` (mediana de `--runs`), con el
+  total acumulado del módulo y sus importaciones más caras. Falla si aparece un módulo
+  pesado que debe cargarse recién con el socket escuchando (httpx, pydantic).
+- Arranque en frío: lanza `python -m app.server` / `python -m gateway.ws_gateway` y mide
+  cuánto tarda el puerto en aceptar conexiones y `/ready` en responder 200 (desde el fork).
+- Termina con código 1 si algo pasa su presupuesto (`--import-budget-ms`,
+  `--ready-budget-ms`): sirve como chequeo en CI. Los presupuestos por defecto dejan ~2× de
+  margen sobre lo medido con 1 núcleo: app ~65 ms de importación y ~380 ms hasta `/ready`
+  (con pydantic-settings y httpx al importar eran ~220-350 ms y escuchaba a los ~590 ms),
+  gateway ~105 ms y ~150 ms (antes ~225 ms y ~440 ms).
+- `--pool-warmup N` levanta `StubLLM` y mide el arranque con `LLM_POOL_WARMUP=N`.
+
+Uso:
+    python -m bench.bench_startup --runs 5
+    python -m bench.bench_startup --ready-budget-ms 250 --pool-warmup 2
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Stub LLM en otro proceso
+import multiprocessing  # Proceso del stub
+import os  # Entorno de los procesos bajo prueba
+import signal  # Apagado de los procesos
+import socket  # Esperar el puerto y consultar /ready
+import statistics  # Medianas
+import subprocess  # Intérprete nuevo por medición
+import sys  # Intérprete actual
+import time  # Medición
+
+from bench.stub_llm import StubLLM
+
+# Módulos bajo prueba → variable de su puerto de métricas
+TARGETS = {
+    "app.server": "METRICS_PORT",
+    "gateway.ws_gateway": "GATEWAY_METRICS_PORT",
+}
+# No deben cargarse al importar (el gateway nunca los usa; la app los carga en `_warm_up`)
+FORBIDDEN = ("httpx", "pydantic", "pydantic_settings")
+
+def _stub_main(port: int) -> None:
+    """Proceso del stub LLM (destino del precalentamiento del pool)."""
+    async def run():
+        async with StubLLM(port=port):
+            await asyncio.Event().wait()
+    asyncio.run(run())
+
+def interpreter_ms() -> float:
+    """Tiempo de pared de `python -c pass` (piso de cualquier arranque)."""
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter() - t0) * 1000
+
+def import_profile(module: str, env: dict) -> tuple[float, list[tuple[float, str]], set[str]]:
+    """
+    Importa `module` en un intérprete nuevo con `-X importtime`.
+
+    - Devuelve el total acumulado (ms), sus importaciones directas más caras (ms, nombre) y
+      todos los módulos que cargó.
+    """
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=env,
+                         capture_output=True, text=True, check=True).stderr
+    total, children, pending, loaded = 0.0, [], [], set()
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # Encabezado
+        # Cada módulo se imprime después de sus hijos, con dos espacios más por nivel
+        depth = (len(name) - len(name.lstrip())) // 2
+        loaded.add(name.strip())
+        if depth == 1:
+            pending.append((int(cumulative) / 1000, name.strip()))
+        elif depth == 0:
+            if name.strip() == module:
+                total, children = int(cumulative) / 1000, pending
+            pending = []
+    return total, sorted(children, reverse=True)[:5], loaded
+
+def _ready(port: int) -> bool:
+    """True si `GET /ready` en `port` responde 200."""
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=1.0) as conn:
+            conn.sendall(b"GET /ready HTTP/1.1\r\nHost: bench\r\n\r\n")
+            return conn.recv(64).startswith(b"HTTP/1.1 200")
+    except OSError:
+        return False
+
+def _accepts(port: int) -> bool:
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+        return True
+    except OSError:
+        return False
+
+def cold_start(module: str, port: int, metrics_port: int, env: dict, timeout: float = 30.0) -> tuple[float, float]:
+    """
+    Lanza `python -m module` y mide (ms) hasta que `port` acepta y hasta que `/ready` da 200.
+    """
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", module], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    listening = None
+    try:
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{module} terminó al arrancar (código {proc.returncode})")
+            if listening is None and _accepts(port):
+                listening = time.perf_counter() - t0
+            if listening is not None and _ready(metrics_port):
+                return listening * 1000, (time.perf_counter() - t0) * 1000
+            time.sleep(0.005)
+        raise RuntimeError(f"{module} no estuvo listo en {timeout:.0f} s")
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5, help="mediciones por módulo (se usa la mediana)")
+    parser.add_argument("--import-budget-ms", type=float, nargs=2, default=[150.0, 200.0],
+                        metavar=("APP", "GATEWAY"), help="importación de app.server y del gateway")
+    parser.add_argument("--ready-budget-ms", type=float, nargs=2, default=[700.0, 350.0],
+                        metavar=("APP", "GATEWAY"), help="desde el fork hasta /ready 200")
+    parser.add_argument("--pool-warmup", type=int, default=0, help="LLM_POOL_WARMUP de la app (con StubLLM)")
+    parser.add_argument("--port", type=int, default=5190)
+    args = parser.parse_args()
+
+    app_port, ws_port, stub_port = args.port, args.port + 1, args.port + 2
+    metrics_ports = {"app.server": args.port + 3, "gateway.ws_gateway": args.port + 4}
+    env = dict(
+        os.environ,
+        APP_HOST="127.0.0.1", APP_PORT=str(app_port), APP_MUX_PORT="", METRICS_HOST="127.0.0.1",
+        GROQ_API_KEY="bench", MODEL_NAME="stub", LLM_URL=f"http://127.0.0.1:{stub_port}/v1/chat/completions",
+        RATE_WINDOW_SECONDS="1", RATE_MAX_MESSAGES="1000", HISTORY_BACKEND="memory",
+        LLM_POOL_WARMUP=str(args.pool_warmup), DIAG_ENABLED="false",
+        TCP_HOST="127.0.0.1", TCP_PORT=str(app_port), WS_HOST="127.0.0.1", WS_PORT=str(ws_port),
+    )
+    stub = None
+    if args.pool_warmup:
+        stub = multiprocessing.Process(target=_stub_main, args=(stub_port,), daemon=True)
+        stub.start()
+        while not _accepts(stub_port):
+            time.sleep(0.05)
+
+    base = statistics.median(interpreter_ms() for _ in range(args.runs))
+    print(f"runs={args.runs}  intérprete vacío (python -c pass): {base:.1f} ms")
+    failures = []
+    try:
+        for (module, metrics_var), import_budget, ready_budget in zip(
+                TARGETS.items(), args.import_budget_ms, args.ready_budget_ms):
+            profiles = [import_profile(module, env) for _ in range(args.runs)]
+            total = statistics.median(p[0] for p in profiles)
+            heavy = sorted(set(FORBIDDEN) & set().union(*(p[2] for p in profiles)))
+            print(f"\n{module}: importación {total:6.1f} ms (presupuesto {import_budget:.0f})")
+            for ms, name in profiles[-1][1]:
+                print(f"    {ms:6.1f} ms  {name}")
+            if heavy:
+                failures.append(f"{module} importa {', '.join(heavy)}")
+            if total > import_budget:
+                failures.append(f"{module}: importación {total:.0f} ms > {import_budget:.0f} ms")
+
+            port = app_port if module == "app.server" else ws_port
+            metrics_port = metrics_ports[module]
+            run_env = dict(env, **{metrics_var: str(metrics_port)})
+            starts = [cold_start(module, port, metrics_port, run_env) for _ in range(args.runs)]
+            listening = statistics.median(s[0] for s in starts)
+            ready = statistics.median(s[1] for s in starts)
+            print(f"  arranque: escuchando {listening:6.1f} ms, /ready {ready:6.1f} ms (presupuesto {ready_budget:.0f})")
+            if ready > ready_budget:
+                failures.append(f"{module}: /ready a los {ready:.0f} ms > {ready_budget:.0f} ms")
+    finally:
+        if stub is not None:
+            stub.terminate()
+
+    if failures:
+        print("\nFUERA DE PRESUPUESTO:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("\nOK: dentro del presupuesto")
+
+if __name__ == "__main__":
+    main()
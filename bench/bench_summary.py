@@ -0,0 +1,86 @@
+"""
+Benchmark: tokens de entrada por request en una conversación larga, sin y con resumen
+incremental (`app.services.summarizer`).
+
+- Una conversación de `--turns` turnos contra `StubLLM`, que responde `--reply-chars`
+  caracteres (también a los pedidos de resumen).
+- Sin resumen: la ventana de `LLM_INPUT_TOKEN_BUDGET` descarta los turnos viejos.
+- Con resumen: los turnos viejos se compactan en segundo plano y cada request lleva
+  system + resumen + los mensajes recientes.
+- Reporta los tokens estimados por request de chat (`psicoia_llm_prompt_tokens`), los
+  enviados para resumir y qué parte de la conversación ve el modelo en el último turno
+  (textual o resumida).
+
+Uso:
+    python -m bench.bench_summary --turns 60 --budget 4000
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Conversación contra el stub
+import logging  # Silenciar logs por request
+
+from bench.bench_resilience import _configure  # Endpoint hacia el stub (configura Settings mínimos)
+from app.services import llm_client, summarizer
+from app.services.http_pool import close_http_client, start_http_client
+from app.services import session_store
+from app.services.session_store import sessions
+from bench.stub_llm import StubLLM
+
+TEXT = "Hoy me siento cansado, discutí otra vez con mi hermana y no pude dormir bien. "
+
+def _counter(metric) -> float:
+    """Valor actual de un contador (o de un hijo con labels)."""
+    return getattr(metric, "_value", metric).value
+
+async def run(mode: str, args) -> None:
+    summarizer.ENABLED = mode == "con resumen"
+    reply = ("Te escucho. " * (args.reply_chars // 12 + 1))[:args.reply_chars]
+    async with StubLLM(latency_s=args.latency_ms / 1000, reply=reply) as stub:
+        _configure("resiliente", stub.url)
+        summarizer.router = llm_client.router
+        await start_http_client()
+        hist = llm_client._PROMPT_TOKENS._value
+        sum0, count0 = hist.sum, hist.count
+        summary0 = _counter(summarizer._SUMMARY_TOKENS)
+        calls0 = _counter(summarizer._SUMMARIES.labels("ok"))
+        cid = f"bench-{mode}"
+        for turn in range(args.turns):
+            await llm_client.llm_generate(f"({turn}) {TEXT * args.user_repeat}", conversation_id=cid)
+            await asyncio.sleep(args.think_ms / 1000)
+        await summarizer.stop_summaries()
+
+        session = sessions.peek(cid)
+        history = session.history
+        remaining = max(0, llm_client._INPUT_BUDGET - llm_client.prompts.get().tokens - llm_client._BUDGET_MARGIN)
+        start = llm_client._window_start(history, session.summary, remaining)
+        covered = history.offset + len(history) - start + (session.summary.upto if session.summary else 0)
+        total = history.offset + len(history)
+        avg = (hist.sum - sum0) / max(1, hist.count - count0)
+        summary_tokens = _counter(summarizer._SUMMARY_TOKENS) - summary0
+        print(f"  {mode:12s} prompt/request={avg:7.0f} tokens  resúmenes={_counter(summarizer._SUMMARIES.labels('ok')) - calls0:3.0f}"
+              f"  tokens para resumir={summary_tokens:7.0f}  total/turno={avg + summary_tokens / args.turns:7.0f}"
+              f"  contexto visible={min(covered, total)}/{total} mensajes")
+        sessions.release(cid)
+        await close_http_client()
+
+async def main(args) -> None:
+    llm_client._INPUT_BUDGET = args.budget
+    session_store._HISTORY_MAX = args.history_max
+    summarizer.TRIGGER_TOKENS = args.trigger or args.budget // 2
+    print(f"{args.turns} turnos, presupuesto {args.budget} tokens, umbral de resumen {summarizer.TRIGGER_TOKENS}")
+    for mode in ("sin resumen", "con resumen"):
+        await run(mode, args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--budget", type=int, default=4000, help="LLM_INPUT_TOKEN_BUDGET")
+    parser.add_argument("--trigger", type=int, default=0, help="LLM_SUMMARY_TRIGGER_TOKENS (0 = budget/2)")
+    parser.add_argument("--history-max", type=int, default=500, help="LLM_HISTORY_MAX_MESSAGES")
+    parser.add_argument("--reply-chars", type=int, default=400)
+    parser.add_argument("--user-repeat", type=int, default=2, help="repeticiones del texto por mensaje")
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--think-ms", type=float, default=20.0)
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(main(parser.parse_args()))
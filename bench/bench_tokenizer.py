@@ -0,0 +1,109 @@
+"""
+Benchmark de tokenizadores: precisión vs. costo por backend.
+
+- Referencia: `BPETokenizer` con el vocabulario indicado (idealmente el del modelo en uso).
+- Compara la heurística chars/token contra la referencia (error medio y máximo)
+  y el costo por llamada de cada backend, con y sin el LRU de `CachedTokenizer`.
+- Sin `--vocab` entrena un vocabulario de demostración sobre el corpus (sólo para
+  ver el costo; la precisión sólo es significativa con el vocabulario real).
+
+Uso:
+    python -m bench.bench_tokenizer --vocab cl100k_base.tiktoken --cpt 3
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import base64  # Escribir el vocabulario de demostración
+import random  # Corpus sintético
+import tempfile  # Archivo temporal del vocabulario
+import time  # Medición de costo
+from collections import Counter  # Conteo de pares en el entrenamiento
+
+from app.services.tokenizer import (
+    _PRETOKENIZE, BPETokenizer, CachedTokenizer, CharsPerTokenTokenizer,
+)
+
+FRASES = [
+    "Hoy me siento muy ansioso y no puedo respirar bien 😟",
+    "No sé qué hacer, mi familia no me entiende.",
+    "Tengo ataques de pánico cuando voy a la facultad 😰😰",
+    "Me cuesta dormir, pienso todo el tiempo en lo mismo…",
+    "Gracias, hablar con vos me ayuda a tener más calma 🙏",
+    "¿Cómo puedo cuidarme mejor cuando estoy triste?",
+    "Siento un vacío enorme y ganas de llorar sin motivo.",
+    "Mi pareja y mis amigos me apoyan, pero igual me siento solo.",
+]
+
+def corpus(n: int, seed: int = 7) -> list[str]:
+    """Mensajes sintéticos en español (con tildes y emoji) de longitud variable."""
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choices(FRASES, k=rnd.randint(1, 4))) for _ in range(n)]
+
+def train_demo_vocab(texts: list[str], merges: int) -> dict[bytes, int]:
+    """
+    Entrena un vocabulario BPE mínimo sobre `texts` (sólo para demostración).
+    """
+    ranks = {bytes([b]): b for b in range(256)}
+    words = Counter(p.encode("utf-8") for t in texts for p in _PRETOKENIZE.findall(t))
+    splits = {w: [w[i:i + 1] for i in range(len(w))] for w in words}
+    for _ in range(merges):
+        pairs = Counter()
+        for w, parts in splits.items():
+            for a, b in zip(parts, parts[1:]):
+                pairs[a + b] += words[w]
+        if not pairs:
+            break
+        best = pairs.most_common(1)[0][0]
+        ranks[best] = len(ranks)
+        for w, parts in splits.items():
+            i = 0
+            while i < len(parts) - 1:
+                if parts[i] + parts[i + 1] == best:
+                    parts[i:i + 2] = [best]
+                else:
+                    i += 1
+    return ranks
+
+def _cost_us(tok, texts: list[str]) -> float:
+    """Costo medio por llamada a `count` en microsegundos."""
+    t0 = time.perf_counter()
+    for t in texts:
+        tok.count(t)
+    return (time.perf_counter() - t0) / len(texts) * 1e6
+
+def main(vocab: str | None, cpt: int, n: int, merges: int) -> None:
+    texts = corpus(n)
+    if vocab is None:
+        ranks = train_demo_vocab(texts[:500], merges)
+        with tempfile.NamedTemporaryFile("wb", suffix=".tiktoken", delete=False) as f:
+            for token, rank in ranks.items():
+                f.write(base64.b64encode(token) + b" " + str(rank).encode() + b"\n")
+            vocab = f.name
+        print(f"(vocabulario de demostración: {len(ranks)} tokens en {vocab})")
+
+    reference = BPETokenizer.from_file(vocab)
+    chars = CharsPerTokenTokenizer(cpt)
+    truth = [reference.count(t) for t in texts]
+
+    errors = [abs(chars.count(t) - r) / r for t, r in zip(texts, truth) if r]
+    print(f"chars/token={cpt}: error medio {sum(errors) / len(errors) * 100:5.1f}%  "
+          f"máximo {max(errors) * 100:5.1f}%")
+
+    rows = [
+        ("chars", CharsPerTokenTokenizer(cpt)),
+        ("bpe (sin cache)", BPETokenizer.from_file(vocab)),
+        ("bpe + LRU", CachedTokenizer(BPETokenizer.from_file(vocab), 4096)),
+    ]
+    for name, tok in rows:
+        first = _cost_us(tok, texts)
+        repeat = _cost_us(tok, texts)  # Segunda pasada: mismos mensajes (historia re-estimada)
+        print(f"{name:16s} 1ra pasada {first:8.2f} µs/msg   repetida {repeat:8.2f} µs/msg")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vocab", help="vocabulario .tiktoken (por defecto, uno de demostración)")
+    parser.add_argument("--cpt", type=int, default=3, help="chars por token de la heurística")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--merges", type=int, default=400)
+    args = parser.parse_args()
+    main(args.vocab, args.cpt, args.messages, args.merges)
@@ -0,0 +1,132 @@
+"""
+Escalado de mensajes/seg con `python -m app.server --workers N` contra un stub local.
+
+- Levanta `StubLLM` en un proceso aparte y el servidor TCP con N workers.
+- Generadores de carga en varios procesos: C conexiones TCP que envían un mensaje,
+  esperan la respuesta y repiten durante `--duration` segundos.
+- Reporta mensajes/seg por N y la aceleración respecto de 1 worker
+  (el escalado es casi lineal mientras haya núcleos libres para servidor + carga + stub).
+
+Uso:
+    python -m bench.bench_workers --workers 1 2 4 --connections 200 --duration 10
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Clientes TCP concurrentes
+import multiprocessing  # Stub y generadores de carga en otros procesos
+import os  # Entorno del servidor y núcleos disponibles
+import signal  # Apagado del servidor
+import socket  # Esperar a que el puerto acepte conexiones
+import subprocess  # Servidor bajo prueba
+import sys  # Intérprete actual
+import time  # Medición
+
+from bench.stub_llm import StubLLM
+
+GREETING_LINES = 3  # Líneas de bienvenida de `handle_client`
+
+def _stub_main(port: int, latency_s: float) -> None:
+    """Proceso del stub LLM (no comparte event loop con la carga)."""
+    async def run():
+        async with StubLLM(port=port, latency_s=latency_s):
+            await asyncio.Event().wait()
+    asyncio.run(run())
+
+def _load_main(port: int, connections: int, duration: float, out) -> None:
+    """Proceso generador de carga: devuelve por `out` los mensajes respondidos."""
+    async def conn(deadline: float) -> int:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for _ in range(GREETING_LINES):
+            await reader.readline()
+        done = 0
+        while time.monotonic() < deadline:
+            writer.write(b"hola, hoy me siento un poco ansioso\n")
+            await writer.drain()
+            if not await reader.readline():
+                break
+            done += 1
+        writer.close()
+        return done
+
+    async def run() -> int:
+        deadline = time.monotonic() + duration
+        return sum(await asyncio.gather(*(conn(deadline) for _ in range(connections))))
+
+    out.send(asyncio.run(run()))
+
+def _wait_port(port: int, timeout: float = 15.0) -> None:
+    """Espera a que el servidor acepte conexiones."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"el servidor no abrió el puerto {port}")
+
+def run_once(workers: int, args) -> float:
+    """Mide mensajes/seg con `workers` procesos."""
+    env = dict(
+        os.environ,
+        APP_HOST="127.0.0.1", APP_PORT=str(args.port),
+        LLM_URL=f"http://127.0.0.1:{args.stub_port}/v1/chat/completions",
+        GROQ_API_KEY="bench", MODEL_NAME="stub",
+        MAX_IN_FLIGHT=str(args.connections * args.loaders), PER_USER_MAX="1",
+        RATE_WINDOW_SECONDS="1", RATE_MAX_MESSAGES="1000000",
+        LLM_STREAM="false", HISTORY_BACKEND="memory",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--workers", str(workers)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_port(args.port)
+        time.sleep(0.5 * workers)  # Dar tiempo a que todos los workers escuchen
+        pipes, procs = [], []
+        for _ in range(args.loaders):
+            recv, send = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(target=_load_main, args=(args.port, args.connections, args.duration, send))
+            proc.start()
+            pipes.append(recv)
+            procs.append(proc)
+        t0 = time.perf_counter()
+        total = sum(p.recv() for p in pipes)
+        wall = time.perf_counter() - t0
+        for proc in procs:
+            proc.join()
+        return total / wall
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--connections", type=int, default=100, help="conexiones por generador de carga")
+    parser.add_argument("--loaders", type=int, default=2, help="procesos generadores de carga")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="latencia simulada del stub")
+    parser.add_argument("--port", type=int, default=5090)
+    parser.add_argument("--stub-port", type=int, default=5091)
+    args = parser.parse_args()
+
+    stub = multiprocessing.Process(target=_stub_main, args=(args.stub_port, args.latency_ms / 1000), daemon=True)
+    stub.start()
+    _wait_port(args.stub_port)
+    print(f"núcleos disponibles: {os.cpu_count()}")
+    base = None
+    try:
+        for n in args.workers:
+            rate = run_once(n, args)
+            base = base or rate
+            print(f"workers={n:2d}  {rate:9.0f} msgs/s  x{rate / base:4.2f}")
+    finally:
+        stub.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Generador de carga de punta a punta: N clientes TCP (contra `app.server`) o WebSocket
+(a través de `gateway.ws_gateway`) hablando con un stub OpenAI-compatible local.
+
+- Levanta `bench.stub_llm` en un proceso aparte (latencia con distribución, 429/5xx
+  inyectados, SSE), el servidor TCP y, con `--target ws`, el gateway.
+- Cada cliente conecta, espera el saludo y envía mensajes en lazo cerrado (manda,
+  espera la respuesta completa, opcionalmente piensa `--think-ms`) durante `--duration-s`.
+- Con `--stream`, la respuesta termina en la marca de fin (`\\x03`); el primer
+  fragmento marca el tiempo al primer byte.
+- Clientes en ráfagas: con `--burst N` cada vuelta manda N mensajes seguidos y espera sus
+  N respuestas (una sola con `--coalesce-ms`, que activa `PIPELINE_COALESCE_MS` en la app);
+  con `--abandon-rate`, una fracción de las vueltas se desconecta sin leer y reconecta.
+  Las llamadas al LLM desperdiciadas son las que el stub respondió y ningún cliente leyó.
+- Reporta throughput, p50/p95/p99 de latencia y de primer byte, errores, CPU y RSS de
+  la app, del gateway y del generador, y los contadores del stub; lo guarda como JSON
+  (`--out`) para comparar entre commits (`--baseline` o `python -m bench.report`).
+
+Uso:
+    python -m bench.loadgen --target tcp --clients 200 --duration-s 10 --latency-ms 50 --dist lognormal
+    python -m bench.loadgen --target ws --clients 500 --stream --fail-rate 0.05 --fail-status 429
+    python -m bench.loadgen --target tcp --clients 100 --burst 3 --abandon-rate 0.3 --latency-ms 200
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import asyncio  # Clientes concurrentes
+import json  # Contadores del stub y reporte base
+import os  # Entorno de los procesos bajo prueba
+import random  # Vueltas abandonadas
+import resource  # Subir el límite de descriptores
+import signal  # Apagado de los procesos
+import sys  # Intérprete actual
+import time  # Medición
+
+import websockets  # Clientes WS (dependencia del gateway)
+
+from app.protocol import CONTROL, STREAM_CHUNK, STREAM_END
+from bench.bench_workers import GREETING_LINES, _wait_port
+from bench.report import ProcessMeter, compare, new_report, summary, write_report
+from bench.stub_llm import LATENCY_DISTS
+
+# Settings mínimos de la app (se respetan los del entorno si ya están definidos)
+APP_DEFAULTS = {
+    "GROQ_API_KEY": "bench", "MODEL_NAME": "stub", "LLM_TEMPERATURE": "0.5", "LLM_MAX_TOKENS": "50",
+    "LLM_TIMEOUT_SECONDS": "10", "LLM_MAX_RETRIES": "3", "LLM_BACKOFF_INITIAL": "0.1",
+    "LLM_BACKOFF_MAX": "1", "LLM_HISTORY_MAX_MESSAGES": "10", "LLM_INPUT_TOKEN_BUDGET": "1000",
+    "LLM_CHARS_PER_TOKEN": "3", "HISTORY_BACKEND": "memory",
+}
+
+# Mensajes que envían los clientes (rotan para no repetir siempre el mismo)
+PROMPTS = (
+    "hola, hoy me siento un poco ansioso",
+    "no pude dormir bien esta semana",
+    "tengo mucho trabajo y me cuesta concentrarme",
+    "discutí con un amigo y me quedé mal",
+)
+
+class _Stats:
+    def __init__(self):
+        """Resultados de todos los clientes."""
+        self.latencies: list[float] = []
+        self.ttfb: list[float] = []
+        self.messages = 0  # Mensajes con respuesta leída
+        self.replies = 0  # Respuestas leídas
+        self.abandoned = 0  # Vueltas en las que el cliente se fue sin leer
+        self.errors = 0
+        self.connect_errors = 0
+
+async def _read_reply(recv) -> float:
+    """
+    Lee una respuesta completa con `recv()` (línea o frame) y devuelve el tiempo al primero.
+
+    - Sin streaming la respuesta es una sola línea; con streaming, fragmentos `\\x02`
+      hasta la marca `\\x03`.
+    """
+    t0 = time.perf_counter()
+    ttfb = None
+    while True:
+        item = await recv()
+        if not item:
+            raise ConnectionError("conexión cerrada")
+        if ttfb is None:
+            ttfb = time.perf_counter() - t0
+        if not item.startswith(STREAM_CHUNK):
+            return ttfb
+
+async def _tcp_session(args):
+    """Conexión TCP directa: devuelve `(recv, send, close)` tras el saludo."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", args.port)
+    for _ in range(GREETING_LINES):
+        await reader.readline()
+
+    async def recv() -> str:
+        return (await reader.readline()).decode("utf-8")
+
+    async def send(text: str) -> None:
+        writer.write(text.encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def close() -> None:
+        writer.close()
+
+    return recv, send, close
+
+async def _ws_session(args):
+    """WebSocket vía gateway: devuelve `(recv, send, close)` tras el token de sesión."""
+    ws = await websockets.connect(f"ws://127.0.0.1:{args.ws_port}", max_size=None)
+    # Saludo (una línea por frame) y después el token `\x01<token>`
+    while not (await ws.recv()).startswith(CONTROL):
+        pass
+
+    async def recv() -> str:
+        try:
+            return await ws.recv()
+        except websockets.ConnectionClosed:
+            return ""
+
+    async def close() -> None:
+        await ws.close()
+
+    return recv, ws.send, close
+
+async def _client(index: int, args, stats: _Stats, start: asyncio.Event, deadline: list[float]) -> None:
+    """
+    Un cliente en lazo cerrado: conecta, espera la largada y manda mensajes hasta el plazo.
+    """
+    opener = _ws_session if args.target == "ws" else _tcp_session
+    try:
+        recv, send, close = await asyncio.wait_for(opener(args), args.timeout_s)
+    except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+        stats.connect_errors += 1
+        return
+    await start.wait()
+    rng = random.Random(index)
+    # Respuestas por vuelta: una por mensaje, o una por ráfaga si la app los junta
+    replies = 1 if args.coalesce_ms else args.burst
+    sent = 0
+    try:
+        while time.monotonic() < deadline[0]:
+            t0 = time.perf_counter()
+            for _ in range(args.burst):
+                await send(PROMPTS[(index + sent) % len(PROMPTS)])
+                sent += 1
+            if args.abandon_rate and rng.random() < args.abandon_rate:
+                # Irse sin leer (pestaña cerrada): las respuestas de esta ráfaga no las lee nadie
+                await asyncio.sleep(args.abandon_after_ms / 1000)
+                await close()
+                stats.abandoned += 1
+                try:
+                    recv, send, close = await asyncio.wait_for(opener(args), args.timeout_s)
+                except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                    stats.connect_errors += 1
+                    return
+                continue
+            try:
+                for i in range(replies):
+                    ttfb = await asyncio.wait_for(_read_reply(recv), args.timeout_s)
+                    stats.latencies.append(time.perf_counter() - t0)
+                    if i == 0:
+                        stats.ttfb.append(ttfb)
+                    stats.replies += 1
+            except (asyncio.TimeoutError, ConnectionError):
+                stats.errors += 1
+                break
+            stats.messages += args.burst
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000)
+    finally:
+        await close()
+
+async def _spawn(*cmd: str, env: dict, capture: bool = False) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "-m", *cmd, env=env,
+        stdout=asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+
+async def _stop(proc: asyncio.subprocess.Process | None, timeout: float = 30.0) -> None:
+    if proc is None or proc.returncode is not None:
+        return
+    proc.send_signal(signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+async def run(args) -> dict:
+    """Corre el escenario completo y devuelve el reporte."""
+    stub = await _spawn(
+        "bench.stub_llm", "--port", str(args.stub_port), "--latency-ms", str(args.latency_ms),
+        "--dist", args.dist, "--sigma", str(args.sigma), "--chunk-delay-ms", str(args.chunk_delay_ms),
+        "--fail-rate", str(args.fail_rate), "--fail-status", str(args.fail_status),
+        *(["--retry-after", str(args.retry_after)] if args.retry_after is not None else []),
+        "--seed", "1",
+        env=dict(os.environ), capture=True,
+    )
+    await stub.stdout.readline()  # "stub escuchando en ..."
+    env = {**APP_DEFAULTS, **os.environ}
+    env.update(
+        APP_HOST="127.0.0.1", APP_PORT=str(args.port), APP_MUX_PORT=str(args.port + 1),
+        LLM_URL=f"http://127.0.0.1:{args.stub_port}/v1/chat/completions", LLM_ENDPOINTS="",
+        LLM_STREAM=str(args.stream).lower(),
+        MAX_IN_FLIGHT=str(args.clients), PER_USER_MAX="1", QUEUE_MAX=str(args.clients),
+        PIPELINE_COALESCE_MS=str(args.coalesce_ms),
+        RATE_WINDOW_SECONDS="1", RATE_MAX_MESSAGES="1000000",
+        TCP_PORT=str(args.port), TCP_MUX_PORT=str(args.port + 1), MUX_LINKS=str(args.mux_links),
+        WS_HOST="127.0.0.1", WS_PORT=str(args.ws_port),
+    )
+    app = gateway = None
+    try:
+        app = await _spawn("app.server", "--workers", str(args.workers), env=env)
+        await asyncio.to_thread(_wait_port, args.port)
+        if args.workers > 1:
+            await asyncio.sleep(0.5 * args.workers)  # Dar tiempo a que todos los workers escuchen
+        if args.target == "ws":
+            gateway = await _spawn("gateway.ws_gateway", env=env)
+            await asyncio.to_thread(_wait_port, args.ws_port)
+
+        stats = _Stats()
+        start = asyncio.Event()
+        deadline = [0.0]
+        # Conectar a todos antes de medir: la apertura no cuenta en la latencia
+        clients = [asyncio.create_task(_client(i, args, stats, start, deadline)) for i in range(args.clients)]
+        await asyncio.sleep(min(args.timeout_s, 1.0 + args.clients / 500))
+        meters = {"app": ProcessMeter(app.pid).start(), "loadgen": ProcessMeter().start()}
+        if gateway is not None:
+            meters["gateway"] = ProcessMeter(gateway.pid).start()
+        t0 = time.perf_counter()
+        deadline[0] = time.monotonic() + args.duration_s
+        start.set()
+        await asyncio.gather(*clients)
+        wall = time.perf_counter() - t0
+        processes = {name: meter.stop() for name, meter in meters.items()}
+    finally:
+        await _stop(gateway)
+        await _stop(app)
+        await _stop(stub)
+    line = await stub.stdout.readline()
+    report = new_report("loadgen", vars(args))
+    stub_stats = json.loads(line) if line.startswith(b"{") else {}
+    # Respuestas completas del stub que ningún cliente leyó (cliente ido, pedido no cancelado)
+    answered = (stub_stats.get("requests", 0) - stub_stats.get("aborted", 0)
+                - stub_stats.get("failures", 0) - stub_stats.get("throttled", 0))
+    report["results"] = {
+        "messages": stats.messages,
+        "replies": stats.replies,
+        "abandoned_rounds": stats.abandoned,
+        "llm_calls": stub_stats.get("requests", 0),
+        "llm_wasted": max(0, answered - stats.replies) if stub_stats else 0,
+        "errors": stats.errors,
+        "connect_errors": stats.connect_errors,
+        "wall_s": round(wall, 3),
+        "throughput_msgs_s": round(stats.messages / wall, 1) if wall else 0.0,
+        "latency": summary(stats.latencies),
+        "ttfb": summary(stats.ttfb),
+    }
+    report["processes"] = processes
+    report["stub"] = stub_stats
+    return report
+
+def _print(report: dict) -> None:
+    res = report["results"]
+    lat, ttfb = res["latency"], res["ttfb"]
+    print(f"{report['params']['target']}: {report['params']['clients']} clientes, {res['wall_s']:.1f} s")
+    print(f"  mensajes={res['messages']}  errores={res['errors']}  sin conectar={res['connect_errors']}  "
+          f"{res['throughput_msgs_s']:.0f} msgs/s")
+    if res["abandoned_rounds"]:
+        print(f"  vueltas abandonadas={res['abandoned_rounds']}  llamadas al LLM={res['llm_calls']}  "
+              f"desperdiciadas={res['llm_wasted']}")
+    print(f"  latencia  p50={lat['p50_ms']:.1f} p95={lat['p95_ms']:.1f} p99={lat['p99_ms']:.1f} ms")
+    print(f"  1er byte  p50={ttfb['p50_ms']:.1f} p95={ttfb['p95_ms']:.1f} p99={ttfb['p99_ms']:.1f} ms")
+    for name, proc in report["processes"].items():
+        print(f"  {name:8s} cpu={proc['cpu_pct']:5.1f}%  rss={proc['rss_mb']:.1f} MB (pico {proc['rss_peak_mb']:.1f})")
+    if report["stub"]:
+        print("  stub     " + "  ".join(f"{k}={v}" for k, v in report["stub"].items()))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--target", choices=("tcp", "ws"), default="tcp")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration-s", type=float, default=10.0)
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pausa entre respuesta y próximo mensaje")
+    parser.add_argument("--timeout-s", type=float, default=30.0, help="plazo por respuesta")
+    parser.add_argument("--burst", type=int, default=1, help="mensajes seguidos por vuelta")
+    parser.add_argument("--coalesce-ms", type=float, default=0.0,
+                        help="PIPELINE_COALESCE_MS de la app (la ráfaga recibe una sola respuesta)")
+    parser.add_argument("--abandon-rate", type=float, default=0.0,
+                        help="fracción de vueltas en que el cliente se va sin leer y reconecta")
+    parser.add_argument("--abandon-after-ms", type=float, default=20.0, help="espera antes de irse")
+    parser.add_argument("--stream", action="store_true", help="LLM_STREAM=true (respuestas en fragmentos)")
+    parser.add_argument("--workers", type=int, default=1, help="procesos de app.server")
+    parser.add_argument("--mux-links", type=int, default=0, help="MUX_LINKS del gateway (0 = un socket por WS)")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="latencia media del stub")
+    parser.add_argument("--dist", choices=LATENCY_DISTS, default="lognormal")
+    parser.add_argument("--sigma", type=float, default=0.5, help="desvío del logaritmo (lognormal)")
+    parser.add_argument("--chunk-delay-ms", type=float, default=5.0, help="demora entre fragmentos SSE")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fracción de requests con falla")
+    parser.add_argument("--fail-status", type=int, default=503, help="status de las fallas (429/5xx)")
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--port", type=int, default=5080, help="APP_PORT (y APP_PORT+1 para mux)")
+    parser.add_argument("--ws-port", type=int, default=8780)
+    parser.add_argument("--stub-port", type=int, default=5089)
+    parser.add_argument("--out", default=None, help="reporte JSON (default: bench/results/loadgen-<target>-<commit>.json)")
+    parser.add_argument("--baseline", default=None, help="reporte JSON contra el que comparar")
+    args = parser.parse_args()
+
+    # Cada cliente es un socket (dos con el gateway en el medio)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, 4 * args.clients + 256)), hard))
+
+    report = asyncio.run(run(args))
+    _print(report)
+    out = args.out or f"bench/results/loadgen-{args.target}-{report['commit']}.json"
+    write_report(report, out)
+    print(f"reporte: {out}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print("\n".join(compare(report, json.load(f))))
+
+if __name__ == "__main__":
+    main()
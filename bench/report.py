@@ -0,0 +1,185 @@
+"""
+Reportes de benchmark en JSON para comparar entre commits.
+
+- `ProcessMeter`: CPU (segundos y % de un núcleo) y RSS de un proceso y sus hijos
+  (por ejemplo, el supervisor de `--workers` y sus workers), leídos de `/proc` (Linux).
+- `summary`: p50/p95/p99/max/media en ms de una lista de duraciones en segundos.
+- `new_report`/`write_report`: arma el JSON con commit, fecha, máquina y parámetros.
+- `compare`: diferencias relativas de las métricas numéricas contra otro reporte.
+
+Uso (comparar dos corridas):
+    python -m bench.report bench/results/nuevo.json --baseline bench/results/viejo.json
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros de línea de comandos
+import json  # Formato del reporte
+import os  # /proc, núcleos y rutas
+import platform  # Máquina e intérprete
+import resource  # CPU de este proceso
+import subprocess  # Commit actual
+import time  # Fecha y reloj de pared
+
+# Ticks de reloj por segundo de /proc/<pid>/stat
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+def _pct(sorted_samples: list[float], p: float) -> float:
+    """Percentil `p` (0-100) por rango más cercano de una lista ya ordenada."""
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * p / 100))]
+
+def summary(samples: list[float]) -> dict:
+    """
+    Resumen en milisegundos de duraciones en segundos.
+    """
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(_pct(ordered, 50) * 1000, 3),
+        "p95_ms": round(_pct(ordered, 95) * 1000, 3),
+        "p99_ms": round(_pct(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+    }
+
+def _tree(pid: int) -> list[int]:
+    """`pid` y todos sus descendientes vivos."""
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+def _cpu_seconds(pid: int) -> float:
+    """CPU de usuario + sistema consumida por `pid`."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # El nombre del comando puede tener espacios: los campos siguen tras el último ')'
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / _CLK_TCK
+
+def _status_kb(pid: int, key: str) -> int:
+    """Campo `key` (en kB) de /proc/<pid>/status."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+class ProcessMeter:
+    def __init__(self, pid: int | None = None):
+        """
+        Mide CPU y memoria de `pid` y sus hijos entre `start()` y `stop()`.
+
+        - `pid=None` mide este proceso (el generador de carga) con `getrusage`.
+        - La CPU de hijos que terminan durante la medición no se cuenta.
+        """
+        self.pid = pid
+        self._cpu0 = 0.0
+        self._wall0 = 0.0
+
+    def _cpu(self) -> float:
+        if self.pid is None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            return usage.ru_utime + usage.ru_stime
+        return sum(_cpu_seconds(pid) for pid in _tree(self.pid))
+
+    def start(self) -> "ProcessMeter":
+        self._cpu0 = self._cpu()
+        self._wall0 = time.perf_counter()
+        return self
+
+    def stop(self) -> dict:
+        """
+        CPU consumida (segundos y % de un núcleo) y RSS actual/pico en MB.
+        """
+        cpu = self._cpu() - self._cpu0
+        wall = time.perf_counter() - self._wall0
+        pids = _tree(self.pid) if self.pid is not None else [os.getpid()]
+        return {
+            "processes": len(pids),
+            "cpu_s": round(cpu, 3),
+            "cpu_pct": round(100 * cpu / wall, 1) if wall else 0.0,
+            "rss_mb": round(sum(_status_kb(pid, "VmRSS:") for pid in pids) / 1024, 1),
+            "rss_peak_mb": round(sum(_status_kb(pid, "VmHWM:") for pid in pids) / 1024, 1),
+        }
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+def new_report(bench: str, params: dict) -> dict:
+    """
+    Encabezado del reporte: benchmark, commit, fecha, máquina y parámetros.
+    """
+    return {
+        "bench": bench,
+        "commit": _git("rev-parse", "--short", "HEAD") or "desconocido",
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": params,
+    }
+
+def write_report(report: dict, path: str) -> None:
+    """Escribe `report` como JSON (crea el directorio si hace falta)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+def _numbers(data: dict, prefix: str = "") -> dict[str, float]:
+    """Aplana las métricas numéricas de `data` (sin parámetros) como `a.b.c → valor`."""
+    flat = {}
+    for key, value in data.items():
+        if key in ("params", "machine"):
+            continue
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_numbers(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = float(value)
+    return flat
+
+def compare(report: dict, baseline: dict) -> list[str]:
+    """
+    Líneas `métrica: antes → ahora (±%)` para las métricas presentes en ambos reportes.
+    """
+    now, before = _numbers(report), _numbers(baseline)
+    lines = [f"{baseline.get('commit', '?')} → {report.get('commit', '?')}"]
+    for key in sorted(now.keys() & before.keys()):
+        old, new = before[key], now[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        lines.append(f"  {key:40s} {old:12.3f} → {new:12.3f}  ({change})")
+    return lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara dos reportes JSON de benchmark")
+    parser.add_argument("report")
+    parser.add_argument("--baseline", required=True)
+    args = parser.parse_args()
+    with open(args.report, encoding="utf-8") as f:
+        current = json.load(f)
+    with open(args.baseline, encoding="utf-8") as f:
+        base = json.load(f)
+    if current.get("params") != base.get("params"):
+        print("aviso: los parámetros de las corridas no coinciden")
+    print("\n".join(compare(current, base)))
@@ -0,0 +1,284 @@
+"""
+Servidor stub OpenAI-compatible para benchmarks locales.
+
+- Implementa un HTTP/1.1 mínimo sobre asyncio con keep-alive.
+- Responde a cualquier POST con un `chat.completion` fijo tras una latencia configurable.
+- Si el request pide `"stream": true`, responde SSE (`chat.completion.chunk`) palabra por palabra.
+- Cuenta conexiones aceptadas para comparar el efecto del pool de conexiones, y los
+  requests abandonados (el cliente cerró la conexión antes de la respuesta).
+- Inyección de fallas: una fracción de requests responde `fail_status` (429/5xx,
+  con `Retry-After` opcional) y otra fracción tarda `slow_latency_s` (cola lenta).
+- Cuota opcional (`rate_limit` requests por `rate_window_s`): informa
+  `x-ratelimit-remaining-requests` / `x-ratelimit-reset-requests` y responde 429 al excederla.
+- Latencia fija o con distribución (`latency_dist`: exponencial o lognormal con media `latency_s`).
+- También corre como proceso aparte (`python -m bench.stub_llm --port 5091 ...`); al recibir
+  SIGTERM/SIGINT imprime sus contadores como una línea JSON.
+"""
+
+# Importaciones necesarias
+import argparse  # Parámetros del modo proceso
+import asyncio  # Servidor TCP asíncrono
+import json  # Serializar respuestas
+import math  # Parámetros de la lognormal
+import random  # Inyección de fallas y latencias aleatorias
+import signal  # Apagado del modo proceso
+import time  # Ventana de la cuota
+
+# Distribuciones de latencia admitidas
+LATENCY_DISTS = ("fixed", "exp", "lognormal")
+
+class StubLLM:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_s: float = 0.0,
+                 reply: str = "Hola, estoy para escucharte.", chunk_delay_s: float = 0.0,
+                 fail_rate: float = 0.0, fail_status: int = 503, retry_after: float | None = None,
+                 slow_rate: float = 0.0, slow_latency_s: float = 0.0, seed: int | None = None,
+                 rate_limit: int = 0, rate_window_s: float = 1.0,
+                 latency_dist: str = "fixed", latency_sigma: float = 0.5):
+        """
+        Inicializa el stub.
+
+        - `port=0` elige un puerto libre (ver `url` tras `start()`).
+        - `latency_s`: demora simulada del modelo antes de responder (la media si hay distribución).
+        - `latency_dist`: "fixed", "exp" (exponencial) o "lognormal" (con desvío `latency_sigma`
+          del logaritmo: 0.5 da una cola p99 de ~3× la media).
+        - `chunk_delay_s`: demora entre eventos SSE en modo streaming.
+        - `fail_rate`: fracción de requests que responden `fail_status` (se puede
+          cambiar en caliente para simular una caída parcial del proveedor).
+        - `retry_after`: valor del header `Retry-After` en las fallas (None = sin header).
+        - `slow_rate`/`slow_latency_s`: fracción de requests con latencia de cola.
+        - `rate_limit`: requests permitidos por ventana de `rate_window_s` (0 = sin cuota).
+        """
+        self.host = host
+        self.port = port
+        self.latency_s = latency_s
+        self.reply = reply
+        self.chunk_delay_s = chunk_delay_s
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_latency_s = slow_latency_s
+        self._rng = random.Random(seed)
+        self.rate_limit = rate_limit
+        self.rate_window_s = rate_window_s
+        if latency_dist not in LATENCY_DISTS:
+            raise ValueError(f"latency_dist debe ser uno de {LATENCY_DISTS}")
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self._window_start = 0.0
+        self._window_used = 0
+        self.failures = 0  # Respuestas de error inyectadas
+        self.throttled = 0  # Respuestas 429 por cuota excedida
+        self.connections = 0  # Conexiones TCP aceptadas
+        self.requests = 0  # Requests atendidos
+        self.aborted = 0  # Requests cuyo cliente cortó durante la latencia (pedido cancelado)
+        self.last_body = b""  # Cuerpo crudo del último request (para inspeccionar `messages`)
+        self._server: asyncio.AbstractServer | None = None
+
+    @property
+    def url(self) -> str:
+        """URL del endpoint de chat completions del stub."""
+        return f"http://{self.host}:{self.port}/v1/chat/completions"
+
+    async def start(self) -> "StubLLM":
+        """Empieza a escuchar y actualiza `port` con el puerto real."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        """Deja de escuchar y cierra el servidor."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> "StubLLM":
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    def stats(self) -> dict:
+        """Contadores del stub."""
+        return {
+            "connections": self.connections, "requests": self.requests,
+            "failures": self.failures, "throttled": self.throttled, "aborted": self.aborted,
+        }
+
+    def _delay(self) -> float:
+        """
+        Latencia del próximo request según `latency_dist` (o la de cola con `slow_rate`).
+        """
+        if self.slow_rate and self._rng.random() < self.slow_rate:
+            return self.slow_latency_s
+        if not self.latency_s or self.latency_dist == "fixed":
+            return self.latency_s
+        if self.latency_dist == "exp":
+            return self._rng.expovariate(1 / self.latency_s)
+        # Lognormal con media `latency_s`: mu = ln(media) - sigma²/2
+        mu = math.log(self.latency_s) - self.latency_sigma ** 2 / 2
+        return self._rng.lognormvariate(mu, self.latency_sigma)
+
+    def _completion(self) -> bytes:
+        """Cuerpo JSON de una respuesta `chat.completion`."""
+        return json.dumps({
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.reply}}],
+        }).encode("utf-8")
+
+    async def _stream(self, writer: asyncio.StreamWriter, extra: bytes = b"") -> None:
+        """
+        Envía la respuesta como eventos SSE con `Transfer-Encoding: chunked`.
+        """
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n" + extra +
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            delta = word if i == 0 else " " + word
+            event = json.dumps({
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": delta}}],
+            })
+            self._write_chunk(writer, f"data: {event}\n\n".encode("utf-8"))
+            await writer.drain()
+            if self.chunk_delay_s:
+                await asyncio.sleep(self.chunk_delay_s)
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _quota(self) -> tuple[bytes, bool]:
+        """
+        Consume la cuota: devuelve los headers `x-ratelimit-*` y si el request excede.
+        """
+        if not self.rate_limit:
+            return b"", False
+        now = time.monotonic()
+        if now - self._window_start >= self.rate_window_s:
+            self._window_start = now
+            self._window_used = 0
+        self._window_used += 1
+        reset = self._window_start + self.rate_window_s - now
+        remaining = max(0, self.rate_limit - self._window_used)
+        headers = (
+            f"x-ratelimit-limit-requests: {self.rate_limit}\r\n"
+            f"x-ratelimit-remaining-requests: {remaining}\r\n"
+            f"x-ratelimit-reset-requests: {reset:.3f}s\r\n"
+        ).encode("ascii")
+        return headers, self._window_used > self.rate_limit
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+        """Escribe un bloque con framing HTTP chunked."""
+        writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Atiende requests HTTP/1.1 en una conexión hasta que el cliente la cierre.
+        """
+        self.connections += 1
+        try:
+            while True:
+                # Línea de request + headers
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                keep_alive = True
+                for line in head.split(b"\r\n")[1:]:
+                    name, _, value = line.partition(b":")
+                    name = name.strip().lower()
+                    if name == b"content-length":
+                        length = int(value.strip())
+                    elif name == b"connection" and value.strip().lower() == b"close":
+                        keep_alive = False
+                body = await reader.readexactly(length) if length else b""
+                self.requests += 1
+                self.last_body = body
+
+                delay = self._delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                    if reader.at_eof():
+                        # El cliente canceló el pedido mientras "generábamos"
+                        self.aborted += 1
+                        break
+
+                quota, exceeded = self._quota()
+                if exceeded:
+                    # Cuota excedida: 429 con el tiempo hasta la próxima ventana
+                    self.throttled += 1
+                    retry = self._window_start + self.rate_window_s - time.monotonic()
+                    writer.write(
+                        b"HTTP/1.1 429 Too Many Requests\r\n" + quota
+                        + f"Retry-After: {max(0.0, retry):.3f}\r\nContent-Length: 0\r\n\r\n".encode("ascii")
+                    )
+                    await writer.drain()
+                    continue
+
+                if self.fail_rate and self._rng.random() < self.fail_rate:
+                    # Falla inyectada: 429/5xx sin cuerpo útil
+                    self.failures += 1
+                    retry = f"Retry-After: {self.retry_after:g}\r\n" if self.retry_after is not None else ""
+                    writer.write(
+                        f"HTTP/1.1 {self.fail_status} Error\r\n{retry}"
+                        "Content-Length: 0\r\n\r\n".encode("ascii")
+                    )
+                    await writer.drain()
+                    continue
+
+                if b'"stream": true' in body or b'"stream":true' in body:
+                    await self._stream(writer, quota)
+                    if not keep_alive:
+                        break
+                    continue
+
+                body = self._completion()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n" + quota
+                    + b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n".encode("ascii")
+                    + (b"Connection: keep-alive\r\n\r\n" if keep_alive else b"Connection: close\r\n\r\n")
+                    + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def _serve_forever(stub: StubLLM) -> None:
+    """Corre `stub` hasta SIGTERM/SIGINT e imprime sus contadores."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    async with stub:
+        print(f"stub escuchando en {stub.url}", flush=True)
+        await stop.wait()
+    print(json.dumps(stub.stats()), flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible para benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5091)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latencia (media si hay distribución)")
+    parser.add_argument("--dist", choices=LATENCY_DISTS, default="fixed", help="distribución de la latencia")
+    parser.add_argument("--sigma", type=float, default=0.5, help="desvío del logaritmo (lognormal)")
+    parser.add_argument("--chunk-delay-ms", type=float, default=0.0, help="demora entre eventos SSE")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fracción de requests con falla")
+    parser.add_argument("--fail-status", type=int, default=503, help="status de las fallas (429/5xx)")
+    parser.add_argument("--retry-after", type=float, default=None, help="header Retry-After de las fallas")
+    parser.add_argument("--rate-limit", type=int, default=0, help="cuota de requests por segundo (0 = sin cuota)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(_serve_forever(StubLLM(
+        host=args.host, port=args.port, latency_s=args.latency_ms / 1000,
+        latency_dist=args.dist, latency_sigma=args.sigma, chunk_delay_s=args.chunk_delay_ms / 1000,
+        fail_rate=args.fail_rate, fail_status=args.fail_status, retry_after=args.retry_after,
+        rate_limit=args.rate_limit, seed=args.seed,
+    )))
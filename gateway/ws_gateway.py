@@ -1,14 +1,46 @@
 import os
 import asyncio
+import logging
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
 import websockets
+from websockets.asyncio.server import ServerConnection
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 from app.config import settings
+from app.protocol import CONTROL, STREAM_CHUNK, STREAM_END, decode_chunk, encode_control, parse_control
+from app.mux import MuxPool
+from app.utils import metrics
+from app.utils.diagnostics import Diagnostics
 
 """
 Gateway WebSocket ↔ TCP:
 - Por CADA conexión WebSocket del navegador, se abre UNA conexión TCP propia hacia el server 'app'.
 - Mapeo 1:1 (WS cliente) ↔ (TCP cliente) garantiza que sesiones no se mezclen.
+- Con MUX_LINKS>0, en vez de un socket por WS se abre una SESIÓN multiplexada sobre
+  pocos links persistentes (ver `app.mux`): mismo protocolo de líneas por sesión,
+  con ventana y créditos propios, así 10k pestañas no son 10k sockets en la app.
 - Concurrencia por I/O: websockets.serve() agenda una coroutine por WS; asyncio.open_connection() usa sockets no bloqueantes.
 - En Docker, TCP_HOST='app' cablea el socket interno gateway->app por la red del compose.
+- Streaming: cada línea `\x02<json>` se reenvía como un frame WS `\x02<delta>` y `\x03` como fin.
+  Los deltas que llegan juntos (y los que se acumulan mientras el navegador lee) van en un
+  solo frame: el navegador los concatena igual.
+- Cola de envío acotada por WS (GATEWAY_SEND_QUEUE_BYTES): con un navegador lento,
+  GATEWAY_SLOW_POLICY decide si se deja de leer de la app (`block`, contrapresión hasta el
+  LLM), se descarta el resto de la respuesta en streaming que no entra (`drop`: sólo
+  deltas, con un aviso de corte antes del fin; las respuestas completas esperan lugar) o
+  se cierra el WS (`close`, 1013).
+- permessage-deflate configurable (GATEWAY_COMPRESSION, GATEWAY_DEFLATE_LEVEL,
+  GATEWAY_DEFLATE_WINDOW_BITS): menos ancho de banda a cambio de CPU y ~memoria por conexión.
+- Sesiones reanudables: el navegador conecta con `?session=<token>`; el gateway lo pasa a la app
+  (`\x01resume <token>`) y reenvía el token asignado como frame WS `\x01<token>`.
+- `?prompt=<nombre>` elige el system prompt de la conversación (`\x01prompt <nombre>`).
+- Con GATEWAY_METRICS_PORT, expone métricas de Prometheus (conexiones, frames y bytes por
+  dirección) en `http://METRICS_HOST:GATEWAY_METRICS_PORT/metrics`, y `/ready` (200 cuando
+  ya acepta WebSockets).
+- Arranque liviano: `app.config` sólo usa la biblioteca estándar (sin pydantic ni httpx).
+- Con DIAG_ENABLED=true, mide el lag del event loop, loguea los bloqueos con su stack y escribe
+  un perfil `.folded` con `kill -USR1 <pid>` (ver `app.utils.diagnostics`).
 """
 
 # --- Configuración de red con valores predeterminados ---
@@ -17,37 +49,253 @@ Gateway WebSocket ↔ TCP:
 # WS_HOST: Dirección en la que el gateway escuchará conexiones WebSocket.
 # WS_PORT: Puerto en el que el gateway escuchará conexiones WebSocket.
 TCP_HOST = os.getenv("TCP_HOST", "127.0.0.1")                 # En Docker usarás 'app'
-TCP_PORT = int(os.getenv("TCP_PORT", settings.APP_PORT))      # 5001 por defecto
+TCP_PORT = int(os.getenv("TCP_PORT", settings.APP_PORT or 5001))  # 5001 por defecto
 WS_HOST  = os.getenv("WS_HOST", "0.0.0.0")
 WS_PORT  = int(os.getenv("WS_PORT", "8765"))
+# MUX_LINKS: links TCP multiplexados hacia TCP_MUX_PORT (0 = una conexión por WS).
+MUX_LINKS = int(os.getenv("MUX_LINKS", "0"))
+TCP_MUX_PORT = int(os.getenv("TCP_MUX_PORT", settings.APP_MUX_PORT or 5002))
+MUX_WINDOW = int(os.getenv("MUX_WINDOW_BYTES", settings.MUX_WINDOW_BYTES or 64 * 1024))
 
-async def bridge_ws_to_tcp(websocket: websockets.WebSocketServerProtocol):
+# GATEWAY_SEND_QUEUE_BYTES: bytes pendientes hacia cada navegador (además del buffer de websockets).
+# GATEWAY_SLOW_POLICY: con la cola llena, "block" (dejar de leer de la app), "drop" (cortar el
+# streaming en curso) o "close".
+SEND_QUEUE_BYTES = int(os.getenv("GATEWAY_SEND_QUEUE_BYTES", "") or 16 * 1024)
+SLOW_POLICY = (os.getenv("GATEWAY_SLOW_POLICY", "") or "block").strip().lower()
+# Delta que cierra una respuesta en streaming cortada por la política "drop"
+TRUNCATED_NOTICE = " […]\n(Respuesta incompleta: la conexión está lenta.)"
+# GATEWAY_COMPRESSION: "deflate" (permessage-deflate) o "none"; nivel zlib (1-9) y ventana (9-15 bits).
+COMPRESSION = (os.getenv("GATEWAY_COMPRESSION", "") or "deflate").strip().lower()
+DEFLATE_LEVEL = int(os.getenv("GATEWAY_DEFLATE_LEVEL", "") or 6)
+DEFLATE_WINDOW_BITS = int(os.getenv("GATEWAY_DEFLATE_WINDOW_BITS", "") or 12)
+
+# GATEWAY_METRICS_PORT: puerto del endpoint /metrics del gateway (0 = deshabilitado).
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("GATEWAY_METRICS_PORT", "0") or 0)
+# DIAG_*: diagnóstico del event loop (mismas variables que la app).
+DIAG_ENABLED = os.getenv("DIAG_ENABLED", "").strip().lower() in ("1", "true", "yes")
+
+# Prefijos de línea reservados al protocolo gateway ↔ app (nunca vienen del navegador)
+_PROTOCOL_PREFIXES = CONTROL + STREAM_CHUNK + STREAM_END
+
+# Tope de un frame de deltas unidos: mientras `send()` espera a un navegador lento, el frame
+# vive codificado y copiado en el buffer de websockets (cuanto más grande, más memoria por WS)
+MERGE_MAX_CHARS = 4096
+# Memoria de un frame encolado además de su texto (objeto str y lugar en el deque): los deltas
+# son de pocos caracteres, así que el tope de la cola se cuenta en memoria y no sólo en texto
+_FRAME_OVERHEAD = 64
+
+# Referencia del tiempo de arranque (importación de este módulo)
+_T0 = time.perf_counter()
+
+# Pool de links (se crea dentro del event loop, en `main`)
+_mux_pool: MuxPool | None = None
+
+# --- Métricas (contadores en memoria; se formatean sólo al scrapear) ---
+_CONNECTIONS = metrics.gauge("psicoia_gateway_connections_active", "WebSockets abiertos")
+_CONNECT_ERRORS = metrics.counter("psicoia_gateway_connect_errors_total", "Fallas al conectar con la app")
+_FRAMES = metrics.counter("psicoia_gateway_frames_total", "Mensajes reenviados por dirección", ("direction",))
+_BYTES = metrics.counter("psicoia_gateway_bytes_total", "Bytes reenviados por dirección", ("direction",))
+_FRAMES_IN, _FRAMES_OUT = _FRAMES.labels("ws_to_tcp"), _FRAMES.labels("tcp_to_ws")
+_BYTES_IN, _BYTES_OUT = _BYTES.labels("ws_to_tcp"), _BYTES.labels("tcp_to_ws")
+_COALESCED = metrics.counter("psicoia_gateway_chunks_coalesced_total", "Deltas de streaming unidos al frame anterior")
+_DROPPED = metrics.counter("psicoia_gateway_frames_dropped_total",
+                           "Deltas de streaming descartados por cola llena (política drop)")
+_SLOW_CLOSED = metrics.counter("psicoia_gateway_slow_closed_total", "WebSockets cerrados por cola llena (política close)")
+_QUEUED = metrics.gauge("psicoia_gateway_send_queue_bytes", "Bytes esperando para salir hacia los navegadores")
+metrics.gauge("psicoia_gateway_mux_links", "Links multiplexados abiertos hacia la app",
+              fn=lambda: _mux_pool.stats()["links"] if _mux_pool is not None else 0)
+
+def _query_param(websocket, name: str) -> str:
+    """
+    Parámetro `name` de la URL del navegador (`?session=...`, `?prompt=...`), o "".
+    """
+    request = getattr(websocket, "request", None)
+    path = request.path if request is not None else getattr(websocket, "path", "")
+    return parse_qs(urlsplit(path or "").query).get(name, [""])[0]
+
+def _client_data(message: str | bytes) -> bytes:
+    """
+    Mensaje del navegador como líneas de chat para la app, sin dejar pasar el protocolo.
+
+    - Cada salto de línea embebido es una línea aparte (como antes, cuando llegaban tal cual).
+    - Se quitan los prefijos `\x01`/`\x02`/`\x03` al comienzo de cada línea: la app trata
+      `\x01...` como control del gateway (IP real, prompt, sesión) y un navegador no debe
+      poder enviarlo.
+    """
+    if isinstance(message, bytes):
+        message = message.decode("utf-8", "replace")
+    lines = [line.strip().lstrip(_PROTOCOL_PREFIXES).strip() for line in message.splitlines()] or [""]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+class _SendQueue:
+    """
+    Frames pendientes hacia un navegador, acotados en memoria (texto + `_FRAME_OVERHEAD` por frame).
+
+    - `put()` (lector de la app) aplica `SLOW_POLICY` cuando el frame no entra; un frame
+      solo siempre entra, aunque supere el tope.
+    - `drop` sólo descarta deltas de streaming: desde el primero que no entra se corta el
+      resto de esa respuesta (sin huecos en el medio del texto) y antes de su fin se envía
+      `TRUNCATED_NOTICE`. Las respuestas completas (sin streaming, saludo) esperan lugar
+      como con `block`; el fin de stream y las líneas de control siempre entran.
+    - `take()` (emisor al WS) se lleva todo lo pendiente y une los deltas de streaming
+      consecutivos en frames de hasta `MERGE_MAX_CHARS`; lo que tiene en mano sigue
+      contando hasta `sent()`.
+      Por conexión quedan a lo sumo `limit` (más un frame) acá y el buffer de escritura de
+      websockets (32 KiB).
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.frames: deque[str] = deque()
+        self.size = 0  # Memoria aproximada de `frames` y de lo que está en mano del emisor
+        self._taken = 0  # Parte de `size` del último `take()` todavía sin enviar
+        self.eof = False  # La app cerró: no llegan más frames
+        self.stopped = False  # El emisor terminó (WS cerrado): no se aceptan más
+        self.slow = False  # Se excedió la cola con la política `close`
+        self.truncated = False  # Con `drop`, la respuesta en streaming en curso perdió deltas
+        self._ready = asyncio.Event()  # Hay frames, o `eof`
+        self._room = asyncio.Event()  # Se liberó espacio, o `stopped`
+
+    async def put(self, frame: str) -> bool:
+        """
+        Encola `frame`; False si hay que dejar de leer de la app (WS cerrado o lento).
+        """
+        if self.truncated and frame.startswith(STREAM_CHUNK):
+            _DROPPED.inc()  # Respuesta ya cortada: se descarta hasta su fin
+            return True
+        cost = len(frame) + _FRAME_OVERHEAD
+        while self.frames and self.size + cost > self.limit and not self.stopped:
+            if SLOW_POLICY == "drop":
+                if frame.startswith(STREAM_CHUNK):
+                    self.truncated = True
+                    _DROPPED.inc()
+                    return True
+                if frame == STREAM_END or frame.startswith(CONTROL):
+                    break  # Marcas de protocolo (un byte o el token): siempre entran
+                # Respuesta completa: nunca se descarta, espera lugar como con "block"
+            elif SLOW_POLICY == "close":
+                _SLOW_CLOSED.inc()
+                self.slow = True
+                return False
+            # "block": esperar a que el emisor se lleve lo pendiente (contrapresión hacia la app)
+            self._room.clear()
+            await self._room.wait()
+        if self.stopped:
+            return False
+        if frame == STREAM_END and self.truncated:
+            # Avisar al navegador que la respuesta llegó incompleta
+            self.truncated = False
+            self._append(STREAM_CHUNK + TRUNCATED_NOTICE)
+        self._append(frame)
+        return True
+
+    def _append(self, frame: str) -> None:
+        cost = len(frame) + _FRAME_OVERHEAD
+        self.frames.append(frame)
+        self.size += cost
+        _QUEUED.inc(cost)
+        self._ready.set()
+
+    async def take(self) -> list[str] | None:
+        """
+        Frames para enviar (deltas consecutivos unidos), o None con la app cerrada y nada pendiente.
+        """
+        while not self.frames:
+            if self.eof:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        out: list[str] = []
+        deltas: list[str] = []
+        merged = 0
+        for frame in self.frames:
+            if frame.startswith(STREAM_CHUNK) and merged + len(frame) <= MERGE_MAX_CHARS:
+                deltas.append(frame[1:])
+                merged += len(frame)
+                continue
+            if deltas:
+                out.append(STREAM_CHUNK + "".join(deltas))
+                deltas, merged = [], 0
+            if frame.startswith(STREAM_CHUNK):
+                deltas.append(frame[1:])
+                merged = len(frame)
+            else:
+                out.append(frame)
+        if deltas:
+            out.append(STREAM_CHUNK + "".join(deltas))
+        _COALESCED.inc(len(self.frames) - len(out))
+        self.frames.clear()
+        self._taken = self.size
+        return out
+
+    def sent(self) -> None:
+        """El emisor terminó de enviar lo del último `take()`: libera ese espacio."""
+        _QUEUED.dec(self._taken)
+        self.size -= self._taken
+        self._taken = 0
+        self._room.set()
+
+    def close(self) -> None:
+        """La app cerró: el emisor envía lo pendiente y termina."""
+        self.eof = True
+        self._ready.set()
+
+    def stop(self) -> None:
+        """El WS se cerró: descartar lo pendiente y liberar al lector."""
+        self.stopped = True
+        _QUEUED.dec(self.size)
+        self.frames.clear()
+        self.size = 0
+        self._room.set()
+
+async def bridge_ws_to_tcp(websocket: ServerConnection):
     """
     Establece un puente entre una conexión WebSocket y una conexión TCP.
 
-    - Por cada cliente WebSocket, se abre una conexión TCP hacia el servidor.
-    - Los mensajes del cliente WS se envían al servidor TCP y viceversa.
+    - Por cada cliente WebSocket, se abre una conexión TCP hacia el servidor
+      (o una sesión sobre un link multiplexado si MUX_LINKS>0).
+    - Los mensajes del cliente WS se envían al servidor TCP y viceversa (hacia el
+      navegador, a través de una cola acotada y una tarea emisora).
     - Maneja errores de conexión y asegura el cierre adecuado de sockets.
     """
     try:
         # Intentar abrir una conexión TCP al servidor especificado
-        reader, writer = await asyncio.open_connection(TCP_HOST, TCP_PORT)
+        if _mux_pool is not None:
+            reader, writer = await _mux_pool.open_stream()
+        else:
+            reader, writer = await asyncio.open_connection(TCP_HOST, TCP_PORT)
     except Exception as e:
         # Enviar un mensaje de error al cliente WebSocket si falla la conexión TCP
-        await websocket.send(f"[gateway] No pude conectar al TCP {TCP_HOST}:{TCP_PORT}: {e}")
+        _CONNECT_ERRORS.inc()
+        port = TCP_MUX_PORT if _mux_pool is not None else TCP_PORT
+        await websocket.send(f"[gateway] No pude conectar al TCP {TCP_HOST}:{port}: {e}")
         await websocket.close()
         return
 
+    # IP real del navegador (para el límite de tasa por IP en la app)
+    remote = getattr(websocket, "remote_address", None)
+    if remote:
+        writer.write(encode_control("peer", str(remote[0])))
+    # System prompt pedido (nombre de módulo: nunca espacios ni saltos de línea)
+    prompt = _query_param(websocket, "prompt")
+    if prompt.isidentifier():
+        writer.write(encode_control("prompt", prompt))
+    # Retomar la conversación del navegador (o pedir una nueva)
+    writer.write(encode_control("resume", _query_param(websocket, "session")))
+
     async def ws_reader():
         """
         Lee mensajes del cliente WebSocket y los envía al servidor TCP.
 
-        - Escribe cada mensaje recibido en el socket TCP.
+        - Escribe cada mensaje recibido en el socket TCP (saneado con `_client_data`).
         - Maneja errores y asegura el cierre del escritor TCP.
         """
         try:
             async for message in websocket:
-                writer.write((message.strip() + "\n").encode("utf-8"))
+                data = _client_data(message)
+                _FRAMES_IN.inc()
+                _BYTES_IN.inc(len(data))
+                writer.write(data)
                 await writer.drain()  # Asegurar que el mensaje se envíe completamente
         except Exception as e:
             # Manejo de errores en la conexión WebSocket
@@ -59,29 +307,101 @@ async def bridge_ws_to_tcp(websocket: websockets.WebSocketServerProtocol):
             except Exception:
                 pass
 
+    queue = _SendQueue(SEND_QUEUE_BYTES)
+
     async def tcp_reader():
         """
-        Lee mensajes del servidor TCP y los envía al cliente WebSocket.
+        Lee mensajes del servidor TCP y los encola como frames para el cliente WebSocket.
 
-        - Procesa cada línea recibida del servidor TCP.
-        - Maneja errores y asegura el cierre del cliente WebSocket.
+        - Procesa cada línea recibida del servidor TCP (las que ya están en el buffer, sin
+          esperar al envío de las anteriores).
+        - Con la cola llena aplica `SLOW_POLICY`.
         """
         try:
             while not reader.at_eof():
                 line = await reader.readline()
                 if not line:
                     break
-                await websocket.send(line.decode("utf-8"))  # Enviar línea al cliente WS
+                _BYTES_OUT.inc(len(line))
+                text = line.decode("utf-8")
+                if text.startswith(STREAM_CHUNK):
+                    # Delta de streaming: el frame WS lleva el delta (sin el JSON)
+                    frame = STREAM_CHUNK + decode_chunk(text.rstrip("\n"))
+                elif text.startswith(STREAM_END):
+                    frame = STREAM_END
+                elif text.startswith(CONTROL):
+                    # Token de la conversación: el navegador lo guarda para reconectar
+                    command, arg = parse_control(text)
+                    if command != "session":
+                        continue
+                    frame = CONTROL + arg
+                else:
+                    frame = text  # Línea tal cual para el cliente WS
+                if not await queue.put(frame):
+                    break
         except Exception:
             pass
         finally:
+            queue.close()
+        if queue.slow:
+            # Navegador que no lee: soltar ya la app (ve EOF y cancela lo pendiente) y lo
+            # encolado; el cierre del WS espera al navegador a lo sumo `close_timeout`
+            queue.stop()
+            writer.close()
+            try:
+                await websocket.close(1013, "cliente lento")
+            except Exception:
+                pass
+
+    async def ws_sender():
+        """
+        Envía al cliente WebSocket los frames encolados y lo cierra cuando la app termina.
+        """
+        try:
+            while (frames := await queue.take()) is not None:
+                for frame in frames:
+                    _FRAMES_OUT.inc()
+                    await websocket.send(frame)
+                queue.sent()
+        except Exception:
+            pass
+        finally:
+            queue.stop()
             try:
                 await websocket.close()  # Cerrar el cliente WebSocket
             except Exception:
                 pass
 
     # Ejecutar las tareas de lectura/escritura de WebSocket y TCP en paralelo
-    await asyncio.gather(ws_reader(), tcp_reader())
+    _CONNECTIONS.inc()
+    try:
+        await asyncio.gather(ws_reader(), tcp_reader(), ws_sender())
+    finally:
+        _CONNECTIONS.dec()
+
+def _compression_options() -> dict:
+    """
+    Argumentos de `websockets.serve` para GATEWAY_COMPRESSION.
+
+    - "deflate": permessage-deflate con el nivel y la ventana configurados (la ventana y
+      `memLevel` acotan la memoria de zlib por conexión; el default de websockets usa 2^12).
+    - "none": sin compresión (menos CPU, más bytes en la red).
+    """
+    if COMPRESSION == "none":
+        return {"compression": None}
+    return {
+        "compression": None,
+        "extensions": [ServerPerMessageDeflateFactory(
+            server_max_window_bits=DEFLATE_WINDOW_BITS,
+            client_max_window_bits=DEFLATE_WINDOW_BITS,
+            compress_settings={"level": DEFLATE_LEVEL, "memLevel": 5},
+        )],
+    }
+
+def _compression_label() -> str:
+    if COMPRESSION == "none":
+        return "deshabilitada"
+    return f"permessage-deflate (nivel {DEFLATE_LEVEL}, ventana 2^{DEFLATE_WINDOW_BITS})"
 
 async def main():
     """
@@ -90,8 +410,37 @@ async def main():
     - Escucha conexiones WebSocket en la dirección y puerto configurados.
     - Por cada conexión WebSocket, se crea una tarea para manejar el puente.
     """
-    print(f"[gateway] WS escuchando en ws://{WS_HOST}:{WS_PORT}  ->  TCP {TCP_HOST}:{TCP_PORT}")
-    async with websockets.serve(bridge_ws_to_tcp, WS_HOST, WS_PORT, ping_interval=20, ping_timeout=20):
+    global _mux_pool, SLOW_POLICY, COMPRESSION
+    if COMPRESSION not in ("deflate", "none"):
+        print(f"[gateway] GATEWAY_COMPRESSION desconocida: {COMPRESSION!r}; uso 'deflate'")
+        COMPRESSION = "deflate"
+    if SLOW_POLICY not in ("block", "drop", "close"):
+        print(f"[gateway] GATEWAY_SLOW_POLICY desconocida: {SLOW_POLICY!r}; uso 'block'")
+        SLOW_POLICY = "block"
+    if DIAG_ENABLED:
+        # Los avisos del diagnóstico van por logging (el resto del gateway usa print)
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+        Diagnostics(
+            name="gateway",
+            lag_interval=float(os.getenv("DIAG_LAG_INTERVAL_MS") or 100) / 1000,
+            slow_callback=float(os.getenv("DIAG_SLOW_CALLBACK_MS") or 100) / 1000,
+            profile_seconds=float(os.getenv("DIAG_PROFILE_SECONDS") or 10),
+            profile_dir=os.getenv("DIAG_PROFILE_DIR") or "data/profiles",
+        ).start()
+    if METRICS_PORT:
+        await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+        print(f"[gateway] Métricas en http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    if MUX_LINKS > 0:
+        _mux_pool = MuxPool(TCP_HOST, TCP_MUX_PORT, MUX_LINKS, window=MUX_WINDOW)
+        print(f"[gateway] WS escuchando en ws://{WS_HOST}:{WS_PORT}  ->  TCP mux {TCP_HOST}:{TCP_MUX_PORT} ({MUX_LINKS} links)")
+    else:
+        print(f"[gateway] WS escuchando en ws://{WS_HOST}:{WS_PORT}  ->  TCP {TCP_HOST}:{TCP_PORT}")
+    print(f"[gateway] Cola de envío {SEND_QUEUE_BYTES} bytes por WS (política {SLOW_POLICY}), "
+          f"compresión {_compression_label()}")
+    async with websockets.serve(bridge_ws_to_tcp, WS_HOST, WS_PORT, ping_interval=20, ping_timeout=20,
+                                **_compression_options()):
+        metrics.set_ready(True)
+        print(f"[gateway] Listo en {(time.perf_counter() - _T0) * 1000:.0f} ms")
         await asyncio.Future()  # Mantener el servidor corriendo indefinidamente
 
 if __name__ == "__main__":